@@ -8,7 +8,9 @@ https://docs.djangoproject.com/en/3.0/topics/settings/
 For the full list of settings and their values, see
 https://docs.djangoproject.com/en/3.0/ref/settings/
 """
+
 import os
+import sys
 
 import dotenv
 
@@ -45,6 +47,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    "src.middleware.RequestTimingMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
@@ -119,3 +122,38 @@ USE_TZ = True
 # https://docs.djangoproject.com/en/3.0/howto/static-files/
 
 STATIC_URL = "/static/"
+
+# Generated reports (see src.jobs) are stored here and served through the admin.
+MEDIA_ROOT = os.path.join(BASE_DIR, "media")
+
+# Processes used to render the receipts of a bulk receipt job.
+RECEIPT_RENDER_WORKERS = int(os.environ.get("RECEIPT_RENDER_WORKERS", 1))
+
+# Processes computing the rows of a dues list job, one customer id range each.
+DUES_LIST_WORKERS = int(os.environ.get("DUES_LIST_WORKERS", 1))
+
+# Accounts inserted per query when several are added for a customer at once.
+ACCOUNT_BULK_CREATE_BATCH_SIZE = int(os.environ.get("ACCOUNT_BULK_CREATE_BATCH_SIZE", 500))
+
+# Customers per page of the bulk deposit page. A customer with an account and a loan posts
+# nine fields, and a page has to stay under Django's limit of 1000 fields per request.
+BULK_DEPOSIT_PAGE_SIZE = int(os.environ.get("BULK_DEPOSIT_PAGE_SIZE", 50))
+
+# Slowest requests kept in memory by each process for the slow requests page.
+SLOW_REQUESTS_SIZE = int(os.environ.get("SLOW_REQUESTS_SIZE", 100))
+
+# Request log lines would otherwise make up most of the output of `manage.py test`.
+TESTING = sys.argv[1:2] == ["test"]
+
+LOGGING = {
+    "version": 1,
+    "disable_existing_loggers": False,
+    "handlers": {"console": {"class": "logging.StreamHandler"}},
+    "loggers": {
+        "src.requests": {
+            "handlers": ["console"],
+            "level": os.environ.get("REQUEST_LOG_LEVEL", "WARNING" if TESTING else "INFO"),
+            "propagate": False,
+        },
+    },
+}
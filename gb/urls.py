@@ -17,18 +17,11 @@ Including another URLconf
 from django.contrib import admin
 from django.urls import include
 from django.urls import path
-from django.conf.urls import handler400
-from django.conf.urls import handler403
-from django.conf.urls import handler404
-from django.conf.urls import handler500
-from uuid import uuid4
-import time
 
+from src.views import SlowRequests
 
-urlpatterns = [path("", admin.site.urls), path("iteration/", include("src.urls"))]
-
-def http_not_found_view(request, *args, **kwargs):
-    request_id = str(uuid4())
-    request_epoch = time.time() * 1000
-    response = 404
-    return response
+urlpatterns = [
+    path("slow-requests/", SlowRequests.as_view(), name="slow_requests"),
+    path("", admin.site.urls),
+    path("iteration/", include("src.urls")),
+]
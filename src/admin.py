@@ -1,22 +1,110 @@
+import io
+import os
+
+from datetime import date
+from datetime import timedelta
+
 from django import forms
+from django.conf import settings
 from django.contrib import admin
-from django.http import HttpResponse
+from django.contrib import messages
+from django.contrib.admin.options import IncorrectLookupParameters
+from django.core.exceptions import PermissionDenied
+from django.core.paginator import Paginator
+from django.db import transaction
+from django.http import FileResponse
+from django.shortcuts import get_object_or_404
+from django.shortcuts import redirect
+from django.shortcuts import render
+from django.urls import path
 from django.urls import reverse
+from django.utils.dateparse import parse_date
 from django.utils.html import format_html
 
+from src.deposits import create_deposits
+from src.deposits import get_existing_deposits
+from src.deposits import IMPORT_COLUMNS
+from src.deposits import import_deposits
+from src.jobs import enqueue_job
 from src.models import Account
 from src.models import AccountDeposit
 from src.models import Address
 from src.models import Customer
 from src.models import Iteration
+from src.models import Job
 from src.models import Loan
 from src.models import LoanDeposit
 from src.models import Receipt
-from src.utils import generate_dues_pdf_response
-from src.utils import get_account_dues
+from src.rollover import rollover_iteration
+from src.snapshots import refresh_account_snapshots
+from src.utils import annotate_account_dues
+from src.utils import annotate_customer_counts
+from src.utils import annotate_customer_dues
+from src.utils import annotate_loan_dues
+from src.utils import create_receipts
+from src.utils import generate_csv_response
 from src.utils import get_account_installments
-from src.utils import get_loan_dues
+from src.utils import get_accounts_dues
 from src.utils import get_loan_installments
+from src.utils import get_loans_dues
+from src.utils import get_snapshot_month
+
+
+# Rows fetched per round trip while a CSV export streams.
+CSV_EXPORT_CHUNK_SIZE = 2000
+
+
+def stream_csv(filename, columns, queryset):
+    """Stream `queryset` as CSV, with a (header, function of the object) pair per column."""
+
+    def rows():
+        yield [header for header, _ in columns]
+        for obj in queryset.order_by("id").iterator(chunk_size=CSV_EXPORT_CHUNK_SIZE):
+            yield [value(obj) for _, value in columns]
+
+    return generate_csv_response(filename, rows())
+
+
+def _address_name(customer):
+    return customer.address.name if customer.address else ""
+
+
+def get_as_of(request):
+    """The `as_of` date the dues columns are computed for, today's if not given."""
+    value = request.GET.get(DuesAsOfFilter.parameter_name)
+    if not value:
+        return None
+    try:
+        as_of = parse_date(value)
+    except ValueError:
+        as_of = None
+    if as_of is None:
+        raise IncorrectLookupParameters(f"Invalid date {value}")
+    return as_of
+
+
+class DuesAsOfFilter(admin.SimpleListFilter):
+    title = "dues as of"
+    parameter_name = "as_of"
+
+    def lookups(self, request, model_admin):
+        month_ends = []
+        month_end = date.today().replace(day=1) - timedelta(days=1)
+        for _ in range(12):
+            month_ends.append((month_end.isoformat(), month_end.strftime("%d %b %Y")))
+            month_end = month_end.replace(day=1) - timedelta(days=1)
+        return month_ends
+
+    def choices(self, changelist):
+        choices = super().choices(changelist)
+        today = next(choices)
+        today["display"] = "Today"
+        yield today
+        yield from choices
+
+    def queryset(self, request, queryset):
+        # The dues are annotated by the admin's get_queryset, see `get_as_of`.
+        return queryset
 
 
 class SuperUserAdmin(admin.ModelAdmin):
@@ -36,26 +124,61 @@ class SuperUserAdmin(admin.ModelAdmin):
 
 class AccountForm(forms.ModelForm):
 
-    number_of_accounts = forms.CharField()
+    number_of_accounts = forms.IntegerField(min_value=1, initial=1)
 
     def save(self, commit=True):
-        number_of_accounts = self.cleaned_data.get("number_of_accounts", None)
-        number_of_accounts = int(number_of_accounts)
-        for i in range(number_of_accounts - 1):
-            obj = Account(
-                customer=self.cleaned_data.get("customer"),
-                iteration=self.cleaned_data.get("iteration"),
-                created_by=self.cleaned_data.get("created_by"),
-                modified_by=self.cleaned_data.get("modified_by"),
+        number_of_accounts = self.cleaned_data.get("number_of_accounts") or 1
+        with transaction.atomic():
+            accounts = Account.objects.bulk_create(
+                [
+                    Account(
+                        customer=self.cleaned_data.get("customer"),
+                        iteration=self.cleaned_data.get("iteration"),
+                        created_by=self.cleaned_data.get("created_by"),
+                        modified_by=self.cleaned_data.get("modified_by"),
+                    )
+                    for i in range(number_of_accounts - 1)
+                ],
+                batch_size=settings.ACCOUNT_BULK_CREATE_BATCH_SIZE,
             )
-            obj.save()
-        return super(AccountForm, self).save(commit=commit)
+            # The accounts other than the form's own, which the admin saves itself.
+            self.created_account_ids = [account.id for account in accounts]
+            # bulk_create sends no post_save, which would create their dues snapshots.
+            refresh_account_snapshots(self.created_account_ids)
+            return super(AccountForm, self).save(commit=commit)
 
     class Meta:
         model = Account
         fields = "__all__"
 
 
+class BulkDepositDateForm(forms.Form):
+    date = forms.DateField(widget=forms.DateInput(attrs={"type": "date"}))
+
+
+class AccountDepositRowForm(forms.Form):
+    selected = forms.BooleanField(required=False)
+    account_id = forms.IntegerField(widget=forms.HiddenInput)
+    principal = forms.IntegerField(min_value=0)
+    penalty = forms.IntegerField(min_value=0)
+
+
+class LoanDepositRowForm(forms.Form):
+    selected = forms.BooleanField(required=False)
+    loan_id = forms.IntegerField(widget=forms.HiddenInput)
+    principal = forms.IntegerField(min_value=0)
+    interest = forms.IntegerField(min_value=0)
+    penalty = forms.IntegerField(min_value=0)
+
+
+class ImportDepositsForm(forms.Form):
+    file = forms.FileField(help_text=f"CSV with the columns {', '.join(IMPORT_COLUMNS)}")
+
+
+AccountDepositFormSet = forms.formset_factory(AccountDepositRowForm, extra=0)
+LoanDepositFormSet = forms.formset_factory(LoanDepositRowForm, extra=0)
+
+
 class AccountAdmin(admin.ModelAdmin):
 
     add_form = AccountForm
@@ -63,6 +186,20 @@ class AccountAdmin(admin.ModelAdmin):
     fieldsets = (
         (None, {"fields": ("created_by", "modified_by", "customer", "iteration", "installments")},),
     )
+    add_fieldsets = (
+        (
+            None,
+            {
+                "fields": (
+                    "created_by",
+                    "modified_by",
+                    "customer",
+                    "iteration",
+                    "number_of_accounts",
+                )
+            },
+        ),
+    )
     list_display = (
         "account_id",
         "customer_url",
@@ -72,11 +209,29 @@ class AccountAdmin(admin.ModelAdmin):
         "last_deposit_date",
         "new_deposits",
     )
-    list_filter = ("customer__address__name",)
+    list_filter = ("customer__address__name", DuesAsOfFilter)
     search_fields = ("=id", "customer__name", "customer__address__name")
     readonly_fields = ("installments",)
     list_per_page = 50
     autocomplete_fields = ("customer",)
+    actions = ["export_csv"]
+
+    def export_csv(self, request, queryset):
+        columns = [
+            ("Account Id", lambda account: account.id),
+            ("Customer Id", lambda account: account.customer_id),
+            ("Name", lambda account: account.customer.name),
+            ("Address", lambda account: _address_name(account.customer)),
+            ("Iteration", lambda account: account.iteration_id),
+            ("Principal Dues", lambda account: account.dues_principal),
+            ("Penalty Dues", lambda account: account.dues_penalty),
+            ("Total Dues", lambda account: account.dues_total),
+            ("Deposits", lambda account: account.deposit_count),
+            ("Last Deposit Date", lambda account: account.last_deposit_date),
+        ]
+        return stream_csv("accounts.csv", columns, queryset)
+
+    export_csv.short_description = "Export selected accounts as CSV"
 
     def installments(self, obj):
         return format_html(
@@ -85,20 +240,32 @@ class AccountAdmin(admin.ModelAdmin):
 
     installments.allow_tags = True
 
+    def get_queryset(self, request):
+        queryset = super().get_queryset(request).select_related("customer__address", "iteration")
+        return annotate_account_dues(queryset, get_as_of(request))
+
     def dues(self, obj):
-        return get_account_dues(obj)
+        return obj.dues_total
 
-    def last_deposit_date(self, obj):
-        objs = obj.deposits.order_by("-date")
-        if objs.count() > 0:
-            return objs[0].date
-        return None
+    dues.admin_order_field = "dues_total"
+
+    def get_fieldsets(self, request, obj=None):
+        if obj is None:
+            return self.add_fieldsets
+        return super().get_fieldsets(request, obj)
 
     def get_form(self, request, obj=None, **kwargs):
         if obj is None:
             kwargs["form"] = self.add_form
         return super().get_form(request, obj, **kwargs)
 
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        created_account_ids = getattr(form, "created_account_ids", [])
+        if created_account_ids:
+            ids = ", ".join(str(account_id) for account_id in [obj.id] + created_account_ids)
+            self.message_user(request, f"Created accounts {ids}")
+
     def customer_url(self, obj):
         customer = obj.customer
         url = reverse(
@@ -112,13 +279,15 @@ class AccountAdmin(admin.ModelAdmin):
         return format_html(f'<a href="{url}">{obj.pk}</a>')
 
     def account_deposits(self, obj):
-        deposits = obj.deposits.count()
+        deposits = obj.deposit_count
         if deposits > 0:
             url = reverse(f"admin:src_accountdeposit_changelist") + f"?account__id__exact={obj.id}"
             return format_html(f'<a href="{url}">{deposits}</a>')
         else:
             return 0
 
+    account_deposits.admin_order_field = "deposit_count"
+
     def new_deposits(self, obj):
         url = reverse(f"admin:src_accountdeposit_add") + f"?account__id__exact={obj.id}"
         return format_html(f'<a href="{url}">Add New Deposit</a>')
@@ -144,6 +313,65 @@ class AccountDepositAdmin(admin.ModelAdmin):
     search_fields = ("=id", "account__customer__name", "account__customer__address__name")
     autocomplete_fields = ("account",)
     list_per_page = 50
+    actions = ["export_csv"]
+
+    # Rejected rows shown after an import, the rest are only counted.
+    IMPORT_REJECTS_SHOWN = 100
+
+    def get_urls(self):
+        urls = [
+            path(
+                "import/",
+                self.admin_site.admin_view(self.import_view),
+                name="src_accountdeposit_import",
+            )
+        ]
+        return urls + super().get_urls()
+
+    def import_view(self, request):
+        if not request.user.is_superuser:
+            raise PermissionDenied
+        result = None
+        rejects = []
+
+        def on_reject(line_number, row, reason):
+            if len(rejects) < self.IMPORT_REJECTS_SHOWN:
+                rejects.append((line_number, reason))
+
+        if request.method == "POST":
+            form = ImportDepositsForm(request.POST, request.FILES)
+            if form.is_valid():
+                # Large uploads are kept in a temporary file and read from it line by line.
+                csv_file = io.TextIOWrapper(form.cleaned_data["file"], encoding="utf-8-sig")
+                result = import_deposits(csv_file, request.user, on_reject=on_reject)
+        else:
+            form = ImportDepositsForm()
+        context = {
+            **self.admin_site.each_context(request),
+            "title": "Import deposits",
+            "opts": self.model._meta,
+            "form": form,
+            "result": result,
+            "rejects": rejects,
+        }
+        return render(request, "src/import_deposits.html", context)
+
+    def export_csv(self, request, queryset):
+        columns = [
+            ("Deposit Id", lambda deposit: deposit.id),
+            ("Date", lambda deposit: deposit.date),
+            ("Account Id", lambda deposit: deposit.account_id),
+            ("Customer Id", lambda deposit: deposit.account.customer_id),
+            ("Name", lambda deposit: deposit.account.customer.name),
+            ("Principal", lambda deposit: deposit.principal),
+            ("Penalty", lambda deposit: deposit.penalty),
+        ]
+        return stream_csv("account_deposits.csv", columns, queryset)
+
+    export_csv.short_description = "Export selected deposits as CSV"
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related("account__customer__address")
 
     def customer_url(self, obj):
         customer = obj.account.customer
@@ -186,94 +414,66 @@ class CustomerAdmin(admin.ModelAdmin):
         "loan",
     )
 
-    list_filter = ("address",)
+    list_filter = ("address", DuesAsOfFilter)
     search_fields = ("=id", "name", "address__name", "phone_number")
     actions = [
         "generate_loan_dues_list",
         "generate_account_dues_list",
         "generate_receipt_this_month",
+        "generate_receipts_this_month",
+        "export_csv",
     ]
     list_per_page = 50
 
+    def export_csv(self, request, queryset):
+        columns = [
+            ("Customer Id", lambda customer: customer.id),
+            ("Name", lambda customer: customer.name),
+            ("Address", _address_name),
+            ("Phone Number", lambda customer: customer.phone_number),
+            ("Accounts", lambda customer: customer.account_count),
+            ("Loans", lambda customer: customer.loan_count),
+            ("Account Dues", lambda customer: customer.account_dues_total),
+            ("Loan Dues", lambda customer: customer.loan_dues_total),
+            ("Total Dues", lambda customer: customer.dues_total),
+        ]
+        return stream_csv("customers.csv", columns, queryset)
+
+    export_csv.short_description = "Export selected customers as CSV"
+
+    def _redirect_to_job(self, request, job):
+        self.message_user(
+            request, f"Job {job.id} queued, the PDF can be downloaded once it is done."
+        )
+        return redirect(reverse("admin:src_job_change", args=[job.id]))
+
     def generate_receipt_this_month(self, request, queryset):
-        from src.utils import generate_invoice
-
-        response = HttpResponse(content_type="application/pdf")
-        response["Content-Disposition"] = "inline; filename=receipt.pdf"
-        customer = queryset.first()
-        accounts = customer.accounts.all()
-        invoice_obj = Receipt.objects.create(customer=customer, detail={}, created_by=request.user)
-        for account in accounts:
-            invoice_obj.accounts.add(account)
-        generate_invoice(response, invoice_obj)
-        return response
+        (invoice_obj,) = create_receipts(queryset[:1], request.user)
+        job = enqueue_job("RECEIPT", request.user, receipt_id=invoice_obj.id)
+        return self._redirect_to_job(request, job)
+
+    def generate_receipts_this_month(self, request, queryset):
+        receipts = create_receipts(queryset.order_by("id"), request.user)
+        job = enqueue_job(
+            "RECEIPTS",
+            request.user,
+            receipt_ids=[receipt.id for receipt in receipts],
+            workers=settings.RECEIPT_RENDER_WORKERS,
+        )
+        return self._redirect_to_job(request, job)
+
+    def _enqueue_dues_list(self, request, kind):
+        params = {"workers": settings.DUES_LIST_WORKERS}
+        as_of = get_as_of(request)
+        if as_of is not None:
+            params["as_of"] = as_of.isoformat()
+        return self._redirect_to_job(request, enqueue_job(kind, request.user, **params))
 
     def generate_loan_dues_list(self, request, queryset):
-        customers = Customer.objects.all()
-        _loans = [
-            [
-                "Serial",
-                "Customer Id",
-                "Name",
-                "Address",
-                "Loan Id",
-                "Principal",
-                "Interest",
-                "Penalty",
-            ]
-        ]
-        count = 1
-        for customer in customers:
-            for _loan in customer.loans.all():
-                dues = get_loan_dues(_loan)
-                if dues > 0:
-                    principal_dues = get_loan_dues(_loan, principal=True)
-                    interest_dues = get_loan_dues(_loan, interest=True)
-                    penalty_dues = get_loan_dues(_loan, penalty=True)
-                    datum = [
-                        count,
-                        customer.id,
-                        customer.name,
-                        customer.address.name,
-                        _loan.id,
-                        principal_dues,
-                        interest_dues,
-                        penalty_dues,
-                    ]
-                    _loans.append(datum)
-                    count += 1
-        response = HttpResponse(content_type="application/pdf")
-        response["Content-Disposition"] = "inline; filename=loan_dues.pdf"
-        generate_dues_pdf_response(response, data=_loans, header_text="Loan Dues List")
-        return response
+        return self._enqueue_dues_list(request, "LOAN_DUES_LIST")
 
     def generate_account_dues_list(self, request, queryset):
-        customers = Customer.objects.all()
-        _accounts = [
-            ["Serial", "Customer Id", "Name", "Address", "Account Id", "Principal", "Penalty"]
-        ]
-        count = 1
-        for customer in customers:
-            for _account in customer.accounts.all():
-                dues = get_account_dues(_account)
-                if dues > 0:
-                    principal_dues = get_account_dues(_account, principal=True)
-                    penalty_dues = get_account_dues(_account, penalty=True)
-                    datum = [
-                        count,
-                        customer.id,
-                        customer.name,
-                        customer.address.name,
-                        _account.id,
-                        principal_dues,
-                        penalty_dues,
-                    ]
-                    _accounts.append(datum)
-                    count += 1
-        response = HttpResponse(content_type="application/pdf")
-        response["Content-Disposition"] = "inline; filename=account_dues.pdf"
-        generate_dues_pdf_response(response, data=_accounts, header_text="Account Dues List")
-        return response
+        return self._enqueue_dues_list(request, "ACCOUNT_DUES_LIST")
 
     def account(self, obj):
         url = reverse(f"admin:src_account_add")
@@ -287,37 +487,43 @@ class CustomerAdmin(admin.ModelAdmin):
         return obj.id
 
     def accounts(self, obj):
-        accounts = obj.accounts.count()
+        accounts = obj.account_count
         if accounts > 0:
             url = reverse(f"admin:src_account_changelist") + f"?customer__id__exact={obj.id}"
-            return format_html(f'<a href="{url}">{obj.accounts.count()}</a>')
+            return format_html(f'<a href="{url}">{accounts}</a>')
         else:
             return 0
 
+    accounts.admin_order_field = "account_count"
+
     def loans(self, obj):
-        accounts = obj.loans.count()
-        if accounts > 0:
+        loans = obj.loan_count
+        if loans > 0:
             url = reverse(f"admin:src_loan_changelist") + f"?customer__id__exact={obj.id}"
-            return format_html(f'<a href="{url}">{obj.loans.count()}</a>')
+            return format_html(f'<a href="{url}">{loans}</a>')
         else:
             return 0
 
+    loans.admin_order_field = "loan_count"
+
+    def get_queryset(self, request):
+        queryset = annotate_customer_counts(super().get_queryset(request).select_related("address"))
+        return annotate_customer_dues(queryset, get_as_of(request))
+
     def account_dues(self, obj):
-        customer_accounts = obj.accounts.all()
-        total_dues = 0
-        for obj in customer_accounts:
-            total_dues += get_account_dues(obj)
-        return total_dues
+        return obj.account_dues_total
+
+    account_dues.admin_order_field = "account_dues_total"
 
     def loan_dues(self, obj):
-        loans = obj.loans.all()
-        total_dues = 0
-        for obj in loans:
-            total_dues += get_loan_dues(obj)
-        return total_dues
+        return obj.loan_dues_total
+
+    loan_dues.admin_order_field = "loan_dues_total"
 
     def total_dues(self, obj):
-        return self.account_dues(obj) + self.loan_dues(obj)
+        return obj.dues_total
+
+    total_dues.admin_order_field = "dues_total"
 
 
 class LoanAdmin(admin.ModelAdmin):
@@ -351,11 +557,32 @@ class LoanAdmin(admin.ModelAdmin):
         "last_deposit_date",
         "status",
     )
-    list_filter = ("customer__address__name",)
+    list_filter = ("customer__address__name", DuesAsOfFilter)
     search_fields = ("=id", "customer__name", "customer__address__name", "customer__phone_number")
     list_per_page = 50
     autocomplete_fields = ("customer",)
     readonly_fields = ("installments",)
+    actions = ["export_csv"]
+
+    def export_csv(self, request, queryset):
+        columns = [
+            ("Loan Id", lambda loan: loan.id),
+            ("Customer Id", lambda loan: loan.customer_id),
+            ("Name", lambda loan: loan.customer.name),
+            ("Address", lambda loan: _address_name(loan.customer)),
+            ("Iteration", lambda loan: loan.iteration_id),
+            ("Amount", lambda loan: loan.amount),
+            ("Status", lambda loan: loan.status),
+            ("Principal Dues", lambda loan: loan.dues_principal),
+            ("Interest Dues", lambda loan: loan.dues_interest),
+            ("Penalty Dues", lambda loan: loan.dues_penalty),
+            ("Total Dues", lambda loan: loan.dues_total),
+            ("Deposits", lambda loan: loan.deposit_count),
+            ("Last Deposit Date", lambda loan: loan.last_deposit_date),
+        ]
+        return stream_csv("loans.csv", columns, queryset)
+
+    export_csv.short_description = "Export selected loans as CSV"
 
     def installments(self, obj):
         return format_html(
@@ -364,23 +591,29 @@ class LoanAdmin(admin.ModelAdmin):
 
     installments.allow_tags = True
 
+    def get_queryset(self, request):
+        queryset = super().get_queryset(request).select_related("customer__address", "iteration")
+        return annotate_loan_dues(queryset, get_as_of(request))
+
     def principal(self, obj):
-        return self.dues(obj, principal=True)
+        return obj.dues_principal
+
+    principal.admin_order_field = "dues_principal"
 
     def interest(self, obj):
-        return self.dues(obj, interest=True)
+        return obj.dues_interest
+
+    interest.admin_order_field = "dues_interest"
 
     def penalty(self, obj):
-        return self.dues(obj, penalty=True)
+        return obj.dues_penalty
 
-    def dues(self, obj, principal=False, interest=False, penalty=False):
-        return get_loan_dues(obj, principal, interest, penalty)
+    penalty.admin_order_field = "dues_penalty"
 
-    def last_deposit_date(self, obj):
-        objs = obj.deposits.order_by("-date")
-        if objs.count() > 0:
-            return objs[0].date
-        return None
+    def dues(self, obj):
+        return obj.dues_total
+
+    dues.admin_order_field = "dues_total"
 
     def loan_url(self, obj):
         url = reverse(f"admin:{obj._meta.app_label}_{obj._meta.model_name}_change", args=[obj.id])
@@ -397,13 +630,15 @@ class LoanAdmin(admin.ModelAdmin):
         )
 
     def loan_deposits_url(self, obj):
-        deposits = obj.deposits.count()
+        deposits = obj.deposit_count
         if deposits > 0:
             url = reverse(f"admin:src_loandeposit_changelist") + f"?loan__id__exact={obj.id}"
             return format_html(f'<a href="{url}">{deposits}</a>')
         else:
             return 0
 
+    loan_deposits_url.admin_order_field = "deposit_count"
+
 
 class LoanDepositAdmin(admin.ModelAdmin):
 
@@ -436,6 +671,25 @@ class LoanDepositAdmin(admin.ModelAdmin):
     search_fields = ("=id", "loan__id", "loan__customer__name", "loan__customer__address__name")
     list_per_page = 50
     autocomplete_fields = ("loan",)
+    actions = ["export_csv"]
+
+    def export_csv(self, request, queryset):
+        columns = [
+            ("Deposit Id", lambda deposit: deposit.id),
+            ("Date", lambda deposit: deposit.date),
+            ("Loan Id", lambda deposit: deposit.loan_id),
+            ("Customer Id", lambda deposit: deposit.loan.customer_id),
+            ("Name", lambda deposit: deposit.loan.customer.name),
+            ("Principal", lambda deposit: deposit.principal),
+            ("Interest", lambda deposit: deposit.interest),
+            ("Penalty", lambda deposit: deposit.penalty),
+        ]
+        return stream_csv("loan_deposits.csv", columns, queryset)
+
+    export_csv.short_description = "Export selected deposits as CSV"
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related("loan__customer__address")
 
     def customer_url(self, obj):
         customer = obj.loan.customer
@@ -459,12 +713,240 @@ class LoanDepositAdmin(admin.ModelAdmin):
         return format_html(f'<a href="{url}">{loan.pk}</a>')
 
 
+class JobAdmin(admin.ModelAdmin):
+
+    list_display = ("id", "kind", "status", "created_by", "created_at", "finished_at", "download")
+    list_filter = ("kind", "status")
+    readonly_fields = (
+        "kind",
+        "status",
+        "params",
+        "download",
+        "error",
+        "created_by",
+        "created_at",
+        "started_at",
+        "finished_at",
+    )
+    fields = readonly_fields
+    list_per_page = 50
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related("created_by")
+
+    def get_urls(self):
+        urls = [
+            path(
+                "<int:job_id>/download/",
+                self.admin_site.admin_view(self.download_view),
+                name="src_job_download",
+            )
+        ]
+        return urls + super().get_urls()
+
+    def download_view(self, request, job_id):
+        job = get_object_or_404(Job, pk=job_id, status="DONE")
+        if not self.has_view_permission(request, job):
+            raise PermissionDenied
+        return FileResponse(job.file.open("rb"), filename=os.path.basename(job.file.name))
+
+    def download(self, obj):
+        if obj.status != "DONE":
+            return "-"
+        url = reverse("admin:src_job_download", args=[obj.id])
+        return format_html(f'<a href="{url}">Download</a>')
+
+
+class IterationAdmin(admin.ModelAdmin):
+
+    list_display = (
+        "__str__",
+        "start_date",
+        "no_of_months",
+        "is_active",
+        "bulk_deposits",
+        "address_report",
+    )
+    actions = ["rollover", "rollover_with_loans"]
+
+    def has_rollover_permission(self, request):
+        return request.user.has_perm("src.add_account")
+
+    def has_rollover_loans_permission(self, request):
+        return request.user.has_perms(["src.add_account", "src.add_loan"])
+
+    def _rollover(self, request, queryset, loans):
+        if queryset.count() != 2:
+            self.message_user(
+                request,
+                "Select the iteration to copy from and the one to copy into.",
+                messages.ERROR,
+            )
+            return
+        old, new = queryset.order_by("start_date", "id")
+        created = rollover_iteration(old, new, request.user, loans=loans)
+        message = f"Rolled over {created['accounts']} accounts"
+        if loans:
+            message += f" and {created['loans']} pending loans"
+        self.message_user(request, f"{message} from iteration {old} into {new}")
+
+    def rollover(self, request, queryset):
+        self._rollover(request, queryset, loans=False)
+
+    rollover.short_description = "Roll the earlier iteration's accounts over into the later one"
+    rollover.allowed_permissions = ("rollover",)
+
+    def rollover_with_loans(self, request, queryset):
+        self._rollover(request, queryset, loans=True)
+
+    rollover_with_loans.short_description = (
+        "Roll the earlier iteration's accounts and pending loans over into the later one"
+    )
+    rollover_with_loans.allowed_permissions = ("rollover_loans",)
+
+    def get_urls(self):
+        urls = [
+            path(
+                "<int:iteration_id>/deposits/",
+                self.admin_site.admin_view(self.bulk_deposits_view),
+                name="src_iteration_deposits",
+            )
+        ]
+        return urls + super().get_urls()
+
+    def _get_rows(self, formset, owners, owner_field):
+        rows = []
+        for form in formset:
+            owner_id = form[owner_field].value()
+            rows.append((form, owners.get(int(owner_id)) if owner_id else None))
+        return rows
+
+    def _get_selected(self, formset, owners, owner_field, date, model):
+        """The checked rows as deposit fields, or None if a row already has a deposit."""
+        deposits = []
+        forms = {}
+        for form in formset:
+            fields = dict(form.cleaned_data)
+            if fields.pop("selected") and fields[owner_field] in owners:
+                deposits.append(dict(fields, date=date))
+                forms[fields[owner_field]] = form
+        existing = get_existing_deposits(model, owner_field, deposits)
+        for owner_id, _ in existing:
+            forms[owner_id].add_error("selected", f"Already has a deposit on {date}")
+        return None if existing else deposits
+
+    def bulk_deposits_view(self, request, iteration_id):
+        if not request.user.has_perms(["src.add_accountdeposit", "src.add_loandeposit"]):
+            raise PermissionDenied
+        iteration = get_object_or_404(Iteration, pk=iteration_id)
+        # A page of the iteration's customers at a time, with all their accounts and loans.
+        customer_ids = (
+            iteration.accounts.values_list("customer", flat=True)
+            .union(iteration.loans.values_list("customer", flat=True))
+            .order_by("customer")
+        )
+        page = Paginator(customer_ids, settings.BULK_DEPOSIT_PAGE_SIZE).get_page(
+            request.GET.get("page")
+        )
+        page_accounts = iteration.accounts.filter(customer__in=list(page))
+        page_loans = iteration.loans.filter(customer__in=list(page))
+        accounts = page_accounts.select_related("customer").order_by("customer", "id")
+        loans = page_loans.select_related("customer").order_by("customer", "id")
+        accounts = {account.id: account for account in accounts}
+        loans = {loan.id: loan for loan in loans}
+
+        if request.method == "POST":
+            date_form = BulkDepositDateForm(request.POST)
+            account_formset = AccountDepositFormSet(request.POST, prefix="accounts")
+            loan_formset = LoanDepositFormSet(request.POST, prefix="loans")
+            if date_form.is_valid() and account_formset.is_valid() and loan_formset.is_valid():
+                date = date_form.cleaned_data["date"]
+                account_deposits = self._get_selected(
+                    account_formset, accounts, "account_id", date, AccountDeposit
+                )
+                loan_deposits = self._get_selected(
+                    loan_formset, loans, "loan_id", date, LoanDeposit
+                )
+                if account_deposits is not None and loan_deposits is not None:
+                    account_deposits, loan_deposits = create_deposits(
+                        request.user, account_deposits, loan_deposits
+                    )
+                    self.message_user(
+                        request,
+                        f"Saved {len(account_deposits)} account deposits and "
+                        f"{len(loan_deposits)} loan deposits for {date}",
+                    )
+                    if page.has_next():
+                        url = reverse("admin:src_iteration_deposits", args=[iteration.id])
+                        return redirect(f"{url}?page={page.next_page_number()}")
+                    return redirect("admin:src_iteration_changelist")
+        else:
+            accounts_dues = get_accounts_dues(page_accounts)
+            loans_dues = get_loans_dues(page_loans)
+            date_form = BulkDepositDateForm(initial={"date": get_snapshot_month(iteration)})
+            account_formset = AccountDepositFormSet(
+                prefix="accounts",
+                initial=[
+                    {
+                        "selected": accounts_dues[account_id]["total"] > 0,
+                        "account_id": account_id,
+                        "principal": accounts_dues[account_id]["principal"],
+                        "penalty": accounts_dues[account_id]["penalty"],
+                    }
+                    for account_id in accounts
+                ],
+            )
+            loan_formset = LoanDepositFormSet(
+                prefix="loans",
+                initial=[
+                    {
+                        "selected": loans_dues[loan_id]["total"] > 0,
+                        "loan_id": loan_id,
+                        "principal": loans_dues[loan_id]["principal"],
+                        "interest": loans_dues[loan_id]["interest"],
+                        "penalty": loans_dues[loan_id]["penalty"],
+                    }
+                    for loan_id in loans
+                ],
+            )
+
+        context = {
+            **self.admin_site.each_context(request),
+            "title": f"Deposits of iteration {iteration}",
+            "opts": self.model._meta,
+            "date_form": date_form,
+            "account_formset": account_formset,
+            "loan_formset": loan_formset,
+            "account_rows": self._get_rows(account_formset, accounts, "account_id"),
+            "loan_rows": self._get_rows(loan_formset, loans, "loan_id"),
+            "page": page,
+        }
+        return render(request, "src/bulk_deposits.html", context)
+
+    def bulk_deposits(self, obj):
+        url = reverse("admin:src_iteration_deposits", args=[obj.id])
+        return format_html(f'<a href="{url}">Enter Deposits</a>')
+
+    def address_report(self, obj):
+        url = reverse("address_report", args=[obj.id])
+        return format_html(f'<a href="{url}">Collections by Address</a>')
+
+
 class ReceiptAdmin(admin.ModelAdmin):
 
     list_display = ("id", "customer", "created_at")
 
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related("customer__address")
+
 
-admin.site.register(Iteration)
+admin.site.register(Iteration, IterationAdmin)
 admin.site.register(Customer, CustomerAdmin)
 admin.site.register(Account, AccountAdmin)
 admin.site.register(Loan, LoanAdmin)
@@ -472,4 +954,5 @@ admin.site.register(LoanDeposit, LoanDepositAdmin)
 admin.site.register(AccountDeposit, AccountDepositAdmin)
 admin.site.register(Address)
 admin.site.register(Receipt, ReceiptAdmin)
+admin.site.register(Job, JobAdmin)
 admin.site.disable_action("delete_selected")
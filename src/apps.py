@@ -3,3 +3,6 @@ from django.apps import AppConfig
 
 class SrcConfig(AppConfig):
     name = "src"
+
+    def ready(self):
+        import src.signals  # noqa: F401
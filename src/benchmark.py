@@ -0,0 +1,258 @@
+import random
+import tempfile
+import time
+
+from datetime import date
+
+from dateutil import relativedelta
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection
+from django.test import Client
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from src.dues import account_dues_breakdown
+from src.dues import AccountState
+from src.dues import get_total_months
+from src.dues import loan_dues_breakdown
+from src.dues import LoanState
+from src.jobs import enqueue_job
+from src.jobs import run_job
+from src.models import Account
+from src.models import AccountDeposit
+from src.models import Address
+from src.models import Customer
+from src.models import Iteration
+from src.models import Loan
+from src.models import LoanDeposit
+from src.models import Receipt
+from src.rollups import refresh_collections
+from src.schedule import get_months
+from src.snapshots import refresh_account_snapshots
+from src.snapshots import refresh_loan_snapshots
+from src.totals import refresh_account_totals
+from src.totals import refresh_loan_totals
+from src.utils import create_receipts
+from src.utils import get_iteration_terms
+
+CHANGELISTS = [
+    "admin:src_customer_changelist",
+    "admin:src_account_changelist",
+    "admin:src_loan_changelist",
+    "admin:src_accountdeposit_changelist",
+    "admin:src_loandeposit_changelist",
+    "admin:src_receipt_changelist",
+]
+# The benchmarked views write to this cache instead of the configured one, which the
+# benchmark must not clear.
+BENCHMARK_CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "benchmark",
+    }
+}
+
+
+def seed(user, iterations=1, customers=1000, months=12, batch_size=5000, seed=0):
+    """Create `customers` customers with an account each, split over `iterations` iterations.
+
+    Every other customer also takes a loan. Both are paid most months of the last
+    `months` months, so some of them are behind on their dues.
+    """
+    rng = random.Random(seed)
+    address = Address.objects.create(name="Benchmark", created_by=user)
+    start_date = date.today().replace(day=1) - relativedelta.relativedelta(months=months)
+    iteration_objs = Iteration.objects.bulk_create(
+        [
+            Iteration(
+                start_date=start_date,
+                interest_rate=2,
+                no_of_months=months + 12,
+                deposit_amount=500,
+                late_deposit_fine=1,
+                is_active=True,
+                day_of_payment=1,
+                return_amount=(months + 12) * 600,
+                created_by=user,
+            )
+            for _ in range(iterations)
+        ],
+        batch_size=batch_size,
+    )
+    customer_objs = Customer.objects.bulk_create(
+        [
+            Customer(
+                name=f"Customer {i}",
+                address=address,
+                phone_number=f"{i:010d}",
+                created_by=user,
+            )
+            for i in range(customers)
+        ],
+        batch_size=batch_size,
+    )
+    accounts = Account.objects.bulk_create(
+        [
+            Account(
+                customer=customer,
+                iteration=iteration_objs[i % iterations],
+                created_by=user,
+            )
+            for i, customer in enumerate(customer_objs)
+        ],
+        batch_size=batch_size,
+    )
+    loans = Loan.objects.bulk_create(
+        [
+            Loan(
+                customer=customer,
+                iteration=iteration_objs[i % iterations],
+                amount=10000,
+                created_by=user,
+            )
+            for i, customer in enumerate(customer_objs)
+            if i % 2 == 0
+        ],
+        batch_size=batch_size,
+    )
+
+    schedule = get_months(start_date, months + 1)
+    deposits = []
+    for account in accounts:
+        for month in schedule:
+            if rng.random() < 0.9:
+                deposits.append(
+                    AccountDeposit(
+                        date=month,
+                        principal=500,
+                        penalty=0,
+                        account=account,
+                        created_by=user,
+                    )
+                )
+        if len(deposits) >= batch_size:
+            AccountDeposit.objects.bulk_create(deposits, batch_size=batch_size)
+            deposits = []
+    AccountDeposit.objects.bulk_create(deposits, batch_size=batch_size)
+
+    deposits = []
+    for loan in loans:
+        for paid, month in enumerate(schedule[1:11]):
+            if rng.random() < 0.9:
+                deposits.append(
+                    LoanDeposit(
+                        date=month,
+                        principal=1000,
+                        interest=int((10000 - paid * 1000) * 0.02),
+                        penalty=0,
+                        loan=loan,
+                        created_by=user,
+                    )
+                )
+        if len(deposits) >= batch_size:
+            LoanDeposit.objects.bulk_create(deposits, batch_size=batch_size)
+            deposits = []
+    LoanDeposit.objects.bulk_create(deposits, batch_size=batch_size)
+
+    # bulk_create skips the signals that keep the totals, dues snapshots and collections
+    # up to date.
+    for owners, refresh_totals, refresh_snapshots in (
+        (accounts, refresh_account_totals, refresh_account_snapshots),
+        (loans, refresh_loan_totals, refresh_loan_snapshots),
+    ):
+        ids = [owner.id for owner in owners]
+        for i in range(0, len(ids), batch_size):
+            refresh_totals(ids[i : i + batch_size])
+            refresh_snapshots(ids[i : i + batch_size])
+    refresh_collections([iteration.id for iteration in iteration_objs])
+    return iteration_objs
+
+
+def _measure(results, name, func):
+    with CaptureQueriesContext(connection) as context:
+        start = time.perf_counter()
+        detail = func()
+        elapsed = time.perf_counter() - start
+    results[name] = {"seconds": round(elapsed, 4), "queries": len(context.captured_queries)}
+    if detail:
+        results[name].update(detail)
+
+
+def _get(client, url):
+    response = client.get(url)
+    return {"status": response.status_code}
+
+
+def _run_job(kind, user, **params):
+    job = enqueue_job(kind, user, **params)
+    return {"status": run_job(job.id)}
+
+
+def _get_dues_inputs(iterations):
+    terms = {
+        iteration.id: (
+            get_iteration_terms(iteration),
+            get_total_months(iteration.start_date, date.today()),
+        )
+        for iteration in iterations
+    }
+    loans = [
+        (terms[iteration_id], LoanState(amount, paid))
+        for iteration_id, amount, paid in Loan.objects.filter(iteration__in=iterations).values_list(
+            "iteration", "amount", "total_principal_paid"
+        )
+    ]
+    accounts = [
+        (terms[iteration_id], AccountState(paid))
+        for iteration_id, paid in Account.objects.filter(iteration__in=iterations).values_list(
+            "iteration", "total_principal_paid"
+        )
+    ]
+    return loans, accounts
+
+
+def _compute_dues(loans, accounts):
+    for (terms, total_months), loan in loans:
+        loan_dues_breakdown(terms, loan, total_months - 1)
+    for (terms, total_months), account in accounts:
+        account_dues_breakdown(terms, account, total_months)
+    return {"loans": len(loans), "accounts": len(accounts)}
+
+
+def run_benchmarks(user, iterations, receipts=100):
+    """Time and count the queries of the admin and report paths on the current data."""
+    results = {}
+    client = Client()
+    client.force_login(user)
+    with override_settings(MEDIA_ROOT=tempfile.mkdtemp(), CACHES=BENCHMARK_CACHES):
+        for changelist in CHANGELISTS:
+            _measure(results, changelist, lambda: _get(client, reverse(changelist)))
+        loans, accounts = _get_dues_inputs(iterations)
+        _measure(results, "dues_kernel", lambda: _compute_dues(loans, accounts))
+        _measure(results, "loan_dues_list", lambda: _run_job("LOAN_DUES_LIST", user))
+        _measure(results, "account_dues_list", lambda: _run_job("ACCOUNT_DUES_LIST", user))
+        customers = Customer.objects.filter(accounts__iteration__in=iterations).distinct()
+        _measure(
+            results,
+            "create_receipts",
+            lambda: {"receipts": len(create_receipts(customers, user))},
+        )
+        receipt_ids = list(Receipt.objects.order_by("-id").values_list("id", flat=True)[:receipts])
+        _measure(
+            results, "render_receipts", lambda: _run_job("RECEIPTS", user, receipt_ids=receipt_ids)
+        )
+        url = reverse("analysis_data", args=[iterations[0].id])
+        # Only the benchmark's own cache, so the first request misses it.
+        cache.clear()
+        _measure(results, "analysis_data", lambda: _get(client, url))
+        _measure(results, "analysis_data_cached", lambda: _get(client, url))
+    return results
+
+
+def get_benchmark_user():
+    user, created = User.objects.get_or_create(
+        username="benchmark", defaults={"is_staff": True, "is_superuser": True}
+    )
+    return user
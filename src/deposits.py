@@ -0,0 +1,173 @@
+import csv
+import datetime
+
+from django.db import transaction
+
+from src.models import Account
+from src.models import AccountDeposit
+from src.models import Loan
+from src.models import LoanDeposit
+from src.rollups import refresh_deposit_collections
+from src.rollups import refresh_owner_collections
+from src.snapshots import refresh_account_snapshots
+from src.snapshots import refresh_loan_snapshots
+from src.totals import refresh_account_totals
+from src.totals import refresh_loan_totals
+
+
+def _get_from_dates(deposits, owner_field, from_dates=None):
+    """Map every owner to the date of its earliest deposit, adding to `from_dates` if given."""
+    from_dates = {} if from_dates is None else from_dates
+    for fields in deposits:
+        owner_id, date = fields[owner_field], fields["date"]
+        from_dates[owner_id] = min(date, from_dates.get(owner_id, date))
+    return from_dates
+
+
+def _refresh(refresh, from_dates, batch_size=500):
+    # Refresh the owners that share a first deposit date together.
+    owners_by_date = {}
+    for owner_id, date in from_dates.items():
+        owners_by_date.setdefault(date, []).append(owner_id)
+    for date, owner_ids in owners_by_date.items():
+        for start in range(0, len(owner_ids), batch_size):
+            refresh(owner_ids[start : start + batch_size], from_date=date)
+
+
+@transaction.atomic
+def create_deposits(user, account_deposits=(), loan_deposits=(), refresh_snapshots=True):
+    """Save many deposits at once, given as dicts of AccountDeposit or LoanDeposit fields.
+
+    Owners are given by id, as `account_id` or `loan_id`. bulk_create sends no
+    post_save, so the owners' deposit totals are refreshed here, and so are their
+    dues snapshots and monthly collections unless the caller does it.
+    """
+    account_deposits = list(account_deposits)
+    loan_deposits = list(loan_deposits)
+    created = (
+        AccountDeposit.objects.bulk_create(
+            [AccountDeposit(created_by=user, **fields) for fields in account_deposits]
+        ),
+        LoanDeposit.objects.bulk_create(
+            [LoanDeposit(created_by=user, **fields) for fields in loan_deposits]
+        ),
+    )
+    refresh_account_totals({fields["account_id"] for fields in account_deposits})
+    refresh_loan_totals({fields["loan_id"] for fields in loan_deposits})
+    if refresh_snapshots:
+        _refresh(refresh_account_snapshots, _get_from_dates(account_deposits, "account_id"))
+        _refresh(refresh_loan_snapshots, _get_from_dates(loan_deposits, "loan_id"))
+        for model, owner_field, deposits in (
+            (AccountDeposit, "account_id", account_deposits),
+            (LoanDeposit, "loan_id", loan_deposits),
+        ):
+            refresh_deposit_collections(
+                model, {(fields[owner_field], fields["date"]) for fields in deposits}
+            )
+    return created
+
+
+def get_existing_deposits(model, owner_field, deposits):
+    """The (owner id, date) pairs of the given deposits that are already saved."""
+    return set(
+        model.objects.filter(
+            **{f"{owner_field}__in": {fields[owner_field] for fields in deposits}},
+            date__in={fields["date"] for fields in deposits},
+        ).values_list(owner_field, "date")
+    )
+
+
+IMPORT_COLUMNS = ["kind", "id", "date", "principal", "interest", "penalty"]
+
+# The owner field and model of each kind of deposit in an import file.
+IMPORT_KINDS = {"account": ("account_id", AccountDeposit), "loan": ("loan_id", LoanDeposit)}
+
+
+def _parse_import_row(row, owner_ids):
+    kind = (row.get("kind") or "").strip().lower()
+    if kind not in IMPORT_KINDS:
+        raise ValueError(f"Unknown kind {kind!r}")
+    try:
+        owner_id = int(row["id"])
+        date = datetime.datetime.strptime(row["date"].strip(), "%Y-%m-%d").date()
+        amounts = {
+            field: int(row.get(field) or 0) for field in ("principal", "interest", "penalty")
+        }
+    except (KeyError, TypeError, ValueError):
+        raise ValueError("Invalid id, date or amount")
+    if any(amount < 0 for amount in amounts.values()):
+        raise ValueError("Negative amount")
+    if owner_id not in owner_ids[kind]:
+        raise ValueError(f"Unknown {kind} {owner_id}")
+    if kind == "account":
+        if amounts.pop("interest"):
+            raise ValueError("Account deposits have no interest")
+    owner_field, _ = IMPORT_KINDS[kind]
+    return kind, dict(amounts, date=date, **{owner_field: owner_id})
+
+
+def _save_import_batch(batch, user, on_reject, from_dates):
+    deposits = {kind: [] for kind in IMPORT_KINDS}
+    for kind, (owner_field, model) in IMPORT_KINDS.items():
+        rows = [fields for _, _, row_kind, fields in batch if row_kind == kind]
+        if not rows:
+            continue
+        # Earlier batches are already saved, so checking the database also
+        # catches duplicates further apart in the file.
+        existing = get_existing_deposits(model, owner_field, rows)
+        for line_number, row, row_kind, fields in batch:
+            if row_kind != kind:
+                continue
+            key = (fields[owner_field], fields["date"])
+            if key in existing:
+                on_reject(line_number, row, f"Duplicate {kind} deposit on {fields['date']}")
+                continue
+            existing.add(key)
+            deposits[kind].append(fields)
+    create_deposits(user, deposits["account"], deposits["loan"], refresh_snapshots=False)
+    for kind, (owner_field, _) in IMPORT_KINDS.items():
+        _get_from_dates(deposits[kind], owner_field, from_dates[kind])
+    return len(deposits["account"]) + len(deposits["loan"])
+
+
+def import_deposits(csv_file, user, batch_size=1000, on_reject=None):
+    """Save the deposits of a CSV file with IMPORT_COLUMNS, `batch_size` rows at a time.
+
+    Rows are read one by one, so the file can be any size. Invalid rows and
+    deposits that already exist are passed to `on_reject` and skipped. The dues
+    snapshots of the owners with new deposits, and the monthly collections of their
+    iterations, are refreshed once at the end.
+    """
+    rejected = 0
+
+    def reject(line_number, row, reason):
+        nonlocal rejected
+        rejected += 1
+        if on_reject is not None:
+            on_reject(line_number, row, reason)
+
+    owner_ids = {
+        "account": set(Account.objects.values_list("id", flat=True)),
+        "loan": set(Loan.objects.values_list("id", flat=True)),
+    }
+    from_dates = {kind: {} for kind in IMPORT_KINDS}
+    imported = 0
+    batch = []
+    reader = csv.DictReader(csv_file)
+    for line_number, row in enumerate(reader, start=2):
+        try:
+            kind, fields = _parse_import_row(row, owner_ids)
+        except ValueError as e:
+            reject(line_number, row, str(e))
+            continue
+        batch.append((line_number, row, kind, fields))
+        if len(batch) >= batch_size:
+            imported += _save_import_batch(batch, user, reject, from_dates)
+            batch = []
+    if batch:
+        imported += _save_import_batch(batch, user, reject, from_dates)
+    _refresh(refresh_account_snapshots, from_dates["account"])
+    _refresh(refresh_loan_snapshots, from_dates["loan"])
+    for kind, (_, model) in IMPORT_KINDS.items():
+        refresh_owner_collections(model, list(from_dates[kind]))
+    return {"imported": imported, "rejected": rejected}
@@ -0,0 +1,78 @@
+from dataclasses import dataclass
+from datetime import date
+from typing import NamedTuple
+
+from dateutil import relativedelta
+
+# The dues formulas on plain values. Nothing here touches the database, so dues can
+# be computed in loops, in other processes or in benchmarks from totals fetched once.
+
+
+@dataclass
+class IterationTerms:
+    __slots__ = ("start_date", "interest_rate", "late_deposit_fine", "deposit_amount")
+    start_date: date
+    interest_rate: int
+    late_deposit_fine: int
+    deposit_amount: int
+
+
+@dataclass
+class LoanState:
+    __slots__ = ("amount", "principal_paid")
+    amount: int
+    principal_paid: int
+
+
+@dataclass
+class AccountState:
+    __slots__ = ("principal_paid",)
+    principal_paid: int
+
+
+class LoanDues(NamedTuple):
+    principal: int
+    interest: int
+    penalty: int
+    installments: int
+    total: int
+
+
+class AccountDues(NamedTuple):
+    principal: int
+    penalty: int
+    installments: int
+    total: int
+
+
+def get_total_months(start_date, as_of):
+    """Installments due from `start_date` up to and including `as_of`."""
+    diff = relativedelta.relativedelta(as_of, start_date)
+    total_months = (diff.years * 12) + (diff.months)
+    if diff.days > 0:
+        total_months += 1
+    return total_months
+
+
+def loan_dues_breakdown(terms, loan, total_months):
+    installment = loan.amount * 0.1
+    principal = max(installment * total_months - loan.principal_paid, 0)
+    installments = max(int(principal / installment), 1)
+    balance = loan.amount - loan.principal_paid
+    interest = (installments * balance * terms.interest_rate) / 100
+    penalty = (max(installments - 1, 0) * balance * terms.late_deposit_fine) / 100
+    return LoanDues(
+        int(principal),
+        int(interest),
+        int(penalty),
+        installments,
+        int(principal + interest + penalty),
+    )
+
+
+def account_dues_breakdown(terms, account, total_months):
+    installments_paid = int(account.principal_paid / terms.deposit_amount)
+    installments = max(total_months - installments_paid, 0)
+    principal = installments * terms.deposit_amount
+    penalty = max(installments - 1, 0) * (terms.late_deposit_fine + terms.interest_rate)
+    return AccountDues(principal, penalty, installments, int(principal + penalty))
@@ -0,0 +1,196 @@
+import io
+import math
+import tempfile
+import traceback
+import zipfile
+
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date
+from itertools import count
+from itertools import repeat
+
+from django.core.files import File
+from django.db import connections
+from django.db import transaction
+from django.utils import timezone
+
+from src.models import Customer
+from src.models import Job
+from src.models import Receipt
+from src.utils import generate_dues_pdf_response
+from src.utils import generate_invoice
+from src.utils import get_account_dues_rows
+from src.utils import get_loan_dues_rows
+
+
+def _get_as_of(job, header_text):
+    as_of = job.params.get("as_of")
+    if as_of is None:
+        return None, header_text
+    as_of = date.fromisoformat(as_of)
+    return as_of, f"{header_text} as of {as_of.strftime('%d-%m-%Y')}"
+
+
+DUES_ROWS = {"LOAN_DUES_LIST": get_loan_dues_rows, "ACCOUNT_DUES_LIST": get_account_dues_rows}
+
+
+def get_customer_ranges(shards):
+    """Split the customers into at most `shards` id ranges of about as many customers."""
+    customer_ids = list(Customer.objects.order_by("id").values_list("id", flat=True))
+    size = max(math.ceil(len(customer_ids) / shards), 1)
+    return [
+        (customer_ids[i], customer_ids[min(i + size, len(customer_ids)) - 1])
+        for i in range(0, len(customer_ids), size)
+    ]
+
+
+def get_dues_rows_shard(kind, as_of, customer_range):
+    rows = DUES_ROWS[kind](as_of, customer_range)
+    next(rows)
+    return list(rows)
+
+
+def get_sharded_dues_rows(kind, as_of, shards, workers=1):
+    """Yield the dues list of `kind` like its own generator, computed per customer range.
+
+    The ranges are worked on by `workers` processes and merged back in customer order.
+    """
+    yield next(DUES_ROWS[kind](as_of))
+    customer_ranges = get_customer_ranges(shards)
+    serials = count(1)
+    if workers > 1:
+        # Forked workers must not share the parent's connection.
+        connections.close_all()
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            for rows in executor.map(
+                get_dues_rows_shard, repeat(kind), repeat(as_of), customer_ranges
+            ):
+                for row in rows:
+                    yield [next(serials)] + row[1:]
+    else:
+        for customer_range in customer_ranges:
+            for row in get_dues_rows_shard(kind, as_of, customer_range):
+                yield [next(serials)] + row[1:]
+
+
+def _get_dues_list_rows(job, as_of):
+    workers = job.params.get("workers", 1)
+    if workers > 1:
+        return get_sharded_dues_rows(job.kind, as_of, workers, workers)
+    return DUES_ROWS[job.kind](as_of)
+
+
+def _render_loan_dues_list(job, output):
+    as_of, header_text = _get_as_of(job, "Loan Dues List")
+    generate_dues_pdf_response(
+        output, data=_get_dues_list_rows(job, as_of), header_text=header_text
+    )
+    return "loan_dues.pdf"
+
+
+def _render_account_dues_list(job, output):
+    as_of, header_text = _get_as_of(job, "Account Dues List")
+    generate_dues_pdf_response(
+        output, data=_get_dues_list_rows(job, as_of), header_text=header_text
+    )
+    return "account_dues.pdf"
+
+
+def _render_receipt(job, output):
+    invoice_obj = Receipt.objects.get(pk=job.params["receipt_id"])
+    generate_invoice(output, invoice_obj)
+    return f"receipt_{invoice_obj.id}.pdf"
+
+
+def render_receipt_pdfs(receipt_ids):
+    receipts = (
+        Receipt.objects.filter(id__in=receipt_ids)
+        .select_related("customer__address")
+        .prefetch_related("customer__accounts")
+        .order_by("id")
+    )
+    pdfs = []
+    for receipt in receipts:
+        output = io.BytesIO()
+        generate_invoice(output, receipt)
+        pdfs.append((f"receipt_{receipt.id}_customer_{receipt.customer_id}.pdf", output.getvalue()))
+    return pdfs
+
+
+def _render_receipts(job, output):
+    receipt_ids = job.params["receipt_ids"]
+    workers = job.params.get("workers", 1)
+    chunk_size = max(math.ceil(len(receipt_ids) / workers), 1)
+    chunks = [receipt_ids[i : i + chunk_size] for i in range(0, len(receipt_ids), chunk_size)]
+    with zipfile.ZipFile(output, "w", zipfile.ZIP_DEFLATED) as archive:
+        if workers > 1:
+            connections.close_all()
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                rendered = list(executor.map(render_receipt_pdfs, chunks))
+        else:
+            rendered = [render_receipt_pdfs(chunk) for chunk in chunks]
+        for pdfs in rendered:
+            for filename, pdf in pdfs:
+                archive.writestr(filename, pdf)
+    return "receipts.zip"
+
+
+JOB_RUNNERS = {
+    "LOAN_DUES_LIST": _render_loan_dues_list,
+    "ACCOUNT_DUES_LIST": _render_account_dues_list,
+    "RECEIPT": _render_receipt,
+    "RECEIPTS": _render_receipts,
+}
+
+
+def enqueue_job(kind, user, **params):
+    return Job.objects.create(kind=kind, params=params, created_by=user)
+
+
+def claim_jobs(limit):
+    """Mark up to `limit` pending jobs as running and return their ids.
+
+    Rows locked by another worker are skipped, so several workers can poll the
+    same table without picking up the same job twice.
+    """
+    with transaction.atomic():
+        job_ids = list(
+            Job.objects.select_for_update(skip_locked=True)
+            .filter(status="PENDING")
+            .order_by("id")
+            .values_list("id", flat=True)[:limit]
+        )
+        Job.objects.filter(id__in=job_ids).update(status="RUNNING", started_at=timezone.now())
+    return job_ids
+
+
+def requeue_stale_jobs(started_before):
+    """Put jobs still RUNNING since before `started_before` back in the queue.
+
+    A worker that is killed leaves its jobs RUNNING, and nothing else would pick them up.
+    """
+    return Job.objects.filter(status="RUNNING", started_at__lt=started_before).update(
+        status="PENDING", started_at=None
+    )
+
+
+def fail_jobs(job_ids, error):
+    Job.objects.filter(id__in=job_ids, status="RUNNING").update(
+        status="FAILED", error=error, finished_at=timezone.now()
+    )
+
+
+def run_job(job_id):
+    job = Job.objects.get(pk=job_id)
+    try:
+        with tempfile.TemporaryFile() as output:
+            filename = JOB_RUNNERS[job.kind](job, output)
+            output.seek(0)
+            job.file.save(filename, File(output), save=False)
+        job.status = "DONE"
+    except Exception:
+        job.status = "FAILED"
+        job.error = traceback.format_exc()
+    job.finished_at = timezone.now()
+    job.save()
+    return job.status
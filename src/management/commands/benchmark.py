@@ -0,0 +1,51 @@
+import json
+import subprocess
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from src.benchmark import get_benchmark_user
+from src.benchmark import run_benchmarks
+from src.benchmark import seed
+
+
+class Command(BaseCommand):
+    help = (
+        "Seed each size of synthetic data, time the admin changelists, dues lists, receipts "
+        "and analysis on it, and write the timings and query counts as JSON. The data of "
+        "every size is rolled back afterwards."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--sizes", type=int, nargs="+", default=[1000, 10000, 100000], help="Accounts."
+        )
+        parser.add_argument("--iterations", type=int, default=1)
+        parser.add_argument("--months", type=int, default=12)
+        parser.add_argument("--receipts", type=int, default=100, help="Receipt PDFs to render.")
+        parser.add_argument("--output", help="File to write the results to instead of stdout.")
+
+    def _get_commit(self):
+        result = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True)
+        return result.stdout.strip() or None
+
+    def handle(self, *args, **options):
+        report = {"commit": self._get_commit(), "created_at": timezone.now().isoformat()}
+        report["sizes"] = {}
+        for size in options["sizes"]:
+            with transaction.atomic():
+                user = get_benchmark_user()
+                iterations = seed(
+                    user, iterations=options["iterations"], customers=size, months=options["months"]
+                )
+                report["sizes"][size] = run_benchmarks(user, iterations, options["receipts"])
+                transaction.set_rollback(True)
+            self.stderr.write(f"Benchmarked {size} accounts")
+
+        output = json.dumps(report, indent=2)
+        if options["output"]:
+            with open(options["output"], "w") as f:
+                f.write(output)
+        else:
+            self.stdout.write(output)
@@ -0,0 +1,68 @@
+import io
+import time
+import tracemalloc
+
+from django.core.management.base import BaseCommand
+from reportlab.lib.enums import TA_CENTER
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.styles import getSampleStyleSheet
+from reportlab.lib.styles import ParagraphStyle
+from reportlab.platypus import Paragraph
+from reportlab.platypus import SimpleDocTemplate
+from reportlab.platypus.tables import Table
+
+from src.utils import _dues_table_style
+from src.utils import generate_dues_pdf_response
+
+
+def _get_rows(count):
+    yield [
+        "Serial",
+        "Customer Id",
+        "Name",
+        "Address",
+        "Loan Id",
+        "Principal",
+        "Interest",
+        "Penalty",
+    ]
+    for i in range(1, count + 1):
+        yield [i, i, f"Customer {i}", "Address", i, 1000, 200, 100]
+
+
+def _single_table_pdf(response, data, header_text):
+    # The dues list renderer before it was paged: one table for every row.
+    doc = SimpleDocTemplate(response, pagesize=A4)
+    styles = getSampleStyleSheet()
+    style = ParagraphStyle(name="Header", parent=styles["Heading1"], alignment=TA_CENTER)
+    table = Table(list(data), style=_dues_table_style(), repeatRows=1)
+    doc.build([Paragraph(header_text, style), table])
+
+
+class Command(BaseCommand):
+    help = "Compare render time and peak memory of the single table and paged dues list PDF."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rows", type=int, default=10000)
+
+    def _measure(self, render, rows):
+        start = time.perf_counter()
+        render(io.BytesIO(), _get_rows(rows), "Loan Dues List")
+        elapsed = time.perf_counter() - start
+        # Tracing slows rendering down a lot, so memory is measured on a separate run.
+        tracemalloc.start()
+        render(io.BytesIO(), _get_rows(rows), "Loan Dues List")
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        return elapsed, peak
+
+    def handle(self, *args, **options):
+        rows = options["rows"]
+        for name, render in (
+            ("single table", _single_table_pdf),
+            ("paged", generate_dues_pdf_response),
+        ):
+            elapsed, peak = self._measure(render, rows)
+            self.stdout.write(
+                f"{name}: {rows} rows in {elapsed:.2f}s, peak memory {peak / 1024 / 1024:.1f} MiB"
+            )
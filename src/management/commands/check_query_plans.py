@@ -0,0 +1,102 @@
+from django.core.management.base import BaseCommand
+from django.core.management.base import CommandError
+from django.db import connection
+from django.db import transaction
+from django.test.utils import CaptureQueriesContext
+
+from src.models import Account
+from src.models import Iteration
+from src.models import Loan
+from src.rollups import get_deposit_collections
+from src.rollups import get_monthly_collections
+from src.utils import get_account_dues_rows
+from src.utils import get_accounts_dues
+from src.utils import get_all_installment_dates
+from src.utils import get_analysis_version
+from src.utils import get_loan_dues_rows
+from src.utils import get_loans_dues
+
+# Tables that grow with every deposit; the report queries must never scan them whole.
+LARGE_TABLES = ["account_deposits", "loan_deposits", "dues_snapshots", "monthly_collections"]
+# Deposit indexes some report query must use: the (owner, date) ones for the sums of an
+# account or loan up to a date, the covering ones for the sums of a month.
+EXPECTED_INDEXES = [
+    "account_deposit_account_date",
+    "loan_deposit_loan_date",
+    "account_deposit_monthly",
+    "loan_deposit_monthly",
+]
+
+
+def _run_reports(iteration):
+    months = get_all_installment_dates(iteration)
+    get_monthly_collections(iteration, months)
+    # The rebuild of a month's collections after a bulk deposit.
+    get_deposit_collections([iteration.id], months[:1])
+    get_analysis_version(iteration)
+    get_accounts_dues(Account.objects.filter(iteration=iteration))
+    get_loans_dues(Loan.objects.filter(iteration=iteration))
+    get_accounts_dues(Account.objects.filter(iteration=iteration), as_of=months[0])
+    get_loans_dues(Loan.objects.filter(iteration=iteration), as_of=months[0])
+    list(get_account_dues_rows())
+    list(get_loan_dues_rows())
+
+
+def _explain(cursor, queries):
+    plans = []
+    for sql in queries:
+        cursor.execute(f"EXPLAIN {sql}")
+        plans.append("\n".join(row[0] for row in cursor.fetchall()))
+    return plans
+
+
+class Command(BaseCommand):
+    help = (
+        "EXPLAIN the report queries of an iteration and fail if any of them scans a whole "
+        "deposit or snapshot table. Sequential scans are disabled while planning, so a scan "
+        "only shows up when no index can serve the query, however small the database is. "
+        "Also fail if a deposit index serves none of them."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--iteration", type=int, help="Defaults to the latest iteration.")
+
+    def handle(self, *args, **options):
+        iterations = Iteration.objects.order_by("-start_date")
+        if options["iteration"]:
+            iterations = iterations.filter(id=options["iteration"])
+        iteration = iterations.first()
+        if iteration is None:
+            raise CommandError("No iteration to check")
+
+        with CaptureQueriesContext(connection) as context:
+            _run_reports(iteration)
+
+        queries = [query["sql"] for query in context.captured_queries]
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute("SET LOCAL enable_seqscan = off")
+            plans = _explain(cursor, queries)
+            # A small iteration is summed through its few owners, and a small table through
+            # whichever index is smallest; plan the queries as for large ones too, where the
+            # sums of a month read the covering indexes.
+            for method in ["nestloop", "mergejoin", "bitmapscan"]:
+                cursor.execute(f"SET LOCAL enable_{method} = off")
+            large_plans = _explain(cursor, queries)
+
+        failures = [
+            f"{sql}\n{plan}"
+            for sql, plan in zip(queries, plans)
+            if any(f"Seq Scan on {table}" in plan for table in LARGE_TABLES)
+        ]
+        if failures:
+            raise CommandError("Sequential scans found:\n\n" + "\n\n".join(failures))
+        unused = [
+            index
+            for index in EXPECTED_INDEXES
+            if not any(f" {index} " in plan for plan in plans + large_plans)
+        ]
+        if unused:
+            raise CommandError(f"Indexes not used by any report query: {', '.join(unused)}")
+        self.stdout.write(
+            f"Checked {len(queries)} queries, no sequential scans and every deposit index used"
+        )
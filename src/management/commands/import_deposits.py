@@ -0,0 +1,61 @@
+import csv
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.core.management.base import CommandError
+
+from src.deposits import IMPORT_COLUMNS
+from src.deposits import import_deposits
+
+
+class Command(BaseCommand):
+    help = (
+        "Import account and loan deposits from a CSV file with the columns "
+        f"{', '.join(IMPORT_COLUMNS)}. kind is account or loan, id the account or loan id "
+        "and date YYYY-MM-DD. Existing deposits and invalid rows are skipped and reported."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("path")
+        parser.add_argument("--user", required=True, help="Username the deposits are created by.")
+        parser.add_argument("--batch-size", type=int, default=1000)
+        parser.add_argument(
+            "--rejects", help="CSV file to write the rejected rows to, with a reason column."
+        )
+
+    def handle(self, *args, **options):
+        try:
+            user = User.objects.get(username=options["user"])
+        except User.DoesNotExist:
+            raise CommandError(f"No user {options['user']}")
+
+        rejects_file = open(options["rejects"], "w", newline="") if options["rejects"] else None
+        if rejects_file is not None:
+            rejects = csv.DictWriter(
+                rejects_file,
+                fieldnames=["line"] + IMPORT_COLUMNS + ["reason"],
+                extrasaction="ignore",
+            )
+            rejects.writeheader()
+
+        def on_reject(line_number, row, reason):
+            if rejects_file is not None:
+                rejects.writerow(dict(row, line=line_number, reason=reason))
+            else:
+                self.stderr.write(f"Line {line_number}: {reason}")
+
+        start = time.perf_counter()
+        try:
+            with open(options["path"], newline="", encoding="utf-8-sig") as csv_file:
+                result = import_deposits(csv_file, user, options["batch_size"], on_reject)
+        finally:
+            if rejects_file is not None:
+                rejects_file.close()
+        elapsed = time.perf_counter() - start
+
+        rows = result["imported"] + result["rejected"]
+        self.stdout.write(
+            f"Imported {result['imported']} deposits, rejected {result['rejected']} rows "
+            f"in {elapsed:.1f}s ({rows / elapsed:.0f} rows/s)"
+        )
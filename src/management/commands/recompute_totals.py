@@ -0,0 +1,43 @@
+from django.core.management.base import BaseCommand
+from django.core.management.base import CommandError
+
+from src.totals import DEPOSIT_TOTALS
+from src.totals import get_drifted_totals
+from src.totals import refresh_totals
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare the deposit totals stored on every account and loan with their deposits, "
+        "and repair the ones that drifted."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--check",
+            action="store_true",
+            help="Only report drifted totals, and fail if there are any.",
+        )
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        drifted_count = 0
+        for deposit_model, (owner_model, _, _) in DEPOSIT_TOTALS.items():
+            name = owner_model._meta.verbose_name.lower()
+            drifted = []
+            for owner_id, stored, actual in get_drifted_totals(deposit_model):
+                self.stdout.write(f"{name} {owner_id}: stored {stored}, actual {actual}")
+                drifted.append(owner_id)
+            drifted_count += len(drifted)
+            if options["check"]:
+                continue
+            batch_size = options["batch_size"]
+            for start in range(0, len(drifted), batch_size):
+                refresh_totals(deposit_model, drifted[start : start + batch_size])
+            if drifted:
+                self.stdout.write(f"Repaired the totals of {len(drifted)} {name}s")
+
+        if options["check"] and drifted_count:
+            raise CommandError(f"{drifted_count} drifted totals")
+        if not drifted_count:
+            self.stdout.write("All totals match the deposits")
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from src.models import Iteration
+from src.rollups import refresh_collections
+
+
+class Command(BaseCommand):
+    help = (
+        "Rebuild the monthly collections of every iteration from the deposits. Deposit "
+        "changes keep them up to date; run this to repair them. Readers see the old rows "
+        "until an iteration is rebuilt."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--iteration", type=int, action="append", help="Can be repeated.")
+
+    def handle(self, *args, **options):
+        iterations = Iteration.objects.order_by("id")
+        if options["iteration"]:
+            iterations = iterations.filter(id__in=options["iteration"])
+        iteration_ids = list(iterations.values_list("id", flat=True))
+        for iteration_id in iteration_ids:
+            refresh_collections([iteration_id])
+        self.stdout.write(f"Refreshed monthly collections of {len(iteration_ids)} iterations")
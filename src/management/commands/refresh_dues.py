@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from src.snapshots import refresh_all_snapshots
+
+
+class Command(BaseCommand):
+    help = (
+        "Rebuild the monthly dues snapshots of every account and loan. Run it once after "
+        "migrating to fill the snapshots table; deposit changes keep it up to date after that. "
+        "Owners of ended iterations get no new rows after the last refresh; the dues lists "
+        "compute those, and owners with no snapshot yet, instead, and running this adds rows "
+        "for them again."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=500)
+
+    def progress(self, model, count):
+        self.stdout.write(f"Refreshed dues snapshots of {count} {model._meta.verbose_name_plural}")
+
+    def handle(self, *args, **options):
+        refresh_all_snapshots(options["batch_size"], self.progress)
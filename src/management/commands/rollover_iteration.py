@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand
+from django.core.management.base import CommandError
+
+from src.models import Iteration
+from src.rollover import rollover_iteration
+
+
+class Command(BaseCommand):
+    help = (
+        "Give every customer of the old iteration the same number of accounts in the new one. "
+        "Accounts the new iteration already has are kept, so this can be re-run safely."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("old", type=int, help="Id of the iteration to copy from.")
+        parser.add_argument("new", type=int, help="Id of the iteration to copy into.")
+        parser.add_argument("--loans", action="store_true", help="Also copy pending loans.")
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def progress(self, model, done, total):
+        self.stdout.write(f"Created {done}/{total} {model._meta.verbose_name_plural.lower()}")
+
+    def handle(self, *args, **options):
+        iterations = Iteration.objects.in_bulk([options["old"], options["new"]])
+        for key in ("old", "new"):
+            if options[key] not in iterations:
+                raise CommandError(f"No iteration {options[key]}")
+        new = iterations[options["new"]]
+        created = rollover_iteration(
+            iterations[options["old"]],
+            new,
+            new.created_by,
+            loans=options["loans"],
+            batch_size=options["batch_size"],
+            progress=self.progress,
+        )
+        self.stdout.write(
+            f"Rolled over {created['accounts']} accounts and {created['loans']} loans "
+            f"into iteration {new.id}"
+        )
@@ -0,0 +1,81 @@
+import os
+import time
+
+from concurrent.futures import FIRST_COMPLETED
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import wait
+from concurrent.futures.process import BrokenProcessPool
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+from django.utils import timezone
+
+from src.jobs import claim_jobs
+from src.jobs import fail_jobs
+from src.jobs import requeue_stale_jobs
+from src.jobs import run_job
+
+
+class Command(BaseCommand):
+    help = "Render queued report jobs in a pool of worker processes."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--workers", type=int, default=os.cpu_count())
+        parser.add_argument(
+            "--poll-interval",
+            type=float,
+            default=5,
+            help="Seconds to wait when the queue is empty.",
+        )
+        parser.add_argument(
+            "--once", action="store_true", help="Exit once the queue is empty instead of polling."
+        )
+        parser.add_argument(
+            "--stale-after",
+            type=int,
+            default=60 * 60,
+            help="Requeue jobs that have been running for longer than this many seconds.",
+        )
+
+    def _work(self, executor, options):
+        """Run jobs until the queue is empty with --once, or return False if the pool breaks."""
+        workers = options["workers"]
+        running = {}
+        while True:
+            job_ids = claim_jobs(workers - len(running)) if len(running) < workers else []
+            if job_ids:
+                # Worker processes are forked; they must open their own connections.
+                connections.close_all()
+            for job_id in job_ids:
+                self.stdout.write(f"Job {job_id} started")
+                running[executor.submit(run_job, job_id)] = job_id
+            if running:
+                done, _ = wait(
+                    running, timeout=options["poll_interval"], return_when=FIRST_COMPLETED
+                )
+                for future in done:
+                    job_id = running.pop(future)
+                    try:
+                        status = future.result()
+                    except BrokenProcessPool:
+                        # Every job in the pool is lost with the process that died.
+                        failed = [job_id, *running.values()]
+                        fail_jobs(failed, "The worker process running the job died.")
+                        self.stderr.write(f"Worker pool broke, jobs {failed} failed")
+                        return False
+                    self.stdout.write(f"Job {job_id} {status}")
+            elif options["once"]:
+                return True
+            else:
+                time.sleep(options["poll_interval"])
+
+    def handle(self, *args, **options):
+        stale_after = timedelta(seconds=options["stale_after"])
+        requeued = requeue_stale_jobs(timezone.now() - stale_after)
+        if requeued:
+            self.stdout.write(f"{requeued} stale jobs requeued")
+        while True:
+            with ProcessPoolExecutor(max_workers=options["workers"]) as executor:
+                if self._work(executor, options):
+                    return
@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from src.benchmark import get_benchmark_user
+from src.benchmark import seed
+
+
+class Command(BaseCommand):
+    help = "Fill the database with synthetic customers, accounts, loans and deposits."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--iterations", type=int, default=1)
+        parser.add_argument("--customers", type=int, default=1000)
+        parser.add_argument("--months", type=int, default=12, help="Months of deposits.")
+        parser.add_argument("--batch-size", type=int, default=5000)
+        parser.add_argument("--seed", type=int, default=0)
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            iterations = seed(
+                get_benchmark_user(),
+                iterations=options["iterations"],
+                customers=options["customers"],
+                months=options["months"],
+                batch_size=options["batch_size"],
+                seed=options["seed"],
+            )
+        self.stdout.write(
+            f"Created {options['customers']} customers in iterations "
+            f"{', '.join(str(iteration.id) for iteration in iterations)}"
+        )
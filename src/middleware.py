@@ -0,0 +1,101 @@
+import heapq
+import itertools
+import json
+import logging
+import threading
+import time
+
+from uuid import uuid4
+
+from django.conf import settings
+from django.db import connection
+from django.utils import timezone
+
+logger = logging.getLogger("src.requests")
+
+# The slowest requests served by this process, as a min-heap so the fastest of
+# them is the one dropped when a slower request comes in.
+_slow_requests = []
+_slow_requests_lock = threading.Lock()
+_counter = itertools.count()
+
+
+def get_slow_requests():
+    with _slow_requests_lock:
+        entries = [entry for _, _, entry in _slow_requests]
+    return sorted(entries, key=lambda entry: entry["duration_ms"], reverse=True)
+
+
+def clear_slow_requests():
+    with _slow_requests_lock:
+        _slow_requests.clear()
+
+
+def _record_slow_request(entry):
+    item = (entry["duration_ms"], next(_counter), entry)
+    with _slow_requests_lock:
+        if len(_slow_requests) < settings.SLOW_REQUESTS_SIZE:
+            heapq.heappush(_slow_requests, item)
+        else:
+            heapq.heappushpop(_slow_requests, item)
+
+
+class QueryTimer:
+    def __init__(self):
+        self.count = 0
+        self.duration = 0
+        self.slowest_duration = 0
+        self.slowest_sql = None
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = time.perf_counter() - start
+            self.count += 1
+            self.duration += duration
+            if duration >= self.slowest_duration:
+                self.slowest_duration = duration
+                self.slowest_sql = sql
+
+
+class RequestTimingMiddleware:
+    """Time every request and its queries.
+
+    The numbers go into the Server-Timing header, a JSON line on the `src.requests`
+    logger and, for the slowest requests, the slow requests page. A streaming response
+    is only timed until its headers are ready, so its entry is marked `streamed`.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        timer = QueryTimer()
+        start = time.perf_counter()
+        with connection.execute_wrapper(timer):
+            response = self.get_response(request)
+        duration = time.perf_counter() - start
+
+        entry = {
+            "request_id": str(uuid4()),
+            "time": timezone.now().isoformat(),
+            "method": request.method,
+            "path": request.path,
+            "status": response.status_code,
+            "streamed": response.streaming,
+            "duration_ms": round(duration * 1000, 2),
+            "queries": timer.count,
+            "db_ms": round(timer.duration * 1000, 2),
+            "slowest_sql": timer.slowest_sql,
+            "slowest_sql_ms": round(timer.slowest_duration * 1000, 2),
+        }
+        response["Server-Timing"] = (
+            f'db;dur={entry["db_ms"]};desc="{timer.count} queries", '
+            f'total;dur={entry["duration_ms"]}'
+        )
+        response["X-Request-Id"] = entry["request_id"]
+        logger.info(json.dumps(entry))
+        _record_slow_request(entry)
+        return response
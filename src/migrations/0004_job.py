@@ -0,0 +1,86 @@
+# Generated by Django 3.0.7 on 2026-10-18 05:47
+import django.contrib.postgres.fields.jsonb
+import django.db.models.deletion
+
+from django.conf import settings
+from django.db import migrations
+from django.db import models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ("src", "0003_iteration_return_amount"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="Job",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True, primary_key=True, serialize=False, verbose_name="ID"
+                    ),
+                ),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+                ("modified_at", models.DateTimeField(auto_now=True)),
+                (
+                    "kind",
+                    models.CharField(
+                        choices=[
+                            ("LOAN_DUES_LIST", "LOAN_DUES_LIST"),
+                            ("ACCOUNT_DUES_LIST", "ACCOUNT_DUES_LIST"),
+                            ("RECEIPT", "RECEIPT"),
+                        ],
+                        max_length=30,
+                    ),
+                ),
+                (
+                    "status",
+                    models.CharField(
+                        choices=[
+                            ("PENDING", "PENDING"),
+                            ("RUNNING", "RUNNING"),
+                            ("DONE", "DONE"),
+                            ("FAILED", "FAILED"),
+                        ],
+                        default="PENDING",
+                        max_length=20,
+                    ),
+                ),
+                (
+                    "params",
+                    django.contrib.postgres.fields.jsonb.JSONField(blank=True, default=dict),
+                ),
+                ("file", models.FileField(blank=True, upload_to="jobs/%Y/%m/")),
+                ("error", models.TextField(blank=True)),
+                ("started_at", models.DateTimeField(blank=True, null=True)),
+                ("finished_at", models.DateTimeField(blank=True, null=True)),
+                (
+                    "created_by",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="job_createdby",
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+                (
+                    "modified_by",
+                    models.ForeignKey(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="job_modifiedby",
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "Job",
+                "verbose_name_plural": "Jobs",
+                "db_table": "jobs",
+            },
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 3.0.7 on 2026-10-18 05:49
+from django.db import migrations
+from django.db import models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("src", "0004_job"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="job",
+            name="kind",
+            field=models.CharField(
+                choices=[
+                    ("LOAN_DUES_LIST", "LOAN_DUES_LIST"),
+                    ("ACCOUNT_DUES_LIST", "ACCOUNT_DUES_LIST"),
+                    ("RECEIPT", "RECEIPT"),
+                    ("RECEIPTS", "RECEIPTS"),
+                ],
+                max_length=30,
+            ),
+        ),
+    ]
@@ -0,0 +1,84 @@
+# Generated by Django 3.0.7 on 2026-10-18 05:51
+import django.db.models.deletion
+
+from django.db import migrations
+from django.db import models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("src", "0005_job_receipts_kind"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="DuesSnapshot",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True, primary_key=True, serialize=False, verbose_name="ID"
+                    ),
+                ),
+                ("month", models.DateField()),
+                ("principal_paid", models.IntegerField()),
+                ("interest_paid", models.IntegerField()),
+                ("penalty_paid", models.IntegerField()),
+                ("principal_dues", models.IntegerField()),
+                ("interest_dues", models.IntegerField()),
+                ("penalty_dues", models.IntegerField()),
+                ("total_dues", models.IntegerField()),
+                ("installments", models.IntegerField()),
+                ("modified_at", models.DateTimeField(auto_now=True)),
+                (
+                    "account",
+                    models.ForeignKey(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="dues_snapshots",
+                        to="src.account",
+                    ),
+                ),
+                (
+                    "loan",
+                    models.ForeignKey(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="dues_snapshots",
+                        to="src.loan",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "Dues Snapshot",
+                "verbose_name_plural": "Dues Snapshots",
+                "db_table": "dues_snapshots",
+            },
+        ),
+        migrations.AddConstraint(
+            model_name="duessnapshot",
+            constraint=models.UniqueConstraint(
+                fields=("account", "month"), name="dues_snapshot_account_month"
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="duessnapshot",
+            constraint=models.UniqueConstraint(
+                fields=("loan", "month"), name="dues_snapshot_loan_month"
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="duessnapshot",
+            constraint=models.CheckConstraint(
+                check=models.Q(
+                    models.Q(("account__isnull", False), ("loan__isnull", True)),
+                    models.Q(("account__isnull", True), ("loan__isnull", False)),
+                    _connector="OR",
+                ),
+                name="dues_snapshot_account_or_loan",
+            ),
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 3.0.7 on 2026-10-18 05:57
+from django.db import migrations
+from django.db import models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("src", "0006_dues_snapshot"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="accountdeposit",
+            index=models.Index(fields=["account", "date"], name="account_deposit_account_date"),
+        ),
+        migrations.AddIndex(
+            model_name="accountdeposit",
+            index=models.Index(
+                fields=["date", "account", "principal", "penalty"], name="account_deposit_monthly"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="duessnapshot",
+            index=models.Index(fields=["month", "total_dues"], name="dues_snapshot_month"),
+        ),
+        migrations.AddIndex(
+            model_name="loandeposit",
+            index=models.Index(fields=["loan", "date"], name="loan_deposit_loan_date"),
+        ),
+        migrations.AddIndex(
+            model_name="loandeposit",
+            index=models.Index(
+                fields=["date", "loan", "principal", "interest", "penalty"],
+                name="loan_deposit_monthly",
+            ),
+        ),
+    ]
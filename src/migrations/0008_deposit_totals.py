@@ -0,0 +1,89 @@
+# Generated by Django 3.0.7 on 2026-10-18 06:29
+from django.db import migrations
+from django.db import models
+
+FILL_ACCOUNT_TOTALS = """
+UPDATE accounts SET
+    total_principal_paid = totals.principal,
+    total_penalty_paid = totals.penalty,
+    deposit_count = totals.count,
+    last_deposit_date = totals.last_date
+FROM (
+    SELECT account_id, SUM(principal) AS principal, SUM(penalty) AS penalty,
+        COUNT(*) AS count, MAX(date) AS last_date
+    FROM account_deposits GROUP BY account_id
+) AS totals
+WHERE accounts.id = totals.account_id
+"""
+
+FILL_LOAN_TOTALS = """
+UPDATE loans SET
+    total_principal_paid = totals.principal,
+    total_interest_paid = totals.interest,
+    total_penalty_paid = totals.penalty,
+    deposit_count = totals.count,
+    last_deposit_date = totals.last_date
+FROM (
+    SELECT loan_id, SUM(principal) AS principal, SUM(interest) AS interest,
+        SUM(penalty) AS penalty, COUNT(*) AS count, MAX(date) AS last_date
+    FROM loan_deposits GROUP BY loan_id
+) AS totals
+WHERE loans.id = totals.loan_id
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("src", "0007_deposit_indexes"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="account",
+            name="deposit_count",
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="account",
+            name="last_deposit_date",
+            field=models.DateField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="account",
+            name="total_penalty_paid",
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="account",
+            name="total_principal_paid",
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="loan",
+            name="deposit_count",
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="loan",
+            name="last_deposit_date",
+            field=models.DateField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="loan",
+            name="total_interest_paid",
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="loan",
+            name="total_penalty_paid",
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="loan",
+            name="total_principal_paid",
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunSQL(FILL_ACCOUNT_TOTALS, migrations.RunSQL.noop),
+        migrations.RunSQL(FILL_LOAN_TOTALS, migrations.RunSQL.noop),
+    ]
@@ -0,0 +1,62 @@
+# Generated by Django 3.0.7 on 2026-10-18 06:32
+import django.db.models.deletion
+
+from django.db import migrations
+from django.db import models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("src", "0008_deposit_totals"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="MonthlyCollection",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True, primary_key=True, serialize=False, verbose_name="ID"
+                    ),
+                ),
+                ("date", models.DateField()),
+                ("account_principal", models.IntegerField(default=0)),
+                ("account_penalty", models.IntegerField(default=0)),
+                ("loan_principal", models.IntegerField(default=0)),
+                ("loan_interest", models.IntegerField(default=0)),
+                ("loan_penalty", models.IntegerField(default=0)),
+                ("modified_at", models.DateTimeField(auto_now=True)),
+                (
+                    "address",
+                    models.ForeignKey(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="collections",
+                        to="src.address",
+                    ),
+                ),
+                (
+                    "iteration",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="collections",
+                        to="src.iteration",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "Monthly Collection",
+                "verbose_name_plural": "Monthly Collections",
+                "db_table": "monthly_collections",
+            },
+        ),
+        migrations.AddConstraint(
+            model_name="monthlycollection",
+            constraint=models.UniqueConstraint(
+                fields=("iteration", "date", "address"), name="monthly_collection_key"
+            ),
+        ),
+    ]
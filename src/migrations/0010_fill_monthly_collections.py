@@ -0,0 +1,38 @@
+from django.db import migrations
+
+# 0009 created the table empty, and the analysis chart reads it.
+FILL_MONTHLY_COLLECTIONS = """
+INSERT INTO monthly_collections (
+    iteration_id, address_id, date, account_principal, account_penalty,
+    loan_principal, loan_interest, loan_penalty, modified_at
+)
+SELECT iteration_id, address_id, date, SUM(account_principal), SUM(account_penalty),
+    SUM(loan_principal), SUM(loan_interest), SUM(loan_penalty), NOW()
+FROM (
+    SELECT accounts.iteration_id, customers.address_id, account_deposits.date,
+        account_deposits.principal AS account_principal,
+        account_deposits.penalty AS account_penalty,
+        0 AS loan_principal, 0 AS loan_interest, 0 AS loan_penalty
+    FROM account_deposits
+    JOIN accounts ON accounts.id = account_deposits.account_id
+    JOIN customers ON customers.id = accounts.customer_id
+    UNION ALL
+    SELECT loans.iteration_id, customers.address_id, loan_deposits.date, 0, 0,
+        loan_deposits.principal, loan_deposits.interest, loan_deposits.penalty
+    FROM loan_deposits
+    JOIN loans ON loans.id = loan_deposits.loan_id
+    JOIN customers ON customers.id = loans.customer_id
+) AS deposits
+GROUP BY iteration_id, address_id, date
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("src", "0009_monthly_collections"),
+    ]
+
+    operations = [
+        migrations.RunSQL(FILL_MONTHLY_COLLECTIONS, migrations.RunSQL.noop),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 3.0.7 on 2026-10-18 07:13
+from django.db import migrations
+from django.db import models
+
+import src.models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("src", "0010_fill_monthly_collections"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="account",
+            name="iteration",
+            field=models.ForeignKey(
+                on_delete=src.models.CASCADE_FROM_OWNER, related_name="accounts", to="src.iteration"
+            ),
+        ),
+        migrations.AlterField(
+            model_name="accountdeposit",
+            name="account",
+            field=models.ForeignKey(
+                on_delete=src.models.CASCADE_FROM_OWNER, related_name="deposits", to="src.account"
+            ),
+        ),
+        migrations.AlterField(
+            model_name="loan",
+            name="iteration",
+            field=models.ForeignKey(
+                on_delete=src.models.CASCADE_FROM_OWNER, related_name="loans", to="src.iteration"
+            ),
+        ),
+        migrations.AlterField(
+            model_name="loandeposit",
+            name="loan",
+            field=models.ForeignKey(
+                on_delete=src.models.CASCADE_FROM_OWNER, related_name="deposits", to="src.loan"
+            ),
+        ),
+    ]
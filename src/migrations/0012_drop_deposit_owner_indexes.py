@@ -0,0 +1,36 @@
+# Generated by Django 3.0.7 on 2026-10-18 07:33
+
+from django.db import migrations
+from django.db import models
+
+import src.models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("src", "0011_owner_cascade"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="accountdeposit",
+            name="account",
+            field=models.ForeignKey(
+                db_index=False,
+                on_delete=src.models.CASCADE_FROM_OWNER,
+                related_name="deposits",
+                to="src.account",
+            ),
+        ),
+        migrations.AlterField(
+            model_name="loandeposit",
+            name="loan",
+            field=models.ForeignKey(
+                db_index=False,
+                on_delete=src.models.CASCADE_FROM_OWNER,
+                related_name="deposits",
+                to="src.loan",
+            ),
+        ),
+    ]
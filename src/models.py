@@ -5,6 +5,13 @@ from django.db import models
 # Create your models here.
 
 
+def CASCADE_FROM_OWNER(collector, field, sub_objs, using):
+    """CASCADE that marks the objects, so their delete signals know the owner goes too."""
+    for obj in sub_objs:
+        obj._owner_deleting = True
+    models.CASCADE(collector, field, sub_objs, using)
+
+
 class BaseModel(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     modified_at = models.DateTimeField(auto_now=True)
@@ -72,7 +79,12 @@ class Customer(BaseModel):
 
 class Account(BaseModel):
     customer = models.ForeignKey(Customer, on_delete=models.CASCADE, related_name="accounts")
-    iteration = models.ForeignKey(Iteration, on_delete=models.CASCADE, related_name="accounts")
+    iteration = models.ForeignKey(Iteration, on_delete=CASCADE_FROM_OWNER, related_name="accounts")
+    # Running totals of the deposits, kept up to date by src.totals.
+    total_principal_paid = models.IntegerField(default=0)
+    total_penalty_paid = models.IntegerField(default=0)
+    deposit_count = models.IntegerField(default=0)
+    last_deposit_date = models.DateField(null=True, blank=True)
 
     def __str__(self):
         return "{}, {}, Account Id: {}".format(self.customer, self.iteration, self.pk)
@@ -87,7 +99,10 @@ class AccountDeposit(BaseModel):
     date = models.DateField()
     principal = models.IntegerField()
     penalty = models.IntegerField()
-    account = models.ForeignKey(Account, on_delete=models.CASCADE, related_name="deposits")
+    # The (account, date) index below serves lookups by account alone too.
+    account = models.ForeignKey(
+        Account, on_delete=CASCADE_FROM_OWNER, related_name="deposits", db_index=False
+    )
 
     def __str__(self):
         customer = self.account.customer
@@ -99,17 +114,30 @@ class AccountDeposit(BaseModel):
         db_table = "account_deposits"
         verbose_name = "Account Deposit"
         verbose_name_plural = "Account Deposits"
+        indexes = [
+            models.Index(fields=["account", "date"], name="account_deposit_account_date"),
+            # Lets the monthly totals be read from the index alone.
+            models.Index(
+                fields=["date", "account", "principal", "penalty"], name="account_deposit_monthly"
+            ),
+        ]
 
 
 class Loan(BaseModel):
     customer = models.ForeignKey(Customer, on_delete=models.CASCADE, related_name="loans")
-    iteration = models.ForeignKey(Iteration, on_delete=models.CASCADE, related_name="loans")
+    iteration = models.ForeignKey(Iteration, on_delete=CASCADE_FROM_OWNER, related_name="loans")
     amount = models.IntegerField()
     status = models.CharField(
         max_length=20,
         choices=[("PENDING", "PENDING"), ("APPROVED", "APPROVED")],
         default="APPROVED",
     )
+    # Running totals of the deposits, kept up to date by src.totals.
+    total_principal_paid = models.IntegerField(default=0)
+    total_interest_paid = models.IntegerField(default=0)
+    total_penalty_paid = models.IntegerField(default=0)
+    deposit_count = models.IntegerField(default=0)
+    last_deposit_date = models.DateField(null=True, blank=True)
 
     def __str__(self):
         return "Loan Id: {}, {}, {}".format(self.pk, self.customer, self.status)
@@ -125,7 +153,10 @@ class LoanDeposit(BaseModel):
     principal = models.IntegerField()
     interest = models.IntegerField()
     penalty = models.IntegerField()
-    loan = models.ForeignKey(Loan, on_delete=models.CASCADE, related_name="deposits")
+    # The (loan, date) index below serves lookups by loan alone too.
+    loan = models.ForeignKey(
+        Loan, on_delete=CASCADE_FROM_OWNER, related_name="deposits", db_index=False
+    )
 
     def __str__(self):
         return "{}, {}, {}, Loan Deposit Id: {}".format(
@@ -136,6 +167,14 @@ class LoanDeposit(BaseModel):
         db_table = "loan_deposits"
         verbose_name = "Loan Deposit"
         verbose_name_plural = "Loan Deposits"
+        indexes = [
+            models.Index(fields=["loan", "date"], name="loan_deposit_loan_date"),
+            # Lets the monthly totals be read from the index alone.
+            models.Index(
+                fields=["date", "loan", "principal", "interest", "penalty"],
+                name="loan_deposit_monthly",
+            ),
+        ]
 
 
 class Receipt(BaseModel):
@@ -150,3 +189,113 @@ class Receipt(BaseModel):
         db_table = "receipts"
         verbose_name = "Receipt"
         verbose_name_plural = "Receipts"
+
+
+class Job(BaseModel):
+    kind = models.CharField(
+        max_length=30,
+        choices=[
+            ("LOAN_DUES_LIST", "LOAN_DUES_LIST"),
+            ("ACCOUNT_DUES_LIST", "ACCOUNT_DUES_LIST"),
+            ("RECEIPT", "RECEIPT"),
+            ("RECEIPTS", "RECEIPTS"),
+        ],
+    )
+    status = models.CharField(
+        max_length=20,
+        choices=[
+            ("PENDING", "PENDING"),
+            ("RUNNING", "RUNNING"),
+            ("DONE", "DONE"),
+            ("FAILED", "FAILED"),
+        ],
+        default="PENDING",
+    )
+    params = pg_fields.JSONField(default=dict, blank=True)
+    file = models.FileField(upload_to="jobs/%Y/%m/", blank=True)
+    error = models.TextField(blank=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.id}, {self.kind}, {self.status}"
+
+    class Meta:
+        db_table = "jobs"
+        verbose_name = "Job"
+        verbose_name_plural = "Jobs"
+
+
+class DuesSnapshot(models.Model):
+    account = models.ForeignKey(
+        Account, on_delete=models.CASCADE, related_name="dues_snapshots", null=True, blank=True
+    )
+    loan = models.ForeignKey(
+        Loan, on_delete=models.CASCADE, related_name="dues_snapshots", null=True, blank=True
+    )
+    month = models.DateField()
+    principal_paid = models.IntegerField()
+    interest_paid = models.IntegerField()
+    penalty_paid = models.IntegerField()
+    principal_dues = models.IntegerField()
+    interest_dues = models.IntegerField()
+    penalty_dues = models.IntegerField()
+    total_dues = models.IntegerField()
+    installments = models.IntegerField()
+    modified_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        owner = f"Account Id: {self.account_id}" if self.account_id else f"Loan Id: {self.loan_id}"
+        return f"{owner}, {self.month}, {self.total_dues}"
+
+    class Meta:
+        db_table = "dues_snapshots"
+        verbose_name = "Dues Snapshot"
+        verbose_name_plural = "Dues Snapshots"
+        indexes = [models.Index(fields=["month", "total_dues"], name="dues_snapshot_month")]
+        constraints = [
+            models.UniqueConstraint(
+                fields=["account", "month"], name="dues_snapshot_account_month"
+            ),
+            models.UniqueConstraint(fields=["loan", "month"], name="dues_snapshot_loan_month"),
+            models.CheckConstraint(
+                check=(
+                    models.Q(account__isnull=False, loan__isnull=True)
+                    | models.Q(account__isnull=True, loan__isnull=False)
+                ),
+                name="dues_snapshot_account_or_loan",
+            ),
+        ]
+
+
+class MonthlyCollection(models.Model):
+    """What the deposits of an iteration's customers at one address added up to on a date.
+
+    Deposits are dated on installment dates, so this is a row per month. Kept up to
+    date by src.rollups.
+    """
+
+    iteration = models.ForeignKey(Iteration, on_delete=models.CASCADE, related_name="collections")
+    address = models.ForeignKey(
+        Address, on_delete=models.CASCADE, related_name="collections", null=True, blank=True
+    )
+    date = models.DateField()
+    account_principal = models.IntegerField(default=0)
+    account_penalty = models.IntegerField(default=0)
+    loan_principal = models.IntegerField(default=0)
+    loan_interest = models.IntegerField(default=0)
+    loan_penalty = models.IntegerField(default=0)
+    modified_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Iteration: {self.iteration_id}, Address: {self.address_id}, {self.date}"
+
+    class Meta:
+        db_table = "monthly_collections"
+        verbose_name = "Monthly Collection"
+        verbose_name_plural = "Monthly Collections"
+        constraints = [
+            models.UniqueConstraint(
+                fields=["iteration", "date", "address"], name="monthly_collection_key"
+            ),
+        ]
@@ -0,0 +1,84 @@
+from typing import NamedTuple
+
+import numpy as np
+
+from src.models import Account
+from src.models import Loan
+
+# The collections an iteration can still expect if every customer pays their dues in
+# full on each remaining installment date. The formulas of src.dues are applied to
+# arrays holding every account or loan of the iteration at once.
+
+
+class IterationState(NamedTuple):
+    account_principal_paid: np.ndarray
+    loan_amount: np.ndarray
+    loan_principal_paid: np.ndarray
+
+
+def load_iteration_state(iteration):
+    """The running totals of the iteration's accounts and approved loans, in two queries."""
+    accounts = Account.objects.filter(iteration=iteration).values_list(
+        "total_principal_paid", flat=True
+    )
+    loans = Loan.objects.filter(iteration=iteration, status="APPROVED").values_list(
+        "amount", "total_principal_paid"
+    )
+    loans = np.array(list(loans), dtype=np.int64).reshape(-1, 2)
+    return IterationState(np.array(list(accounts), dtype=np.int64), loans[:, 0], loans[:, 1])
+
+
+def account_dues_arrays(terms, principal_paid, total_months):
+    """`dues.account_dues_breakdown` of every account: principal and penalty arrays."""
+    installments = np.maximum(total_months - principal_paid // terms.deposit_amount, 0)
+    principal = installments * terms.deposit_amount
+    penalty = np.maximum(installments - 1, 0) * (terms.late_deposit_fine + terms.interest_rate)
+    return principal, penalty
+
+
+def loan_dues_arrays(terms, amount, principal_paid, total_months):
+    """`dues.loan_dues_breakdown` of every loan: principal, interest and penalty arrays."""
+    installment = amount * 0.1
+    principal = np.maximum(installment * total_months - principal_paid, 0)
+    installments = np.maximum((principal / installment).astype(np.int64), 1)
+    balance = amount - principal_paid
+    interest = (installments * balance * terms.interest_rate) / 100
+    penalty = (np.maximum(installments - 1, 0) * balance * terms.late_deposit_fine) / 100
+    return principal.astype(np.int64), interest.astype(np.int64), penalty.astype(np.int64)
+
+
+def project_collections(terms, dates, total_months, state):
+    """Collections expected on each of the installment `dates` after the first `total_months`.
+
+    Returns a dict keyed by date, shaped like `rollups.get_monthly_collections`. Dues in
+    arrears are paid on the first projected date. No loan is repaid more than its amount.
+    """
+    account_paid = state.account_principal_paid.copy()
+    loan_paid = state.loan_principal_paid.copy()
+    collections = {}
+    for month in range(max(0, total_months), len(dates)):
+        # Accounts pay the installment of the month they pay in, loans the ones before it.
+        account_principal, account_penalty = account_dues_arrays(terms, account_paid, month + 1)
+        loan_principal, loan_interest, loan_penalty = loan_dues_arrays(
+            terms, state.loan_amount, loan_paid, month
+        )
+        loan_principal = np.minimum(loan_principal, state.loan_amount - loan_paid)
+        account_paid += account_principal
+        loan_paid += loan_principal
+        collections[dates[month]] = {
+            "account_principal": int(account_principal.sum()),
+            "account_penalty": int(account_penalty.sum()),
+            "loan_principal": int(loan_principal.sum()),
+            "loan_interest": int(loan_interest.sum()),
+            "loan_penalty": int(loan_penalty.sum()),
+        }
+    return collections
+
+
+def get_optimum_interest(deposit_amount, interest_rate, no_of_months):
+    """Interest one account's deposits earn if each compounds until the iteration ends."""
+    # Every deposit is truncated to rupees before summing, so the geometric series is
+    # summed term by term rather than in closed form.
+    growth = (1 + interest_rate / 100) ** np.arange(no_of_months, 0, -1)
+    deposits = (growth * deposit_amount).astype(np.int64)
+    return int(deposits.sum()) - deposit_amount * no_of_months
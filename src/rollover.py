@@ -0,0 +1,65 @@
+from django.db import transaction
+from django.db.models import Count
+
+from src.models import Account
+from src.models import Loan
+from src.snapshots import refresh_account_snapshots
+from src.snapshots import refresh_loan_snapshots
+
+
+def _count_by(queryset, *fields):
+    return {
+        tuple(row[field] for field in fields): row["count"]
+        for row in queryset.values(*fields).annotate(count=Count("id")).order_by()
+    }
+
+
+def _get_missing(old_counts, new_counts):
+    """Yield the key of every row the old iteration has more of than the new one."""
+    for key, count in old_counts.items():
+        for _ in range(count - new_counts.get(key, 0)):
+            yield key
+
+
+def _create_in_batches(model, objs, refresh, batch_size, progress):
+    """Create `objs` in batches, passing the ids of each batch to `refresh` as it commits."""
+    for start in range(0, len(objs), batch_size):
+        with transaction.atomic():
+            created = model.objects.bulk_create(objs[start : start + batch_size])
+            refresh([obj.id for obj in created])
+        if progress is not None:
+            progress(model, start + len(created), len(objs))
+
+
+def rollover_iteration(old, new, user, loans=False, batch_size=1000, progress=None):
+    """Give every customer of `old` as many accounts in `new`, and pending loans if `loans`.
+
+    Only what `new` is still missing is created, so a rollover can be re-run.
+    """
+    accounts = [
+        Account(customer_id=customer_id, iteration=new, created_by=user)
+        for (customer_id,) in _get_missing(
+            _count_by(old.accounts.all(), "customer"), _count_by(new.accounts.all(), "customer")
+        )
+    ]
+    _create_in_batches(Account, accounts, refresh_account_snapshots, batch_size, progress)
+    created = {"accounts": len(accounts), "loans": 0}
+
+    if loans:
+        pending = Loan.objects.filter(status="PENDING")
+        loans = [
+            Loan(
+                customer_id=customer_id,
+                amount=amount,
+                status="PENDING",
+                iteration=new,
+                created_by=user,
+            )
+            for customer_id, amount in _get_missing(
+                _count_by(pending.filter(iteration=old), "customer", "amount"),
+                _count_by(pending.filter(iteration=new), "customer", "amount"),
+            )
+        ]
+        _create_in_batches(Loan, loans, refresh_loan_snapshots, batch_size, progress)
+        created["loans"] = len(loans)
+    return created
@@ -0,0 +1,187 @@
+from collections import defaultdict
+
+from django.db import IntegrityError
+from django.db import transaction
+from django.db.models import F
+from django.db.models import Sum
+
+from src.models import Account
+from src.models import AccountDeposit
+from src.models import Iteration
+from src.models import Loan
+from src.models import LoanDeposit
+from src.models import MonthlyCollection
+
+# The owner of every kind of deposit and the deposit columns collected from it.
+# Each column is stored as `<owner field>_<column>` on MonthlyCollection.
+COLLECTED_DEPOSITS = {
+    AccountDeposit: (Account, "account", ["principal", "penalty"]),
+    LoanDeposit: (Loan, "loan", ["principal", "interest", "penalty"]),
+}
+
+
+def _get_collections(deposit_model, deposits):
+    """The sums of the deposits, keyed by (iteration id, address id, date)."""
+    _, owner_field, columns = COLLECTED_DEPOSITS[deposit_model]
+    totals = (
+        deposits.values(
+            iteration_key=F(f"{owner_field}__iteration"),
+            address_key=F(f"{owner_field}__customer__address"),
+            date_key=F("date"),
+        )
+        .annotate(**{f"{owner_field}_{column}": Sum(column) for column in columns})
+        .order_by()
+    )
+    return {
+        (total.pop("iteration_key"), total.pop("address_key"), total.pop("date_key")): total
+        for total in totals
+    }
+
+
+def _add_to_row(key, totals, sign=1):
+    iteration_id, address_id, date = key
+    rows = MonthlyCollection.objects.filter(
+        iteration_id=iteration_id, address_id=address_id, date=date
+    )
+    changes = {field: F(field) + sign * value for field, value in totals.items()}
+    # Rows without an address are not unique, so only one of them takes the change.
+    if MonthlyCollection.objects.filter(pk__in=rows.values("pk")[:1]).update(**changes):
+        return
+    try:
+        with transaction.atomic():
+            MonthlyCollection.objects.create(
+                iteration_id=iteration_id,
+                address_id=address_id,
+                date=date,
+                **{field: sign * value for field, value in totals.items()},
+            )
+    except IntegrityError:
+        # Another transaction created the row since.
+        rows.update(**changes)
+
+
+def add_to_collection(deposit_model, owner_id, date, amounts, sign=1):
+    """Add a deposit's amounts to its collection, or take them out with `sign` -1."""
+    owner_model, owner_field, columns = COLLECTED_DEPOSITS[deposit_model]
+    iteration_id, address_id = (
+        owner_model.objects.filter(pk=owner_id).values_list("iteration", "customer__address").get()
+    )
+    totals = {f"{owner_field}_{column}": amounts[column] for column in columns}
+    _add_to_row((iteration_id, address_id, date), totals, sign)
+
+
+def remove_collections(deposit_model, deposits):
+    """Take the sums of deposits about to be deleted out of their collections."""
+    for key, totals in _get_collections(deposit_model, deposits).items():
+        _add_to_row(key, totals, -1)
+
+
+def move_collections(deposit_model, deposits, previous_key):
+    """Move the sums of deposits whose customer, iteration or address changed.
+
+    `previous_key` maps the (iteration id, address id, date) key of each sum to the key
+    it was collected under before.
+    """
+    for key, totals in _get_collections(deposit_model, deposits).items():
+        _add_to_row(previous_key(*key), totals, -1)
+        _add_to_row(key, totals)
+
+
+def move_address_collections(address_id):
+    """Move the collections of an address about to be deleted to the rows without one."""
+    fields = [
+        f"{owner_field}_{column}"
+        for _, owner_field, columns in COLLECTED_DEPOSITS.values()
+        for column in columns
+    ]
+    rows = MonthlyCollection.objects.filter(address_id=address_id).values_list(
+        "iteration", "date", *fields
+    )
+    for iteration_id, date, *totals in rows:
+        _add_to_row((iteration_id, None, date), dict(zip(fields, totals)))
+
+
+def get_deposit_collections(iteration_ids, dates=None):
+    """The collections of the iterations summed from their deposits, only on `dates` if given.
+
+    Keyed by (iteration id, address id, date), with every collected column.
+    """
+    collections = defaultdict(dict)
+    for deposit_model, (_, owner_field, _) in COLLECTED_DEPOSITS.items():
+        deposits = deposit_model.objects.filter(**{f"{owner_field}__iteration__in": iteration_ids})
+        if dates is not None:
+            deposits = deposits.filter(date__in=dates)
+        for key, totals in _get_collections(deposit_model, deposits).items():
+            collections[key].update(totals)
+    return collections
+
+
+@transaction.atomic
+def refresh_collections(iteration_ids, dates=None):
+    """Rebuild the collections of the iterations, only on `dates` if given.
+
+    Readers keep seeing the old rows until the rebuild commits. Rebuilds of the same
+    iteration wait for each other, and deposit changes in flight wait for the rebuild.
+    """
+    list(
+        Iteration.objects.select_for_update()
+        .filter(id__in=iteration_ids)
+        .order_by("id")
+        .values_list("id", flat=True)
+    )
+    # Deleting waits for the deposit changes holding a row, so the sums include them.
+    stale = MonthlyCollection.objects.filter(iteration__in=iteration_ids)
+    if dates is not None:
+        stale = stale.filter(date__in=dates)
+    stale.delete()
+    collections = get_deposit_collections(iteration_ids, dates)
+    MonthlyCollection.objects.bulk_create(
+        [
+            MonthlyCollection(iteration_id=iteration_id, address_id=address_id, date=date, **totals)
+            for (iteration_id, address_id, date), totals in collections.items()
+        ]
+    )
+
+
+def refresh_deposit_collections(deposit_model, owner_dates):
+    """Rebuild the collections of the deposits' dates, given as (owner id, date) pairs."""
+    owner_model, _, _ = COLLECTED_DEPOSITS[deposit_model]
+    owner_dates = list(owner_dates)
+    iterations = dict(
+        owner_model.objects.filter(id__in={owner_id for owner_id, _ in owner_dates}).values_list(
+            "id", "iteration"
+        )
+    )
+    dates = defaultdict(set)
+    for owner_id, date in owner_dates:
+        dates[iterations[owner_id]].add(date)
+    for iteration_id, iteration_dates in dates.items():
+        refresh_collections([iteration_id], iteration_dates)
+
+
+def refresh_owner_collections(deposit_model, owner_ids):
+    """Rebuild the collections of every iteration the owners are in."""
+    owner_model, _, _ = COLLECTED_DEPOSITS[deposit_model]
+    iteration_ids = owner_model.objects.filter(id__in=owner_ids).values_list("iteration", flat=True)
+    refresh_collections(list(set(iteration_ids)))
+
+
+def refresh_all_collections():
+    refresh_collections(list(Iteration.objects.values_list("id", flat=True)))
+
+
+def get_monthly_collections(iteration, dates):
+    """The iteration's collections on each of `dates`, summed over its addresses."""
+    collections = (
+        MonthlyCollection.objects.filter(iteration=iteration, date__in=dates)
+        .values("date")
+        .order_by("date")
+        .annotate(
+            account_principal=Sum("account_principal"),
+            account_penalty=Sum("account_penalty"),
+            loan_principal=Sum("loan_principal"),
+            loan_interest=Sum("loan_interest"),
+            loan_penalty=Sum("loan_penalty"),
+        )
+    )
+    return {collection["date"]: collection for collection in collections}
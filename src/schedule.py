@@ -0,0 +1,32 @@
+from datetime import datetime
+from functools import lru_cache
+
+from dateutil import relativedelta
+
+# Every iteration shares a handful of schedules, so they are computed once per
+# process and kept as tuples that callers can't mutate.
+
+
+@lru_cache(maxsize=1024)
+def get_months(start_date, count):
+    """`start_date` followed by the next `count - 1` monthly dates."""
+    return tuple(start_date + relativedelta.relativedelta(months=i) for i in range(count))
+
+
+@lru_cache(maxsize=1024)
+def get_installment_dates(start_date, no_of_months, day_of_payment):
+    return tuple(
+        month.replace(day=day_of_payment) for month in get_months(start_date, no_of_months)
+    )
+
+
+def get_elapsed_months(start_date, current_date=None):
+    current_date = current_date or datetime.today().date()
+    diff = relativedelta.relativedelta(current_date, start_date)
+    return (diff.years * 12) + (diff.months)
+
+
+def match_deposits(months, deposits):
+    """Pair every month with the deposit made on it, or None."""
+    deposits_by_date = {deposit.date: deposit for deposit in deposits}
+    return [(month, deposits_by_date.get(month)) for month in months]
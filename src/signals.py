@@ -0,0 +1,206 @@
+from django.db.models.signals import post_delete
+from django.db.models.signals import post_save
+from django.db.models.signals import pre_delete
+from django.db.models.signals import pre_save
+from django.dispatch import receiver
+
+from src.models import Account
+from src.models import AccountDeposit
+from src.models import Address
+from src.models import Customer
+from src.models import Iteration
+from src.models import Loan
+from src.models import LoanDeposit
+from src.rollups import add_to_collection
+from src.rollups import move_address_collections
+from src.rollups import move_collections
+from src.rollups import remove_collections
+from src.snapshots import refresh_account_snapshots
+from src.snapshots import refresh_iteration_snapshots
+from src.snapshots import refresh_loan_snapshots
+from src.totals import add_deposit
+from src.totals import DEPOSIT_TOTALS
+from src.totals import get_deposit_amounts
+from src.totals import remove_deposit
+
+DEPOSIT_OWNERS = {
+    AccountDeposit: ("account_id", refresh_account_snapshots),
+    LoanDeposit: ("loan_id", refresh_loan_snapshots),
+}
+
+
+def _owner_deleting(instance):
+    # Set by models.CASCADE_FROM_OWNER. The owner's deposits, or the iteration's accounts
+    # and loans, go with it, so there is nothing to refresh for each of them, and
+    # refreshing would write rows that point at the deleted owner.
+    return getattr(instance, "_owner_deleting", False)
+
+
+@receiver(pre_delete, sender=Account)
+@receiver(pre_delete, sender=Loan)
+def remove_deleted_owner_collections(sender, instance, **kwargs):
+    # Before the deposits are gone, and only for the deleted owner's rows.
+    if not _owner_deleting(instance):
+        remove_collections(instance.deposits.model, instance.deposits.all())
+
+
+@receiver(pre_save, sender=AccountDeposit)
+@receiver(pre_save, sender=LoanDeposit)
+def remember_deposit_owner(sender, instance, **kwargs):
+    # An edit can move a deposit to another owner or month, both need refreshing.
+    owner_field, _ = DEPOSIT_OWNERS[sender]
+    _, _, sums = DEPOSIT_TOTALS[sender]
+    instance._previous = None
+    if instance.pk:
+        instance._previous = (
+            sender.objects.filter(pk=instance.pk)
+            .values(owner_field, "date", *sums.values())
+            .first()
+        )
+
+
+@receiver(post_save, sender=AccountDeposit)
+@receiver(post_save, sender=LoanDeposit)
+@receiver(post_delete, sender=AccountDeposit)
+@receiver(post_delete, sender=LoanDeposit)
+def refresh_deposit_snapshots(sender, instance, **kwargs):
+    if _owner_deleting(instance):
+        return
+    owner_field, refresh = DEPOSIT_OWNERS[sender]
+    affected = {getattr(instance, owner_field): instance.date}
+    previous = getattr(instance, "_previous", None)
+    if previous is not None:
+        owner_id, date = previous[owner_field], previous["date"]
+        affected[owner_id] = min(date, affected.get(owner_id, date))
+    for owner_id, date in affected.items():
+        refresh([owner_id], from_date=date)
+
+
+@receiver(post_save, sender=AccountDeposit)
+@receiver(post_save, sender=LoanDeposit)
+def add_deposit_to_collection(sender, instance, **kwargs):
+    owner_field, _ = DEPOSIT_OWNERS[sender]
+    owner_id = getattr(instance, owner_field)
+    amounts = get_deposit_amounts(instance)
+    previous = getattr(instance, "_previous", None)
+    if previous is not None:
+        if (previous[owner_field], previous["date"]) == (owner_id, instance.date):
+            amounts = {column: amount - previous[column] for column, amount in amounts.items()}
+        else:
+            add_to_collection(sender, previous[owner_field], previous["date"], previous, -1)
+    add_to_collection(sender, owner_id, instance.date, amounts)
+
+
+@receiver(post_delete, sender=AccountDeposit)
+@receiver(post_delete, sender=LoanDeposit)
+def remove_deposit_from_collection(sender, instance, **kwargs):
+    if _owner_deleting(instance):
+        return
+    owner_field, _ = DEPOSIT_OWNERS[sender]
+    add_to_collection(
+        sender, getattr(instance, owner_field), instance.date, get_deposit_amounts(instance), -1
+    )
+
+
+@receiver(post_save, sender=AccountDeposit)
+@receiver(post_save, sender=LoanDeposit)
+def add_deposit_to_totals(sender, instance, **kwargs):
+    owner_field, _ = DEPOSIT_OWNERS[sender]
+    previous = getattr(instance, "_previous", None)
+    if previous is not None:
+        remove_deposit(sender, previous[owner_field], previous)
+    add_deposit(instance)
+
+
+@receiver(post_delete, sender=AccountDeposit)
+@receiver(post_delete, sender=LoanDeposit)
+def remove_deposit_from_totals(sender, instance, **kwargs):
+    if _owner_deleting(instance):
+        return
+    owner_field, _ = DEPOSIT_OWNERS[sender]
+    remove_deposit(sender, getattr(instance, owner_field), get_deposit_amounts(instance))
+
+
+# Fields that decide which collections the deposits of a customer, account or loan are in.
+COLLECTION_KEYS = {
+    Customer: ["address_id"],
+    Account: ["customer_id", "iteration_id"],
+    Loan: ["customer_id", "iteration_id"],
+}
+
+
+@receiver(pre_save, sender=Customer)
+@receiver(pre_save, sender=Account)
+@receiver(pre_save, sender=Loan)
+def remember_collection_key(sender, instance, **kwargs):
+    fields = COLLECTION_KEYS[sender]
+    instance._previous_key = None
+    if instance.pk:
+        instance._previous_key = sender.objects.filter(pk=instance.pk).values(*fields).first()
+
+
+@receiver(post_save, sender=Customer)
+@receiver(post_save, sender=Account)
+@receiver(post_save, sender=Loan)
+def move_owner_collections(sender, instance, **kwargs):
+    previous = getattr(instance, "_previous_key", None)
+    if previous is None:
+        return
+    if all(previous[field] == getattr(instance, field) for field in previous):
+        return
+    if sender is Customer:
+        previous_address_id = previous["address_id"]
+        moved = [
+            (AccountDeposit, AccountDeposit.objects.filter(account__customer=instance)),
+            (LoanDeposit, LoanDeposit.objects.filter(loan__customer=instance)),
+        ]
+    else:
+        previous_address_id = (
+            Customer.objects.filter(pk=previous["customer_id"])
+            .values_list("address", flat=True)
+            .get()
+        )
+        moved = [(instance.deposits.model, instance.deposits.all())]
+
+    def previous_key(iteration_id, address_id, date):
+        return previous.get("iteration_id", iteration_id), previous_address_id, date
+
+    for deposit_model, deposits in moved:
+        move_collections(deposit_model, deposits, previous_key)
+
+
+@receiver(pre_delete, sender=Address)
+def move_address_collections_to_no_address(sender, instance, **kwargs):
+    # Its customers are left without one, and its own rows are deleted with it.
+    move_address_collections(instance.pk)
+
+
+@receiver(post_save, sender=Account)
+def refresh_account(sender, instance, **kwargs):
+    refresh_account_snapshots([instance.id])
+
+
+@receiver(post_save, sender=Loan)
+def refresh_loan(sender, instance, **kwargs):
+    refresh_loan_snapshots([instance.id])
+
+
+# Fields of an iteration the dues, and so the snapshots, are computed from.
+DUES_TERMS = ["start_date", "interest_rate", "late_deposit_fine", "deposit_amount", "no_of_months"]
+
+
+@receiver(pre_save, sender=Iteration)
+def remember_dues_terms(sender, instance, **kwargs):
+    instance._previous_terms = None
+    if instance.pk:
+        instance._previous_terms = sender.objects.filter(pk=instance.pk).values(*DUES_TERMS).first()
+
+
+@receiver(post_save, sender=Iteration)
+def refresh_iteration(sender, instance, **kwargs):
+    previous = getattr(instance, "_previous_terms", None)
+    if previous is None:
+        return
+    if all(previous[field] == getattr(instance, field) for field in previous):
+        return
+    refresh_iteration_snapshots(instance)
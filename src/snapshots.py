@@ -0,0 +1,140 @@
+from collections import defaultdict
+from datetime import date
+
+from django.db import connection
+from django.db import transaction
+from django.utils import timezone
+
+from src.dues import account_dues_breakdown
+from src.dues import AccountState
+from src.dues import get_total_months
+from src.dues import loan_dues_breakdown
+from src.dues import LoanState
+from src.models import Account
+from src.models import AccountDeposit
+from src.models import DuesSnapshot
+from src.models import Loan
+from src.models import LoanDeposit
+from src.schedule import get_months
+from src.utils import get_iteration_terms
+
+# A snapshot row holds the dues of one account or loan for one month, as they stand
+# on that month's installment date. The dues functions give the same numbers for
+# every day after the previous installment date up to this one, so the row for
+# `src.utils.get_snapshot_month(iteration)` is the one that matches today's dues.
+
+
+def _get_snapshot_months(iteration):
+    # Rows run to the end of the iteration, or to today if it already ended.
+    last_month = max(iteration.no_of_months, get_total_months(iteration.start_date, date.today()))
+    return enumerate(get_months(iteration.start_date, last_month + 1))
+
+
+def _build_snapshots(owner_field, owner, deposits, from_month=None):
+    iteration = owner.iteration
+    terms = get_iteration_terms(iteration)
+    snapshots = []
+    deposits = iter(deposits)
+    deposit = next(deposits, None)
+    principal_paid = interest_paid = penalty_paid = 0
+    for total_months, month in _get_snapshot_months(iteration):
+        while deposit is not None and deposit.date <= month:
+            principal_paid += deposit.principal
+            interest_paid += getattr(deposit, "interest", 0)
+            penalty_paid += deposit.penalty
+            deposit = next(deposits, None)
+        if from_month is not None and month < from_month:
+            continue
+        if owner_field == "loan":
+            dues = loan_dues_breakdown(
+                terms, LoanState(owner.amount, principal_paid), total_months - 1
+            )
+        else:
+            dues = account_dues_breakdown(terms, AccountState(principal_paid), total_months)
+        snapshots.append(
+            {
+                f"{owner_field}_id": owner.id,
+                "month": month,
+                "principal_paid": principal_paid,
+                "interest_paid": interest_paid,
+                "penalty_paid": penalty_paid,
+                "principal_dues": dues.principal,
+                "interest_dues": getattr(dues, "interest", 0),
+                "penalty_dues": dues.penalty,
+                "total_dues": dues.total,
+                "installments": dues.installments,
+            }
+        )
+    return snapshots
+
+
+def _insert_snapshots(snapshots, batch_size=5000):
+    # A refresh can write hundreds of thousands of rows. bulk_create spends most
+    # of that time preparing every field of every model instance, while these
+    # rows are only dates and integers, so the INSERT is built here.
+    columns = [
+        field.column for field in DuesSnapshot._meta.concrete_fields if not field.primary_key
+    ]
+    row_sql = f"({', '.join(['%s'] * len(columns))})"
+    now = timezone.now()
+    with connection.cursor() as cursor:
+        for start in range(0, len(snapshots), batch_size):
+            batch = snapshots[start : start + batch_size]
+            cursor.execute(
+                f"INSERT INTO {DuesSnapshot._meta.db_table} ({', '.join(columns)}) "
+                f"VALUES {', '.join([row_sql] * len(batch))}",
+                [
+                    now if column == "modified_at" else snapshot.get(column)
+                    for snapshot in batch
+                    for column in columns
+                ],
+            )
+
+
+def _refresh_snapshots(owner_model, deposit_model, owner_field, owner_ids, from_date=None):
+    owners = owner_model.objects.filter(id__in=owner_ids).select_related("iteration")
+    deposits = defaultdict(list)
+    owner_deposits = deposit_model.objects.filter(**{f"{owner_field}__in": owner_ids})
+    for deposit in owner_deposits.order_by("date"):
+        deposits[getattr(deposit, f"{owner_field}_id")].append(deposit)
+
+    snapshots = []
+    stale = DuesSnapshot.objects.filter(**{f"{owner_field}__in": owner_ids})
+    if from_date is not None:
+        stale = stale.filter(month__gte=from_date)
+    for owner in owners:
+        snapshots += _build_snapshots(owner_field, owner, deposits[owner.id], from_date)
+    with transaction.atomic():
+        stale.delete()
+        _insert_snapshots(snapshots)
+
+
+def refresh_account_snapshots(account_ids, from_date=None):
+    """Rebuild the snapshots of the accounts, only from `from_date` on if given."""
+    _refresh_snapshots(Account, AccountDeposit, "account", account_ids, from_date)
+
+
+def refresh_loan_snapshots(loan_ids, from_date=None):
+    """Rebuild the snapshots of the loans, only from `from_date` on if given."""
+    _refresh_snapshots(Loan, LoanDeposit, "loan", loan_ids, from_date)
+
+
+def _refresh_in_batches(refresh, owners, batch_size):
+    ids = list(owners.order_by("id").values_list("id", flat=True))
+    for start in range(0, len(ids), batch_size):
+        refresh(ids[start : start + batch_size])
+    return len(ids)
+
+
+def refresh_all_snapshots(batch_size=500, progress=None):
+    """Rebuild the snapshots of every account and loan, `batch_size` owners at a time."""
+    for model, refresh in ((Account, refresh_account_snapshots), (Loan, refresh_loan_snapshots)):
+        count = _refresh_in_batches(refresh, model.objects.all(), batch_size)
+        if progress is not None:
+            progress(model, count)
+
+
+def refresh_iteration_snapshots(iteration, batch_size=500):
+    """Rebuild the snapshots of the iteration's accounts and loans, in batches."""
+    _refresh_in_batches(refresh_account_snapshots, iteration.accounts.all(), batch_size)
+    _refresh_in_batches(refresh_loan_snapshots, iteration.loans.all(), batch_size)
@@ -0,0 +1,1420 @@
+import csv
+import importlib
+import io
+import json
+import os
+import pickle
+import tempfile
+import threading
+import time
+
+from collections import defaultdict
+from datetime import date
+from datetime import timedelta
+from unittest import mock
+
+from dateutil import relativedelta
+from django.contrib.auth.models import Permission
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection
+from django.db import DatabaseError
+from django.db import transaction
+from django.db.models import F
+from django.http import HttpResponse
+from django.test import override_settings
+from django.test import TestCase
+from django.test import TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from src.benchmark import seed
+from src.deposits import create_deposits
+from src.dues import account_dues_breakdown
+from src.dues import AccountState
+from src.dues import get_total_months
+from src.dues import loan_dues_breakdown
+from src.dues import LoanState
+from src.jobs import claim_jobs
+from src.jobs import DUES_ROWS
+from src.jobs import enqueue_job
+from src.jobs import get_customer_ranges
+from src.jobs import get_sharded_dues_rows
+from src.jobs import run_job
+from src.middleware import clear_slow_requests
+from src.middleware import get_slow_requests
+from src.models import Account
+from src.models import AccountDeposit
+from src.models import Address
+from src.models import Customer
+from src.models import DuesSnapshot
+from src.models import Iteration
+from src.models import Job
+from src.models import Loan
+from src.models import LoanDeposit
+from src.models import MonthlyCollection
+from src.models import Receipt
+from src.projection import get_optimum_interest
+from src.projection import load_iteration_state
+from src.projection import project_collections
+from src.schedule import get_installment_dates
+from src.schedule import get_months
+from src.utils import annotate_account_dues
+from src.utils import annotate_customer_dues
+from src.utils import annotate_loan_dues
+from src.utils import create_receipts
+from src.utils import generate_dues_pdf_response
+from src.utils import get_account_dues
+from src.utils import get_account_dues_rows
+from src.utils import get_account_installments
+from src.utils import get_accounts_dues
+from src.utils import get_address_report
+from src.utils import get_all_installment_dates
+from src.utils import get_analysis_version
+from src.utils import get_current_snapshots
+from src.utils import get_iteration_terms
+from src.utils import get_loan_dues
+from src.utils import get_loan_dues_rows
+from src.utils import get_loans_dues
+from src.utils import get_snapshot_month
+
+
+class BookMixin:
+    def setUp(self):
+        self.user = User.objects.create_superuser("admin", "admin@example.com", "admin")
+        self.address = Address.objects.create(name="Village", created_by=self.user)
+        start_date = date.today().replace(day=15) - relativedelta.relativedelta(months=6)
+        self.iteration = Iteration.objects.create(
+            start_date=start_date,
+            interest_rate=2,
+            no_of_months=20,
+            deposit_amount=500,
+            late_deposit_fine=1,
+            is_active=True,
+            day_of_payment=15,
+            return_amount=12000,
+            created_by=self.user,
+        )
+
+    def create_customers(self, count):
+        for i in range(count):
+            customer = Customer.objects.create(
+                name=f"Customer {i}",
+                address=self.address,
+                phone_number="9999999999",
+                created_by=self.user,
+            )
+            account = Account.objects.create(
+                customer=customer, iteration=self.iteration, created_by=self.user
+            )
+            loan = Loan.objects.create(
+                customer=customer, iteration=self.iteration, amount=10000, created_by=self.user
+            )
+            for month in range(i % 5):
+                deposit_date = self.iteration.start_date + relativedelta.relativedelta(months=month)
+                AccountDeposit.objects.create(
+                    date=deposit_date,
+                    principal=500,
+                    penalty=0,
+                    account=account,
+                    created_by=self.user,
+                )
+                LoanDeposit.objects.create(
+                    date=deposit_date,
+                    principal=1000,
+                    interest=200,
+                    penalty=0,
+                    loan=loan,
+                    created_by=self.user,
+                )
+
+
+class BookTestCase(BookMixin, TestCase):
+    pass
+
+
+class BulkDuesTest(BookTestCase):
+    def test_loans_dues_match_per_loan_dues(self):
+        self.create_customers(6)
+        loans_dues = get_loans_dues(Loan.objects.all())
+        for loan in Loan.objects.all():
+            dues = loans_dues[loan.id]
+            self.assertEqual(dues["total"], get_loan_dues(loan))
+            self.assertEqual(dues["principal"], get_loan_dues(loan, principal=True))
+            self.assertEqual(dues["interest"], get_loan_dues(loan, interest=True))
+            self.assertEqual(dues["penalty"], get_loan_dues(loan, penalty=True))
+            self.assertEqual(dues["installments"], get_loan_dues(loan, installments=True))
+
+    def test_accounts_dues_match_per_account_dues(self):
+        self.create_customers(6)
+        accounts_dues = get_accounts_dues(Account.objects.all())
+        for account in Account.objects.all():
+            dues = accounts_dues[account.id]
+            self.assertEqual(dues["total"], get_account_dues(account))
+            self.assertEqual(dues["principal"], get_account_dues(account, principal=True))
+            self.assertEqual(dues["penalty"], get_account_dues(account, penalty=True))
+            self.assertEqual(dues["installments"], get_account_dues(account, installments=True))
+
+    def test_bulk_dues_query_count(self):
+        self.create_customers(2)
+        with self.assertNumQueries(1):
+            get_loans_dues(Loan.objects.all())
+        with self.assertNumQueries(1):
+            get_accounts_dues(Account.objects.all())
+        self.create_customers(8)
+        with self.assertNumQueries(1):
+            get_loans_dues(Loan.objects.all())
+        with self.assertNumQueries(1):
+            get_accounts_dues(Account.objects.all())
+
+
+class DuesAnnotationTest(BookTestCase):
+    def test_loan_annotations_match_bulk_dues(self):
+        self.create_customers(6)
+        loans_dues = get_loans_dues(Loan.objects.all())
+        for loan in annotate_loan_dues(Loan.objects.all()):
+            dues = loans_dues[loan.id]
+            self.assertEqual(loan.dues_principal, dues["principal"])
+            self.assertEqual(loan.dues_interest, dues["interest"])
+            self.assertEqual(loan.dues_penalty, dues["penalty"])
+            self.assertEqual(loan.dues_total, dues["total"])
+
+    def test_account_annotations_match_bulk_dues(self):
+        self.create_customers(6)
+        accounts_dues = get_accounts_dues(Account.objects.all())
+        for account in annotate_account_dues(Account.objects.all()):
+            dues = accounts_dues[account.id]
+            self.assertEqual(account.dues_principal, dues["principal"])
+            self.assertEqual(account.dues_penalty, dues["penalty"])
+            self.assertEqual(account.dues_total, dues["total"])
+
+    def test_customer_annotations_sum_account_and_loan_dues(self):
+        self.create_customers(6)
+        accounts_dues = get_accounts_dues(Account.objects.all())
+        loans_dues = get_loans_dues(Loan.objects.all())
+        for customer in annotate_customer_dues(Customer.objects.all()):
+            account_dues = sum(
+                accounts_dues[account.id]["total"] for account in customer.accounts.all()
+            )
+            loan_dues = sum(loans_dues[loan.id]["total"] for loan in customer.loans.all())
+            self.assertEqual(customer.account_dues_total, account_dues)
+            self.assertEqual(customer.loan_dues_total, loan_dues)
+            self.assertEqual(customer.dues_total, account_dues + loan_dues)
+
+
+class ChangelistQueryCountTest(BookTestCase):
+    changelists = [
+        "admin:src_customer_changelist",
+        "admin:src_account_changelist",
+        "admin:src_loan_changelist",
+        "admin:src_accountdeposit_changelist",
+        "admin:src_loandeposit_changelist",
+        "admin:src_receipt_changelist",
+    ]
+
+    def create_customers(self, count):
+        super().create_customers(count)
+        for customer in Customer.objects.filter(receipts__isnull=True):
+            Receipt.objects.create(customer=customer, detail={}, created_by=self.user)
+
+    def get_query_counts(self):
+        query_counts = {}
+        for changelist in self.changelists:
+            with CaptureQueriesContext(connection) as context:
+                response = self.client.get(reverse(changelist))
+            self.assertEqual(response.status_code, 200)
+            query_counts[changelist] = len(context.captured_queries)
+        return query_counts
+
+    def test_changelist_query_count_does_not_grow_with_rows(self):
+        self.client.force_login(self.user)
+        self.create_customers(2)
+        query_counts = self.get_query_counts()
+        self.create_customers(10)
+        self.assertEqual(self.get_query_counts(), query_counts)
+
+    def test_customer_changelist_count_skips_the_dues(self):
+        self.client.force_login(self.user)
+        self.create_customers(2)
+        with CaptureQueriesContext(connection) as context:
+            self.client.get(reverse("admin:src_customer_changelist"))
+        (count_sql,) = [
+            query["sql"]
+            for query in context.captured_queries
+            if query["sql"].startswith("SELECT COUNT(*)") and '"customers"' in query["sql"]
+        ][:1]
+        with connection.cursor() as cursor:
+            cursor.execute(f"EXPLAIN {count_sql}")
+            plan = "\n".join(row[0] for row in cursor.fetchall())
+        # The dues and counts are not needed to count customers, so the planner drops them.
+        self.assertNotIn("accounts", plan)
+        self.assertNotIn("loans", plan)
+
+
+class DuesListTest(BookTestCase):
+    def test_loan_dues_rows_list_loans_with_dues(self):
+        self.create_customers(6)
+        loans_dues = get_loans_dues(Loan.objects.all())
+        rows = list(get_loan_dues_rows())
+        expected = [
+            loan.id
+            for loan in Loan.objects.order_by("customer", "id")
+            if loans_dues[loan.id]["total"]
+        ]
+        self.assertEqual([row[4] for row in rows[1:]], expected)
+        for row in rows[1:]:
+            dues = loans_dues[row[4]]
+            self.assertEqual(row[5:], [dues["principal"], dues["interest"], dues["penalty"]])
+
+    def test_owners_without_a_current_snapshot_stay_listed(self):
+        self.create_customers(6)
+        loan_rows = list(get_loan_dues_rows())
+        account_rows = list(get_account_dues_rows())
+        # As after an iteration has ended and a month passed since the last refresh.
+        DuesSnapshot.objects.filter(
+            loan__in=[row[4] for row in loan_rows[1:3]],
+            month=get_snapshot_month(self.iteration),
+        ).delete()
+        DuesSnapshot.objects.filter(account__isnull=False).delete()
+        self.assertEqual(list(get_loan_dues_rows()), loan_rows)
+        self.assertEqual(list(get_account_dues_rows()), account_rows)
+
+    def test_dues_list_pdf_has_a_page_per_block_of_rows(self):
+        rows = [["Serial", "Name"]] + [[i, f"Customer {i}"] for i in range(200)]
+        response = HttpResponse(content_type="application/pdf")
+        generate_dues_pdf_response(response, data=iter(rows), header_text="Dues List")
+        self.assertGreater(response.content.count(b"/Type /Page\n"), 1)
+
+
+def _kill_worker(job_id):
+    os._exit(1)
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class JobTest(BookTestCase):
+    def test_dues_list_action_queues_a_job(self):
+        self.client.force_login(self.user)
+        customer = Customer.objects.create(
+            name="Customer", address=self.address, phone_number="9999999999", created_by=self.user
+        )
+        response = self.client.post(
+            reverse("admin:src_customer_changelist"),
+            {"action": "generate_loan_dues_list", "_selected_action": [customer.id]},
+        )
+        job = Job.objects.get()
+        self.assertRedirects(response, reverse("admin:src_job_change", args=[job.id]))
+        self.assertEqual((job.kind, job.status), ("LOAN_DUES_LIST", "PENDING"))
+
+    def test_run_job_stores_the_pdf(self):
+        self.create_customers(3)
+        job = enqueue_job("ACCOUNT_DUES_LIST", self.user)
+        self.assertEqual(claim_jobs(5), [job.id])
+        self.assertEqual(claim_jobs(5), [])
+        self.assertEqual(run_job(job.id), "DONE")
+        self.client.force_login(self.user)
+        response = self.client.get(reverse("admin:src_job_download", args=[job.id]))
+        self.assertTrue(b"".join(response.streaming_content).startswith(b"%PDF"))
+
+    def test_download_needs_the_view_permission(self):
+        job = enqueue_job("ACCOUNT_DUES_LIST", self.user)
+        claim_jobs(1)
+        run_job(job.id)
+        url = reverse("admin:src_job_download", args=[job.id])
+        staff = User.objects.create_user("staff", password="staff", is_staff=True)
+        self.client.force_login(staff)
+        self.assertEqual(self.client.get(url).status_code, 403)
+        staff.user_permissions.add(Permission.objects.get(codename="view_job"))
+        self.assertEqual(self.client.get(url).status_code, 200)
+
+    def test_run_jobs_fails_the_jobs_of_a_dead_worker(self):
+        stale = enqueue_job("ACCOUNT_DUES_LIST", self.user)
+        Job.objects.filter(id=stale.id).update(
+            status="RUNNING", started_at=timezone.now() - timedelta(hours=2)
+        )
+        job = enqueue_job("ACCOUNT_DUES_LIST", self.user)
+        # The test's connection has to stay open, and the forked workers never use it.
+        with mock.patch("src.management.commands.run_jobs.connections"), mock.patch(
+            "src.management.commands.run_jobs.run_job", _kill_worker
+        ):
+            call_command(
+                "run_jobs", "--once", "--workers=1", stdout=io.StringIO(), stderr=io.StringIO()
+            )
+        self.assertEqual(
+            list(Job.objects.order_by("id").values_list("status", flat=True)), ["FAILED"] * 2
+        )
+        self.assertIn("died", Job.objects.get(id=job.id).error)
+
+    def test_sharded_dues_rows_match_the_serial_list(self):
+        self.create_customers(7)
+        as_of = self.iteration.start_date + relativedelta.relativedelta(months=2)
+        self.assertEqual(len(get_customer_ranges(3)), 3)
+        for kind, rows in DUES_ROWS.items():
+            for when in (None, as_of):
+                self.assertEqual(
+                    list(get_sharded_dues_rows(kind, when, shards=3)), list(rows(when))
+                )
+
+
+class BulkReceiptTest(BookTestCase):
+    def test_create_receipts_for_many_customers(self):
+        self.create_customers(3)
+        this_month = date.today().replace(day=15)
+        customer = Customer.objects.order_by("id").first()
+        AccountDeposit.objects.create(
+            date=this_month,
+            principal=500,
+            penalty=10,
+            account=customer.accounts.get(),
+            created_by=self.user,
+        )
+        LoanDeposit.objects.create(
+            date=this_month,
+            principal=1000,
+            interest=200,
+            penalty=0,
+            loan=customer.loans.get(),
+            created_by=self.user,
+        )
+        # Savepoint, customers, two deposit totals, receipts, accounts, links, release.
+        with self.assertNumQueries(8):
+            receipts = create_receipts(Customer.objects.order_by("id"), self.user)
+        self.assertEqual(len(receipts), 3)
+        receipt = Receipt.objects.get(customer=customer)
+        self.assertEqual(list(receipt.accounts.all()), list(customer.accounts.all()))
+        self.assertEqual(
+            receipt.detail,
+            {
+                "Account Credit": [1, 500],
+                "Account Penalty": [1, 10],
+                "Loan Principal": [1, 1000],
+                "Loan Interest": [1, 200],
+                "Loan Penalty": [0, 0],
+            },
+        )
+
+
+class DuesSnapshotTest(BookTestCase):
+    def assertSnapshotsMatchDues(self):
+        loans_dues = get_loans_dues(Loan.objects.all())
+        snapshots = get_current_snapshots("loan")
+        self.assertEqual(
+            {snapshot.loan_id: snapshot.total_dues for snapshot in snapshots},
+            {loan_id: dues["total"] for loan_id, dues in loans_dues.items()},
+        )
+        accounts_dues = get_accounts_dues(Account.objects.all())
+        snapshots = get_current_snapshots("account")
+        self.assertEqual(
+            {snapshot.account_id: snapshot.principal_dues for snapshot in snapshots},
+            {account_id: dues["principal"] for account_id, dues in accounts_dues.items()},
+        )
+
+    def test_snapshots_follow_deposit_changes(self):
+        self.create_customers(5)
+        self.assertSnapshotsMatchDues()
+        deposit = LoanDeposit.objects.order_by("id").first()
+        deposit.loan = Loan.objects.exclude(id=deposit.loan_id).first()
+        deposit.save()
+        self.assertSnapshotsMatchDues()
+        AccountDeposit.objects.order_by("id").first().delete()
+        self.assertSnapshotsMatchDues()
+
+    def test_iteration_saves_refresh_snapshots_only_when_the_terms_change(self):
+        self.create_customers(5)
+        self.iteration.is_active = False
+        with mock.patch("src.signals.refresh_iteration_snapshots") as refresh:
+            self.iteration.save()
+        refresh.assert_not_called()
+        self.iteration.late_deposit_fine = 3
+        with mock.patch("src.snapshots.refresh_account_snapshots") as refresh:
+            self.iteration.save()
+        self.assertEqual([len(ids) for (ids,), _ in refresh.call_args_list], [5])
+        self.iteration.interest_rate = 3
+        self.iteration.save()
+        self.assertSnapshotsMatchDues()
+
+    def test_refresh_dues_rebuilds_snapshots(self):
+        self.create_customers(5)
+        DuesSnapshot.objects.all().delete()
+        call_command("refresh_dues", stdout=io.StringIO())
+        self.assertSnapshotsMatchDues()
+        loan = Loan.objects.order_by("id").last()
+        snapshot = loan.dues_snapshots.get(month=get_snapshot_month(self.iteration))
+        self.assertEqual(snapshot.principal_paid, 4000)
+        self.assertEqual(snapshot.interest_paid, 800)
+
+
+class AnalysisTest(BookTestCase):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+
+    def test_analysis_only_counts_the_iteration_deposits(self):
+        self.create_customers(3)
+        other_iteration = Iteration.objects.create(
+            start_date=self.iteration.start_date,
+            interest_rate=2,
+            no_of_months=20,
+            deposit_amount=500,
+            late_deposit_fine=1,
+            is_active=False,
+            day_of_payment=15,
+            return_amount=12000,
+            created_by=self.user,
+        )
+        loan = Loan.objects.create(
+            customer=Customer.objects.first(),
+            iteration=other_iteration,
+            amount=10000,
+            created_by=self.user,
+        )
+        LoanDeposit.objects.create(
+            date=self.iteration.start_date,
+            principal=1000,
+            interest=5000,
+            penalty=0,
+            loan=loan,
+            created_by=self.user,
+        )
+        self.client.force_login(self.user)
+        response = self.client.get(reverse("analysis_data", args=[self.iteration.id]))
+        series = response.json()
+        self.assertEqual(series["dates"][0], self.iteration.start_date.isoformat())
+        # Customers 1 and 2 paid interest of 200 in their first month.
+        self.assertEqual(series["interest"][0], 400)
+        self.assertEqual(series["interest"][-1], 600)
+        self.assertEqual(len(series["optimum"]), self.iteration.no_of_months)
+
+    def test_analysis_is_cached_until_a_deposit_changes(self):
+        self.create_customers(3)
+        self.client.force_login(self.user)
+        url = reverse("analysis_data", args=[self.iteration.id])
+        self.client.get(url)
+        with CaptureQueriesContext(connection) as cached:
+            response = self.client.get(url)
+        self.assertEqual(response.json()["interest"][-1], 600)
+        deposit = LoanDeposit.objects.order_by("id").first()
+        deposit.interest = 300
+        deposit.save()
+        with CaptureQueriesContext(connection) as uncached:
+            response = self.client.get(url)
+        self.assertEqual(response.json()["interest"][-1], 700)
+        self.assertLess(len(cached), len(uncached))
+
+    def test_analysis_version_is_computed_once_per_request(self):
+        self.client.force_login(self.user)
+        with mock.patch("src.views.get_analysis_version", wraps=get_analysis_version) as version:
+            self.client.get(reverse("analysis_data", args=[self.iteration.id]))
+        self.assertEqual(version.call_count, 1)
+
+    def test_analysis_data_supports_conditional_and_gzip_requests(self):
+        self.create_customers(3)
+        self.client.force_login(self.user)
+        url = reverse("analysis_data", args=[self.iteration.id])
+        response = self.client.get(url, HTTP_ACCEPT_ENCODING="gzip")
+        self.assertEqual(response["Content-Encoding"], "gzip")
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=response["ETag"])
+        self.assertEqual(response.status_code, 304)
+        LoanDeposit.objects.order_by("id").first().delete()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=response["ETag"])
+        self.assertEqual(response.status_code, 200)
+
+    def test_analysis_of_an_iteration_starting_next_month(self):
+        self.create_customers(2)
+        self.iteration.start_date = date.today() + relativedelta.relativedelta(months=1)
+        self.iteration.save()
+        self.assertLess(get_total_months(self.iteration.start_date, date.today()), 0)
+        terms = get_iteration_terms(self.iteration)
+        dates = get_all_installment_dates(self.iteration)
+        state = load_iteration_state(self.iteration)
+        self.assertEqual(
+            project_collections(terms, dates, -1, state),
+            project_collections(terms, dates, 0, state),
+        )
+        self.client.force_login(self.user)
+        response = self.client.get(reverse("analysis_data", args=[self.iteration.id]))
+        self.assertEqual(response.status_code, 200)
+        series = response.json()
+        self.assertEqual(series["interest"][-1], 0)
+        self.assertEqual(len(series["projectedInterest"]), self.iteration.no_of_months)
+        self.assertNotIn(None, series["projectedInterest"])
+
+    def test_analysis_page_loads_the_data_separately(self):
+        self.client.force_login(self.user)
+        response = self.client.get(reverse("analysis", args=[self.iteration.id]))
+        self.assertContains(response, reverse("analysis_data", args=[self.iteration.id]))
+
+
+class ScheduleTest(BookTestCase):
+    def test_months_are_computed_once(self):
+        get_months.cache_clear()
+        months = get_months(date(2020, 1, 31), 3)
+        self.assertEqual(months, (date(2020, 1, 31), date(2020, 2, 29), date(2020, 3, 31)))
+        self.assertIs(get_months(date(2020, 1, 31), 3), months)
+        self.assertEqual(
+            get_installment_dates(date(2020, 1, 31), 3, 10),
+            (date(2020, 1, 10), date(2020, 2, 10), date(2020, 3, 10)),
+        )
+
+    def test_installments_table_shows_each_month_deposit(self):
+        self.create_customers(3)
+        account = Account.objects.order_by("id").last()
+        rows = get_account_installments(account).split("</tr>")[:-1]
+        self.assertEqual(len(rows), 7)
+        self.assertEqual(sum("<td>500<td>" in row for row in rows), 2)
+
+
+class QueryPlanTest(BookTestCase):
+    def seed_book(self):
+        # Enough rows, with fresh statistics, for the planner to tell the indexes apart.
+        (iteration,) = seed(self.user, customers=500)
+        with connection.cursor() as cursor:
+            cursor.execute("ANALYZE")
+        return iteration
+
+    def test_report_queries_use_indexes(self):
+        iteration = self.seed_book()
+        output = io.StringIO()
+        call_command("check_query_plans", iteration=iteration.id, stdout=output)
+        self.assertIn("no sequential scans", output.getvalue())
+
+    def test_missing_index_fails_the_check(self):
+        self.create_customers(5)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT indexname FROM pg_indexes "
+                "WHERE tablename = 'loan_deposits' AND indexname != 'loan_deposits_pkey'"
+            )
+            for (index,) in cursor.fetchall():
+                cursor.execute(f'DROP INDEX "{index}"')
+        with self.assertRaisesMessage(CommandError, "Seq Scan on loan_deposits"):
+            call_command("check_query_plans", stdout=io.StringIO())
+
+    def test_unused_index_fails_the_check(self):
+        iteration = self.seed_book()
+        with connection.cursor() as cursor:
+            cursor.execute('DROP INDEX "account_deposit_monthly"')
+        with self.assertRaisesMessage(
+            CommandError, "Indexes not used by any report query: account_deposit_monthly"
+        ):
+            call_command("check_query_plans", iteration=iteration.id, stdout=io.StringIO())
+
+
+class BenchmarkTest(BookTestCase):
+    def test_benchmark_reports_every_path_as_json(self):
+        cache.set("kept", 1)
+        output = io.StringIO()
+        call_command("benchmark", sizes=[20], receipts=0, stdout=output, stderr=io.StringIO())
+        results = json.loads(output.getvalue())["sizes"]["20"]
+        self.assertEqual(results["admin:src_account_changelist"]["status"], 200)
+        self.assertEqual(results["loan_dues_list"]["status"], "DONE")
+        self.assertEqual(results["dues_kernel"]["accounts"], 20)
+        self.assertEqual(results["dues_kernel"]["queries"], 0)
+        self.assertEqual(results["create_receipts"]["receipts"], 20)
+        self.assertEqual(results["analysis_data"]["status"], 200)
+        self.assertLess(
+            results["analysis_data_cached"]["queries"], results["analysis_data"]["queries"]
+        )
+        # The seeded data is rolled back.
+        self.assertFalse(Customer.objects.exists())
+        # The configured cache is left alone.
+        self.assertEqual(cache.get("kept"), 1)
+
+
+class RequestTimingTest(BookTestCase):
+    def setUp(self):
+        super().setUp()
+        clear_slow_requests()
+
+    @override_settings(SLOW_REQUESTS_SIZE=2)
+    def test_requests_are_timed_and_the_slowest_kept(self):
+        self.client.force_login(self.user)
+        with self.assertLogs("src.requests") as logs:
+            for _ in range(3):
+                response = self.client.get(reverse("admin:src_customer_changelist"))
+        self.assertRegex(response["Server-Timing"], r'^db;dur=[\d.]+;desc="\d+ queries", total;')
+        entry = json.loads(logs.records[-1].getMessage())
+        self.assertEqual(entry["request_id"], response["X-Request-Id"])
+        self.assertEqual(entry["path"], reverse("admin:src_customer_changelist"))
+        self.assertGreater(entry["queries"], 0)
+        self.assertTrue(entry["slowest_sql"])
+        self.assertFalse(entry["streamed"])
+        slow_requests = get_slow_requests()
+        self.assertEqual(len(slow_requests), 2)
+        self.assertGreaterEqual(slow_requests[0]["duration_ms"], slow_requests[1]["duration_ms"])
+
+    def test_streamed_responses_are_marked(self):
+        self.create_customers(1)
+        self.client.force_login(self.user)
+        with self.assertLogs("src.requests") as logs:
+            self.client.post(
+                reverse("admin:src_customer_changelist"),
+                {"action": "export_csv", "_selected_action": [Customer.objects.get().id]},
+            )
+        self.assertTrue(json.loads(logs.records[-1].getMessage())["streamed"])
+
+    def test_slow_requests_page_is_for_superusers(self):
+        staff = User.objects.create_user("staff", password="staff", is_staff=True)
+        self.client.force_login(staff)
+        self.assertEqual(self.client.get(reverse("slow_requests")).status_code, 403)
+        self.client.force_login(self.user)
+        response = self.client.get(reverse("slow_requests"))
+        self.assertContains(response, reverse("slow_requests"))
+
+
+class BulkDepositTest(BookTestCase):
+    def test_bulk_deposit_page_prefills_dues(self):
+        self.create_customers(3)
+        self.client.force_login(self.user)
+        # Session, user, iteration, the page of customers and its count, accounts, loans
+        # and the dues of each.
+        with self.assertNumQueries(9):
+            response = self.client.get(
+                reverse("admin:src_iteration_deposits", args=[self.iteration.id])
+            )
+        accounts_dues = get_accounts_dues(Account.objects.all())
+        initial = response.context["account_formset"].initial
+        self.assertEqual(len(initial), 3)
+        for row in initial:
+            dues = accounts_dues[row["account_id"]]
+            self.assertEqual(
+                (row["principal"], row["penalty"]), (dues["principal"], dues["penalty"])
+            )
+
+    def test_bulk_deposit_saves_checked_rows(self):
+        self.create_customers(3)
+        accounts = list(Account.objects.order_by("id"))
+        loan = Loan.objects.order_by("id").first()
+        month = get_snapshot_month(self.iteration)
+        data = {
+            "date": month.isoformat(),
+            "accounts-TOTAL_FORMS": 3,
+            "accounts-INITIAL_FORMS": 3,
+            "loans-TOTAL_FORMS": 1,
+            "loans-INITIAL_FORMS": 1,
+            "loans-0-selected": "on",
+            "loans-0-loan_id": loan.id,
+            "loans-0-principal": 1000,
+            "loans-0-interest": 200,
+            "loans-0-penalty": 0,
+        }
+        for i, account in enumerate(accounts):
+            data.update(
+                {
+                    f"accounts-{i}-account_id": account.id,
+                    f"accounts-{i}-principal": 500,
+                    f"accounts-{i}-penalty": 5,
+                }
+            )
+            if i:
+                data[f"accounts-{i}-selected"] = "on"
+        url = reverse("admin:src_iteration_deposits", args=[self.iteration.id])
+        staff = User.objects.create_user("staff", password="staff", is_staff=True)
+        self.client.force_login(staff)
+        self.assertEqual(self.client.post(url, data).status_code, 403)
+        self.assertFalse(AccountDeposit.objects.filter(date=month).exists())
+
+        self.client.force_login(self.user)
+        response = self.client.post(url, data)
+        self.assertRedirects(response, reverse("admin:src_iteration_changelist"))
+        self.assertEqual(AccountDeposit.objects.filter(date=month).count(), 2)
+        self.assertFalse(accounts[0].deposits.filter(date=month).exists())
+        self.assertEqual(loan.deposits.get(date=month).interest, 200)
+        # Snapshots are refreshed even though bulk_create sends no signals.
+        snapshot = loan.dues_snapshots.get(month=month)
+        self.assertEqual(snapshot.principal_paid, 1000)
+        self.assertEqual(accounts[1].dues_snapshots.get(month=month).penalty_paid, 5)
+
+        # Posting the page again saves nothing twice.
+        response = self.client.post(url, data)
+        self.assertContains(response, f"Already has a deposit on {month}")
+        self.assertEqual(AccountDeposit.objects.filter(date=month).count(), 2)
+        self.assertEqual(loan.deposits.filter(date=month).count(), 1)
+
+    @override_settings(BULK_DEPOSIT_PAGE_SIZE=2)
+    def test_bulk_deposit_page_shows_a_page_of_customers(self):
+        self.create_customers(3)
+        self.client.force_login(self.user)
+        url = reverse("admin:src_iteration_deposits", args=[self.iteration.id])
+        response = self.client.get(url)
+        accounts = list(Account.objects.order_by("customer", "id"))
+        account_ids = [row["account_id"] for row in response.context["account_formset"].initial]
+        self.assertEqual(account_ids, [account.id for account in accounts[:2]])
+        self.assertEqual(len(response.context["loan_formset"].initial), 2)
+
+        data = {
+            "date": get_snapshot_month(self.iteration).isoformat(),
+            "accounts-TOTAL_FORMS": 1,
+            "accounts-INITIAL_FORMS": 1,
+            "accounts-0-selected": "on",
+            "accounts-0-account_id": accounts[0].id,
+            "accounts-0-principal": 500,
+            "accounts-0-penalty": 0,
+            "loans-TOTAL_FORMS": 0,
+            "loans-INITIAL_FORMS": 0,
+        }
+        self.assertRedirects(self.client.post(url, data), f"{url}?page=2")
+        response = self.client.get(url, {"page": 2})
+        account_ids = [row["account_id"] for row in response.context["account_formset"].initial]
+        self.assertEqual(account_ids, [accounts[2].id])
+
+
+class ImportDepositsTest(BookTestCase):
+    def get_csv(self):
+        self.create_customers(2)
+        account = Account.objects.order_by("id").last()
+        loan = Loan.objects.order_by("id").last()
+        start = self.iteration.start_date
+        later = start + relativedelta.relativedelta(months=1)
+        latest = start + relativedelta.relativedelta(months=2)
+        return (
+            account,
+            loan,
+            "\n".join(
+                [
+                    "kind,id,date,principal,interest,penalty",
+                    f"account,{account.id},{later},500,,10",
+                    f"loan,{loan.id},{latest},1000,200,0",
+                    # Already saved by create_customers.
+                    f"account,{account.id},{start},500,,0",
+                    f"account,{account.id},{latest},500,,0",
+                    # Saved in the batch before.
+                    f"account,{account.id},{later},500,,0",
+                    "loan,0,2020-01-01,1000,200,0",
+                    f"loan,{loan.id},01/02/2020,1000,200,0",
+                    f"account,{account.id},{latest},500,100,0",
+                    f"savings,{account.id},{latest},500,,0",
+                ]
+            ),
+        )
+
+    def test_import_command_skips_invalid_and_duplicate_rows(self):
+        account, loan, content = self.get_csv()
+        directory = tempfile.mkdtemp()
+        path = f"{directory}/deposits.csv"
+        with open(path, "w") as f:
+            f.write(content)
+        output = io.StringIO()
+        call_command(
+            "import_deposits",
+            path,
+            user="admin",
+            batch_size=2,
+            rejects=f"{directory}/rejects.csv",
+            stdout=output,
+        )
+        self.assertIn("Imported 3 deposits, rejected 6 rows", output.getvalue())
+        with open(f"{directory}/rejects.csv") as f:
+            rejects = list(csv.DictReader(f))
+        # Invalid rows are rejected as they are read, duplicates when their batch is saved.
+        self.assertEqual([row["line"] for row in rejects], ["4", "7", "8", "9", "10", "6"])
+        later = self.iteration.start_date + relativedelta.relativedelta(months=1)
+        self.assertEqual(rejects[-1]["reason"], f"Duplicate account deposit on {later}")
+        self.assertEqual(account.deposits.count(), 3)
+        self.assertEqual(loan.dues_snapshots.order_by("month")[2].principal_paid, 2000)
+
+    def test_import_view(self):
+        account, loan, content = self.get_csv()
+        self.client.force_login(self.user)
+        response = self.client.post(
+            reverse("admin:src_accountdeposit_import"),
+            {"file": SimpleUploadedFile("deposits.csv", content.encode())},
+        )
+        self.assertContains(response, "Imported 3 deposits, rejected 6 rows.")
+        self.assertContains(response, "Unknown loan 0")
+
+
+class CsvExportTest(BookTestCase):
+    def export(self, changelist, ids):
+        response = self.client.post(
+            reverse(changelist), {"action": "export_csv", "_selected_action": ids}
+        )
+        self.assertTrue(response.streaming)
+        content = b"".join(response.streaming_content).decode()
+        return list(csv.reader(io.StringIO(content)))
+
+    def test_loan_export_has_the_dues_of_every_selected_loan(self):
+        self.create_customers(4)
+        self.client.force_login(self.user)
+        loans_dues = get_loans_dues(Loan.objects.all())
+        rows = self.export("admin:src_loan_changelist", list(loans_dues))
+        self.assertEqual(rows[0][0], "Loan Id")
+        self.assertEqual(
+            {int(row[0]): int(row[10]) for row in rows[1:]},
+            {loan_id: dues["total"] for loan_id, dues in loans_dues.items()},
+        )
+
+    def test_every_changelist_exports_csv(self):
+        self.create_customers(3)
+        self.client.force_login(self.user)
+        for changelist, model in (
+            ("admin:src_customer_changelist", Customer),
+            ("admin:src_account_changelist", Account),
+            ("admin:src_accountdeposit_changelist", AccountDeposit),
+            ("admin:src_loandeposit_changelist", LoanDeposit),
+        ):
+            ids = list(model.objects.values_list("id", flat=True))
+            rows = self.export(changelist, ids)
+            self.assertEqual([int(row[0]) for row in rows[1:]], sorted(ids))
+
+
+class AccountFormTest(BookTestCase):
+    def test_adding_several_accounts_at_once(self):
+        customer = Customer.objects.create(
+            name="Customer", address=self.address, phone_number="9999999999", created_by=self.user
+        )
+        self.client.force_login(self.user)
+        url = reverse("admin:src_account_add")
+        self.assertContains(self.client.get(url), "number_of_accounts")
+        response = self.client.post(
+            url,
+            {
+                "created_by": self.user.id,
+                "customer": customer.id,
+                "iteration": self.iteration.id,
+                "number_of_accounts": 5,
+            },
+            follow=True,
+        )
+        accounts = list(customer.accounts.order_by("id"))
+        self.assertEqual(len(accounts), 5)
+        ids = ", ".join(str(account.id) for account in accounts[-1:] + accounts[:-1])
+        self.assertContains(response, f"Created accounts {ids}")
+        self.assertEqual(
+            DuesSnapshot.objects.filter(account__in=accounts).values("account").distinct().count(),
+            5,
+        )
+
+
+class RolloverTest(BookTestCase):
+    def test_rollover_copies_accounts_once(self):
+        self.create_customers(3)
+        customer = Customer.objects.order_by("id").first()
+        Account.objects.create(customer=customer, iteration=self.iteration, created_by=self.user)
+        Loan.objects.filter(customer=customer).update(status="PENDING")
+        new = Iteration.objects.create(
+            start_date=date.today().replace(day=15),
+            interest_rate=2,
+            no_of_months=20,
+            deposit_amount=500,
+            late_deposit_fine=1,
+            is_active=True,
+            day_of_payment=15,
+            return_amount=12000,
+            created_by=self.user,
+        )
+        output = io.StringIO()
+        call_command("rollover_iteration", self.iteration.id, new.id, loans=True, stdout=output)
+        self.assertIn("Rolled over 4 accounts and 1 loans", output.getvalue())
+        self.assertEqual(customer.accounts.filter(iteration=new).count(), 2)
+        self.assertEqual(new.loans.get().customer, customer)
+        self.assertTrue(DuesSnapshot.objects.filter(account__iteration=new).exists())
+
+        self.client.force_login(self.user)
+        self.client.post(
+            reverse("admin:src_iteration_changelist"),
+            {"action": "rollover", "_selected_action": [self.iteration.id, new.id]},
+        )
+        self.assertEqual(new.accounts.count(), 4)
+        self.assertEqual(new.loans.count(), 1)
+
+    def test_rollover_actions_copy_loans_only_when_asked(self):
+        self.create_customers(2)
+        Loan.objects.update(status="PENDING")
+        new = Iteration.objects.create(
+            start_date=date.today().replace(day=15),
+            interest_rate=2,
+            no_of_months=20,
+            deposit_amount=500,
+            late_deposit_fine=1,
+            is_active=True,
+            day_of_payment=15,
+            return_amount=12000,
+            created_by=self.user,
+        )
+        url = reverse("admin:src_iteration_changelist")
+        staff = User.objects.create_user("staff", password="staff", is_staff=True)
+        staff.user_permissions.add(Permission.objects.get(codename="view_iteration"))
+        self.client.force_login(staff)
+        response = self.client.get(url)
+        # Viewing iterations allows no action at all.
+        self.assertIsNone(response.context["action_form"])
+        self.client.post(
+            url, {"action": "rollover", "_selected_action": [self.iteration.id, new.id]}
+        )
+        self.assertFalse(new.accounts.exists())
+        # Rolling over loans also needs adding loans.
+        staff.user_permissions.add(Permission.objects.get(codename="add_account"))
+        self.client.post(
+            url, {"action": "rollover_with_loans", "_selected_action": [self.iteration.id, new.id]}
+        )
+        self.assertFalse(new.accounts.exists())
+
+        self.client.force_login(self.user)
+        self.client.post(
+            url, {"action": "rollover", "_selected_action": [self.iteration.id, new.id]}
+        )
+        self.assertEqual((new.accounts.count(), new.loans.count()), (2, 0))
+        self.client.post(
+            url, {"action": "rollover_with_loans", "_selected_action": [self.iteration.id, new.id]}
+        )
+        self.assertEqual((new.accounts.count(), new.loans.count()), (2, 2))
+
+
+class AsOfDuesTest(BookTestCase):
+    def setUp(self):
+        super().setUp()
+        self.create_customers(6)
+        self.as_of = self.iteration.start_date + relativedelta.relativedelta(months=2)
+
+    def test_dues_as_of_match_the_snapshots_of_that_month(self):
+        snapshots = DuesSnapshot.objects.filter(month=self.as_of)
+        loans_dues = get_loans_dues(Loan.objects.all(), self.as_of)
+        for loan in annotate_loan_dues(Loan.objects.all(), self.as_of):
+            snapshot = snapshots.get(loan=loan)
+            self.assertEqual(loans_dues[loan.id]["total"], snapshot.total_dues)
+            self.assertEqual(get_loan_dues(loan, as_of=self.as_of), snapshot.total_dues)
+            self.assertEqual(loan.dues_total, snapshot.total_dues)
+        accounts_dues = get_accounts_dues(Account.objects.all(), self.as_of)
+        for account in annotate_account_dues(Account.objects.all(), self.as_of):
+            snapshot = snapshots.get(account=account)
+            self.assertEqual(accounts_dues[account.id]["total"], snapshot.total_dues)
+            self.assertEqual(get_account_dues(account, as_of=self.as_of), snapshot.total_dues)
+            self.assertEqual(account.dues_total, snapshot.total_dues)
+        self.assertEqual(get_account_installments(account, self.as_of).count("<tr>"), 3)
+
+    def test_changelists_and_dues_lists_take_the_date(self):
+        self.client.force_login(self.user)
+        url = reverse("admin:src_customer_changelist")
+        response = self.client.get(url, {"as_of": self.as_of.isoformat()})
+        customers = annotate_customer_dues(Customer.objects.all(), self.as_of)
+        self.assertEqual(
+            {customer.id: customer.dues_total for customer in response.context["cl"].result_list},
+            {customer.id: customer.dues_total for customer in customers},
+        )
+        self.assertRedirects(
+            self.client.get(url, {"as_of": "2020-02-30"}),
+            f"{url}?e=1",
+            fetch_redirect_response=False,
+        )
+
+        response = self.client.post(
+            f"{url}?as_of={self.as_of.isoformat()}",
+            {"action": "generate_loan_dues_list", "_selected_action": [customers[0].id]},
+        )
+        self.assertEqual(Job.objects.get().params, {"as_of": self.as_of.isoformat(), "workers": 1})
+        rows = list(get_loan_dues_rows(self.as_of))
+        loans_dues = get_loans_dues(Loan.objects.all(), self.as_of)
+        self.assertEqual(
+            [row[4] for row in rows[1:]],
+            [
+                loan.id
+                for loan in Loan.objects.order_by("customer", "id")
+                if loans_dues[loan.id]["total"]
+            ],
+        )
+
+
+class DuesKernelTest(BookTestCase):
+    def test_kernel_computes_dues_from_totals_without_queries(self):
+        self.create_customers(6)
+        loans_dues = get_loans_dues(Loan.objects.all())
+        accounts_dues = get_accounts_dues(Account.objects.all())
+        terms = get_iteration_terms(self.iteration)
+        total_months = get_total_months(terms.start_date, date.today())
+        loans = [
+            (loan.id, LoanState(loan.amount, sum(d.principal for d in loan.deposits.all())))
+            for loan in Loan.objects.prefetch_related("deposits")
+        ]
+        accounts = [
+            (account.id, AccountState(sum(d.principal for d in account.deposits.all())))
+            for account in Account.objects.prefetch_related("deposits")
+        ]
+        with self.assertNumQueries(0):
+            for loan_id, loan in loans:
+                self.assertEqual(
+                    loan_dues_breakdown(terms, loan, total_months - 1)._asdict(),
+                    loans_dues[loan_id],
+                )
+            for account_id, account in accounts:
+                self.assertEqual(
+                    account_dues_breakdown(terms, account, total_months)._asdict(),
+                    accounts_dues[account_id],
+                )
+
+    def test_value_objects_are_slotted_and_picklable(self):
+        terms = get_iteration_terms(self.iteration)
+        self.assertFalse(hasattr(terms, "__dict__"))
+        self.assertEqual(pickle.loads(pickle.dumps(terms)), terms)
+        self.assertEqual(pickle.loads(pickle.dumps(LoanState(10000, 2000))), LoanState(10000, 2000))
+
+
+class DepositTotalsTest(BookTestCase):
+    def assertTotals(self, owner, **totals):
+        owner.refresh_from_db()
+        self.assertEqual({field: getattr(owner, field) for field in totals}, totals)
+
+    def test_totals_follow_deposit_writes(self):
+        self.create_customers(2)
+        first, second = Loan.objects.order_by("id")
+        start_date = self.iteration.start_date
+        deposit = LoanDeposit.objects.create(
+            date=start_date + relativedelta.relativedelta(months=3),
+            principal=1000,
+            interest=100,
+            penalty=10,
+            loan=first,
+            created_by=self.user,
+        )
+        self.assertTotals(
+            first,
+            total_principal_paid=1000,
+            total_interest_paid=100,
+            total_penalty_paid=10,
+            deposit_count=1,
+            last_deposit_date=deposit.date,
+        )
+        deposit.loan = second
+        deposit.principal = 2000
+        deposit.save()
+        self.assertTotals(first, total_principal_paid=0, deposit_count=0, last_deposit_date=None)
+        self.assertTotals(
+            second, total_principal_paid=3000, deposit_count=2, last_deposit_date=deposit.date
+        )
+        deposit.delete()
+        self.assertTotals(
+            second, total_principal_paid=1000, deposit_count=1, last_deposit_date=start_date
+        )
+
+        account = Account.objects.first()
+        create_deposits(
+            self.user,
+            account_deposits=[
+                dict(account_id=account.id, date=start_date, principal=500, penalty=5)
+            ],
+        )
+        self.assertTotals(account, total_principal_paid=500, total_penalty_paid=5, deposit_count=1)
+        self.assertEqual(
+            get_account_dues(account), get_accounts_dues(Account.objects.all())[account.id]["total"]
+        )
+
+    def test_recompute_totals_repairs_drift(self):
+        self.create_customers(5)
+        output = io.StringIO()
+        call_command("recompute_totals", "--check", stdout=output)
+        self.assertIn("All totals match", output.getvalue())
+
+        Loan.objects.filter(deposit_count__gt=0).update(total_principal_paid=0)
+        drifted = Loan.objects.filter(deposit_count__gt=0).count()
+        with self.assertRaisesMessage(CommandError, f"{drifted} drifted totals"):
+            call_command("recompute_totals", "--check", stdout=io.StringIO())
+        call_command("recompute_totals", stdout=output)
+        self.assertIn(f"Repaired the totals of {drifted} loans", output.getvalue())
+        call_command("recompute_totals", "--check", stdout=io.StringIO())
+
+
+class MonthlyCollectionTest(BookTestCase):
+    def get_collections(self):
+        # Changes leave emptied rows behind, and may split the rows without an address.
+        fields = [
+            "account_principal",
+            "account_penalty",
+            "loan_principal",
+            "loan_interest",
+            "loan_penalty",
+        ]
+        collections = defaultdict(lambda: (0,) * len(fields))
+        for row in MonthlyCollection.objects.values_list("iteration", "address", "date", *fields):
+            key, totals = row[:3], row[3:]
+            collections[key] = tuple(map(sum, zip(collections[key], totals)))
+        return {key: totals for key, totals in collections.items() if any(totals)}
+
+    def assertCollectionsUpToDate(self):
+        collections = self.get_collections()
+        call_command("refresh_collections", stdout=io.StringIO())
+        self.assertEqual(collections, self.get_collections())
+
+    def test_collections_follow_deposit_and_customer_changes(self):
+        self.create_customers(5)
+        start_date = self.iteration.start_date
+        self.assertEqual(
+            self.get_collections()[(self.iteration.id, self.address.id, start_date)],
+            (2000, 0, 4000, 800, 0),
+        )
+        deposit = LoanDeposit.objects.order_by("id").first()
+        deposit.date = start_date + relativedelta.relativedelta(months=5)
+        deposit.save()
+        self.assertCollectionsUpToDate()
+
+        customer = Customer.objects.first()
+        customer.address = Address.objects.create(name="Town", created_by=self.user)
+        customer.save()
+        self.assertCollectionsUpToDate()
+        customer.address.delete()
+        self.assertCollectionsUpToDate()
+
+        Account.objects.filter(deposit_count__gt=0).first().delete()
+        self.assertCollectionsUpToDate()
+        create_deposits(
+            self.user,
+            account_deposits=[
+                dict(account_id=account.id, date=start_date, principal=500, penalty=5)
+                for account in Account.objects.all()
+            ],
+        )
+        self.assertCollectionsUpToDate()
+        self.iteration.delete()
+        self.assertFalse(MonthlyCollection.objects.exists())
+
+    def test_deposit_changes_only_touch_their_row(self):
+        self.create_customers(3)
+        account = Account.objects.get(deposit_count=2)
+        with CaptureQueriesContext(connection) as queries:
+            deposit = AccountDeposit.objects.create(
+                date=self.iteration.start_date,
+                principal=500,
+                penalty=5,
+                account=account,
+                created_by=self.user,
+            )
+            deposit.penalty = 10
+            deposit.save()
+            deposit.delete()
+        self.assertCollectionsUpToDate()
+        for query in queries.captured_queries:
+            self.assertNotIn("FOR UPDATE", query["sql"])
+            self.assertNotIn('DELETE FROM "monthly_collections"', query["sql"])
+
+    def test_moved_and_deleted_owners_only_change_their_sums(self):
+        self.create_customers(5)
+        town = Address.objects.create(name="Town", created_by=self.user)
+        customer = Customer.objects.get(name="Customer 4")
+        customer.address = town
+        customer.save()
+        self.assertCollectionsUpToDate()
+        account = Account.objects.get(customer__name="Customer 3")
+        account.customer = customer
+        account.save()
+        self.assertCollectionsUpToDate()
+        Customer.objects.get(name="Customer 2").delete()
+        self.assertCollectionsUpToDate()
+        town.delete()
+        self.assertCollectionsUpToDate()
+        self.assertTrue(MonthlyCollection.objects.filter(address=None).exists())
+
+    def test_failed_delete_keeps_refreshing_the_owner(self):
+        self.create_customers(2)
+        account = Account.objects.get(deposit_count=1)
+        delete_batch = "django.db.models.sql.DeleteQuery.delete_batch"
+        with mock.patch(delete_batch, side_effect=DatabaseError):
+            with self.assertRaises(DatabaseError), transaction.atomic():
+                account.delete()
+        AccountDeposit.objects.create(
+            date=self.iteration.start_date,
+            principal=500,
+            penalty=0,
+            account=account,
+            created_by=self.user,
+        )
+        account.refresh_from_db()
+        self.assertEqual(account.deposit_count, 2)
+        self.assertCollectionsUpToDate()
+        self.assertEqual(
+            DuesSnapshot.objects.get(
+                account=account, month=get_snapshot_month(self.iteration)
+            ).principal_paid,
+            1000,
+        )
+
+    def test_analysis_reads_the_collections(self):
+        self.create_customers(3)
+        self.client.force_login(self.user)
+        MonthlyCollection.objects.update(loan_interest=F("loan_interest") * 10)
+        response = self.client.get(reverse("analysis_data", args=[self.iteration.id]))
+        self.assertEqual(response.json()["interest"][-1], 6000)
+
+    def test_migration_fills_the_collections(self):
+        self.create_customers(3)
+        collections = self.get_collections()
+        MonthlyCollection.objects.all().delete()
+        migration = importlib.import_module("src.migrations.0010_fill_monthly_collections")
+        with connection.cursor() as cursor:
+            cursor.execute(migration.FILL_MONTHLY_COLLECTIONS)
+        self.assertEqual(self.get_collections(), collections)
+
+
+class ConcurrentCollectionTest(BookMixin, TransactionTestCase):
+    def save_deposit(self, account, errors, saved=None, commit=None):
+        try:
+            with transaction.atomic():
+                AccountDeposit.objects.create(
+                    date=self.iteration.start_date,
+                    principal=500,
+                    penalty=0,
+                    account=account,
+                    created_by=self.user,
+                )
+                if saved is not None:
+                    saved.set()
+                    commit.wait(10)
+        except Exception as error:
+            errors.append(error)
+        finally:
+            connection.close()
+
+    def test_deposits_saved_together_are_both_collected(self):
+        self.create_customers(2)
+        first, second = Account.objects.order_by("id")
+        errors, saved, commit = [], threading.Event(), threading.Event()
+        threads = [
+            threading.Thread(target=self.save_deposit, args=(first, errors, saved, commit)),
+            threading.Thread(target=self.save_deposit, args=(second, errors)),
+        ]
+        threads[0].start()
+        saved.wait(10)
+        threads[1].start()
+        # The second deposit's rebuild reaches the collections while the first is open.
+        time.sleep(0.5)
+        commit.set()
+        for thread in threads:
+            thread.join(10)
+        self.assertEqual(errors, [])
+        collection = MonthlyCollection.objects.get(
+            iteration=self.iteration, address=self.address, date=self.iteration.start_date
+        )
+        self.assertEqual(collection.account_principal, 1500)
+
+
+class AddressReportTest(BookTestCase):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+
+    def test_report_per_address(self):
+        self.create_customers(4)
+        town = Address.objects.create(name="Town", created_by=self.user)
+        Customer.objects.filter(name="Customer 3").update(address=town)
+        Address.objects.create(name="Empty", created_by=self.user)
+        month = self.iteration.start_date + relativedelta.relativedelta(months=1)
+        call_command("refresh_collections", stdout=io.StringIO())
+
+        rows = get_address_report(self.iteration, month)
+        self.assertEqual([row["address"] for row in rows], ["Town", "Village"])
+        town_row, village_row = rows
+        self.assertEqual((town_row["accounts"], town_row["loans"]), (1, 1))
+        self.assertEqual(town_row["expected"], 500 + 1000)
+        # Customers 2 and 3 deposited in the second month, customer 1 did not.
+        self.assertEqual(town_row["collected"], 1700)
+        self.assertEqual(village_row["collected"], 1700)
+        for row, address in ((town_row, town), (village_row, self.address)):
+            accounts = Account.objects.filter(customer__address=address)
+            loans = Loan.objects.filter(customer__address=address)
+            dues = sum(get_account_dues(account, as_of=month) for account in accounts)
+            dues += sum(get_loan_dues(loan, as_of=month) for loan in loans)
+            self.assertEqual(row["dues"], dues)
+
+    def test_customers_without_an_address_are_reported(self):
+        self.create_customers(4)
+        Customer.objects.filter(name="Customer 3").update(address=None)
+        month = self.iteration.start_date + relativedelta.relativedelta(months=1)
+        call_command("refresh_collections", stdout=io.StringIO())
+
+        rows = get_address_report(self.iteration, month)
+        self.assertEqual([row["address"] for row in rows], ["Village", "(no address)"])
+        row = rows[1]
+        self.assertEqual((row["accounts"], row["loans"]), (1, 1))
+        self.assertEqual(row["expected"], 500 + 1000)
+        self.assertEqual(row["collected"], 1700)
+        account = Account.objects.get(customer__address=None)
+        loan = Loan.objects.get(customer__address=None)
+        self.assertEqual(
+            row["dues"], get_account_dues(account, as_of=month) + get_loan_dues(loan, as_of=month)
+        )
+        self.assertEqual(sum(row["accounts"] for row in rows), Account.objects.count())
+
+    def test_report_is_superuser_only_and_cached(self):
+        self.create_customers(2)
+        url = reverse("address_report", args=[self.iteration.id])
+        staff = User.objects.create_user("staff", password="staff", is_staff=True)
+        self.client.force_login(staff)
+        self.assertEqual(self.client.get(url).status_code, 403)
+
+        self.client.force_login(self.user)
+        month = self.iteration.start_date.isoformat()
+        self.assertContains(self.client.get(url, {"month": month}), "Village")
+        with CaptureQueriesContext(connection) as cached:
+            self.client.get(url, {"month": month})
+        with CaptureQueriesContext(connection) as uncached:
+            self.client.get(url)
+        self.assertLess(len(cached), len(uncached))
+        self.assertEqual(self.client.get(url, {"month": "2000-01-01"}).status_code, 404)
+
+
+class ProjectionTest(BookTestCase):
+    def test_projection_matches_the_dues_kernel(self):
+        self.create_customers(6)
+        Loan.objects.filter(customer__name="Customer 5").update(status="PENDING")
+        terms = get_iteration_terms(self.iteration)
+        dates = get_all_installment_dates(self.iteration)
+        with self.assertNumQueries(2):
+            state = load_iteration_state(self.iteration)
+        self.assertEqual((len(state.account_principal_paid), len(state.loan_amount)), (6, 5))
+
+        accounts = [AccountState(paid) for paid in state.account_principal_paid.tolist()]
+        loans = [
+            LoanState(amount, paid)
+            for amount, paid in zip(state.loan_amount.tolist(), state.loan_principal_paid.tolist())
+        ]
+        expected = {}
+        for month in range(3, len(dates)):
+            collection = dict.fromkeys(
+                [
+                    "account_principal",
+                    "account_penalty",
+                    "loan_principal",
+                    "loan_interest",
+                    "loan_penalty",
+                ],
+                0,
+            )
+            for account in accounts:
+                dues = account_dues_breakdown(terms, account, month + 1)
+                collection["account_principal"] += dues.principal
+                collection["account_penalty"] += dues.penalty
+                account.principal_paid += dues.principal
+            for loan in loans:
+                dues = loan_dues_breakdown(terms, loan, month)
+                principal = min(dues.principal, loan.amount - loan.principal_paid)
+                collection["loan_principal"] += principal
+                collection["loan_interest"] += dues.interest
+                collection["loan_penalty"] += dues.penalty
+                loan.principal_paid += principal
+            expected[dates[month]] = collection
+        self.assertEqual(project_collections(terms, dates, 3, state), expected)
+
+    def test_optimum_interest(self):
+        for deposit_amount, interest_rate, no_of_months in ((500, 2, 20), (1000, 3, 12)):
+            total = sum(
+                int(pow(1 + interest_rate / 100, i) * deposit_amount)
+                for i in range(no_of_months, 0, -1)
+            )
+            self.assertEqual(
+                get_optimum_interest(deposit_amount, interest_rate, no_of_months),
+                total - deposit_amount * no_of_months,
+            )
+
+    def test_analysis_projects_from_the_current_month(self):
+        self.create_customers(3)
+        cache.clear()
+        self.client.force_login(self.user)
+        series = self.client.get(reverse("analysis_data", args=[self.iteration.id])).json()
+        total_months = get_total_months(self.iteration.start_date, date.today())
+        projected = series["projectedInterest"]
+        self.assertEqual(projected[: total_months - 1], [None] * (total_months - 1))
+        self.assertEqual(projected[total_months - 1], series["interest"][total_months - 1])
+        # Every loan is repaid with interest on its shrinking balance by the end.
+        self.assertGreater(projected[-1], series["interest"][-1])
+        self.assertEqual(series["interestPlusPenalty"], series["interest"])
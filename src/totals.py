@@ -0,0 +1,127 @@
+from django.db.models import Count
+from django.db.models import DateField
+from django.db.models import F
+from django.db.models import IntegerField
+from django.db.models import Max
+from django.db.models import OuterRef
+from django.db.models import Subquery
+from django.db.models import Sum
+from django.db.models import Value
+from django.db.models.functions import Coalesce
+from django.db.models.functions import Greatest
+
+from src.models import Account
+from src.models import AccountDeposit
+from src.models import Loan
+from src.models import LoanDeposit
+
+# The owner of every kind of deposit, and the deposit column each running total sums.
+DEPOSIT_TOTALS = {
+    AccountDeposit: (
+        Account,
+        "account",
+        {"total_principal_paid": "principal", "total_penalty_paid": "penalty"},
+    ),
+    LoanDeposit: (
+        Loan,
+        "loan",
+        {
+            "total_principal_paid": "principal",
+            "total_interest_paid": "interest",
+            "total_penalty_paid": "penalty",
+        },
+    ),
+}
+
+TOTAL_FIELDS = ["deposit_count", "last_deposit_date"]
+
+
+def _deposits_subquery(deposit_model, owner_field, aggregate, output_field):
+    deposits = (
+        deposit_model.objects.filter(**{owner_field: OuterRef("pk")})
+        .order_by()
+        .values(owner_field)
+        .annotate(value=aggregate)
+        .values("value")
+    )
+    return Subquery(deposits, output_field=output_field)
+
+
+def _get_actual_totals(deposit_model):
+    """Expressions summing up the deposits of the owner they are evaluated for."""
+    _, owner_field, sums = DEPOSIT_TOTALS[deposit_model]
+    totals = {
+        field: Coalesce(
+            _deposits_subquery(deposit_model, owner_field, Sum(column), IntegerField()), 0
+        )
+        for field, column in sums.items()
+    }
+    totals["deposit_count"] = Coalesce(
+        _deposits_subquery(deposit_model, owner_field, Count("id"), IntegerField()), 0
+    )
+    totals["last_deposit_date"] = _deposits_subquery(
+        deposit_model, owner_field, Max("date"), DateField()
+    )
+    return totals
+
+
+def _update_totals(deposit_model, owner_id, amounts, sign, last_deposit_date):
+    owner_model, _, sums = DEPOSIT_TOTALS[deposit_model]
+    changes = {field: F(field) + sign * amounts[column] for field, column in sums.items()}
+    changes["deposit_count"] = F("deposit_count") + sign
+    changes["last_deposit_date"] = last_deposit_date
+    owner_model.objects.filter(pk=owner_id).update(**changes)
+
+
+def get_deposit_amounts(deposit):
+    _, _, sums = DEPOSIT_TOTALS[type(deposit)]
+    return {column: getattr(deposit, column) for column in sums.values()}
+
+
+def add_deposit(deposit):
+    """Count a saved deposit into the totals of its owner."""
+    _, owner_field, _ = DEPOSIT_TOTALS[type(deposit)]
+    date = Value(deposit.date, output_field=DateField())
+    _update_totals(
+        type(deposit),
+        getattr(deposit, f"{owner_field}_id"),
+        get_deposit_amounts(deposit),
+        1,
+        Greatest(Coalesce(F("last_deposit_date"), date), date),
+    )
+
+
+def remove_deposit(deposit_model, owner_id, amounts):
+    """Take a deposit, already deleted or moved, out of the totals of `owner_id`."""
+    _, owner_field, _ = DEPOSIT_TOTALS[deposit_model]
+    # The latest deposit may be the one taken out, so look it up again.
+    last_deposit_date = _deposits_subquery(deposit_model, owner_field, Max("date"), DateField())
+    _update_totals(deposit_model, owner_id, amounts, -1, last_deposit_date)
+
+
+def refresh_totals(deposit_model, owner_ids):
+    """Recompute the totals of the owners from their deposits, in one UPDATE."""
+    owner_model, _, _ = DEPOSIT_TOTALS[deposit_model]
+    owner_model.objects.filter(id__in=owner_ids).update(**_get_actual_totals(deposit_model))
+
+
+def refresh_account_totals(account_ids):
+    refresh_totals(AccountDeposit, account_ids)
+
+
+def refresh_loan_totals(loan_ids):
+    refresh_totals(LoanDeposit, loan_ids)
+
+
+def get_drifted_totals(deposit_model, chunk_size=2000):
+    """Yield the id, stored and actual totals of every owner whose totals are wrong."""
+    owner_model, _, sums = DEPOSIT_TOTALS[deposit_model]
+    fields = list(sums) + TOTAL_FIELDS
+    actual = {
+        f"actual_{field}": value for field, value in _get_actual_totals(deposit_model).items()
+    }
+    owners = owner_model.objects.annotate(**actual).values_list("id", *fields, *actual)
+    for row in owners.order_by("id").iterator(chunk_size=chunk_size):
+        stored, actual_values = row[1 : len(fields) + 1], row[len(fields) + 1 :]
+        if stored != actual_values:
+            yield row[0], dict(zip(fields, stored)), dict(zip(fields, actual_values))
@@ -1,7 +1,13 @@
 from django.urls import path
 
+from src.views import AddressReport
 from src.views import Analysis
+from src.views import AnalysisData
 
 app = "src"
 
-urlpatterns = [path("<iteration_id>/analysis", Analysis.as_view(), name="analysis")]
+urlpatterns = [
+    path("<iteration_id>/analysis", Analysis.as_view(), name="analysis"),
+    path("<iteration_id>/analysis/data", AnalysisData.as_view(), name="analysis_data"),
+    path("<iteration_id>/addresses", AddressReport.as_view(), name="address_report"),
+]
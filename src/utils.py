@@ -1,12 +1,34 @@
+import csv
+import heapq
 import os
 
 from datetime import datetime
-from math import pow
+from itertools import islice
 
 from dateutil import relativedelta
 from django.conf import settings
+from django.db import transaction
+from django.db.models import Case
+from django.db.models import Count
+from django.db.models import Exists
+from django.db.models import ExpressionWrapper
 from django.db.models import F
+from django.db.models import FloatField
+from django.db.models import Func
+from django.db.models import IntegerField
+from django.db.models import Max
+from django.db.models import OuterRef
+from django.db.models import Q
+from django.db.models import Subquery
 from django.db.models import Sum
+from django.db.models import Value
+from django.db.models import When
+from django.db.models.functions import Cast
+from django.db.models.functions import Coalesce
+from django.db.models.functions import ExtractMonth
+from django.db.models.functions import ExtractYear
+from django.db.models.functions import Greatest
+from django.http import StreamingHttpResponse
 from pyinvoice.models import ClientInfo
 from pyinvoice.models import InvoiceInfo
 from pyinvoice.models import Item
@@ -17,142 +39,542 @@ from reportlab.lib.enums import TA_CENTER
 from reportlab.lib.pagesizes import A4
 from reportlab.lib.styles import getSampleStyleSheet
 from reportlab.lib.styles import ParagraphStyle
+from reportlab.lib.units import inch
+from reportlab.pdfgen import canvas
+from reportlab.platypus import Frame
 from reportlab.platypus import Paragraph
-from reportlab.platypus import SimpleDocTemplate
 from reportlab.platypus.tables import Table
 from reportlab.platypus.tables import TableStyle
 
+from src.dues import account_dues_breakdown
+from src.dues import AccountState
+from src.dues import get_total_months
+from src.dues import IterationTerms
+from src.dues import loan_dues_breakdown
+from src.dues import LoanState
+from src.models import Account
 from src.models import AccountDeposit
+from src.models import Address
+from src.models import DuesSnapshot
+from src.models import Iteration
+from src.models import Loan
 from src.models import LoanDeposit
+from src.models import MonthlyCollection
+from src.models import Receipt
+from src.projection import get_optimum_interest
+from src.schedule import get_elapsed_months
+from src.schedule import get_installment_dates
+from src.schedule import get_months
+from src.schedule import match_deposits
 
 os.environ["INVOICE_LANG"] = "en"
 
 
-def _principal_dues(obj, total_months, total_principal_paid):
-    principal_should_be_paid = obj.amount * 0.1 * total_months
-    return max(principal_should_be_paid - total_principal_paid, 0)
+def _get_total_months(start_date, current_date=None):
+    return get_total_months(start_date, current_date or datetime.today().date())
 
 
-def get_loan_dues(obj, principal=False, interest=False, penalty=False, installments=False):
-    deposits = obj.deposits.all()
-    iteration = obj.iteration
-    current_date = datetime.today().date()
-    start_date = iteration.start_date
-    diff = relativedelta.relativedelta(current_date, start_date)
-    total_months = (diff.years * 12) + (diff.months)
-    if diff.days > 0:
-        total_months += 1
-    total_months -= 1
-    total_principal_paid = sum([deposit.principal for deposit in deposits])
-    total_principal_dues = _principal_dues(obj, total_months, total_principal_paid)
+def get_iteration_terms(iteration):
+    return IterationTerms(
+        iteration.start_date,
+        iteration.interest_rate,
+        iteration.late_deposit_fine,
+        iteration.deposit_amount,
+    )
+
+
+def _pick_dues(dues, principal=False, interest=False, penalty=False, installments=False):
     if principal:
-        return int(total_principal_dues)
-    total_installments_dues = int(total_principal_dues / (obj.amount * 0.1))
-    total_installments_dues = max(total_installments_dues, 1)
-    total_interest = (
-        total_installments_dues * (obj.amount - total_principal_paid) * (iteration.interest_rate)
-    ) / 100
+        return dues["principal"]
     if interest:
-        return int(total_interest)
+        return dues["interest"]
     if installments:
-        return total_installments_dues
-    total_penalty = (
-        max((total_installments_dues - 1), 0)
-        * (obj.amount - total_principal_paid)
-        * (iteration.late_deposit_fine)
-    ) / 100
+        return dues["installments"]
     if penalty:
-        return int(total_penalty)
-    return int(total_principal_dues + total_interest + total_penalty)
+        return dues["penalty"]
+    return dues["total"]
+
 
+def _get_principal_paid(obj, as_of):
+    if as_of is None:
+        return obj.total_principal_paid
+    # Filtered in Python so prefetched deposits are not queried again.
+    return sum(deposit.principal for deposit in obj.deposits.all() if deposit.date <= as_of)
 
-def get_account_dues(obj, principal=False, penalty=False, installments=False):
-    deposits = obj.deposits.all()
+
+def get_loan_dues(
+    obj, principal=False, interest=False, penalty=False, installments=False, as_of=None
+):
     iteration = obj.iteration
-    current_date = datetime.today().date()
-    start_date = iteration.start_date
-    diff = relativedelta.relativedelta(current_date, start_date)
-    total_months = (diff.years * 12) + (diff.months)
-    if diff.days > 0:
-        total_months += 1
-    total_principal_paid = sum([deposit.principal for deposit in deposits])
-    total_installments_paid = int(total_principal_paid / iteration.deposit_amount)
-    total_installments_missed = max(total_months - total_installments_paid, 0)
-    if installments:
-        return total_installments_missed
-    principal_dues = total_installments_missed * iteration.deposit_amount
-    if principal:
-        return principal_dues
-    penalty_dues = max((total_installments_missed - 1), 0) * (
-        iteration.late_deposit_fine + iteration.interest_rate
+    total_months = _get_total_months(iteration.start_date, as_of) - 1
+    total_principal_paid = _get_principal_paid(obj, as_of)
+    dues = loan_dues_breakdown(
+        get_iteration_terms(iteration), LoanState(obj.amount, total_principal_paid), total_months
     )
-    if penalty:
-        return penalty_dues
-
-    return int(principal_dues + penalty_dues)
+    return _pick_dues(dues._asdict(), principal, interest, penalty, installments)
 
 
-def get_account_installments(obj):
-    deposits = obj.deposits.all()
+def get_account_dues(obj, principal=False, penalty=False, installments=False, as_of=None):
     iteration = obj.iteration
-    current_date = datetime.today().date()
-    start_date = iteration.start_date
-    diff = relativedelta.relativedelta(current_date, start_date)
-    total_months = (diff.years * 12) + (diff.months)
+    total_months = _get_total_months(iteration.start_date, as_of)
+    total_principal_paid = _get_principal_paid(obj, as_of)
+    dues = account_dues_breakdown(
+        get_iteration_terms(iteration), AccountState(total_principal_paid), total_months
+    )
+    return _pick_dues(
+        dues._asdict(), principal=principal, penalty=penalty, installments=installments
+    )
+
+
+def _principal_paid_expression(deposit_model, owner_field, as_of=None):
+    if as_of is None:
+        return F("total_principal_paid")
+    deposits = deposit_model.objects.filter(**{owner_field: OuterRef("pk")}, date__lte=as_of)
+    deposits = deposits.order_by().values(owner_field).annotate(total=Sum("principal"))
+    return Coalesce(Subquery(deposits.values("total"), output_field=IntegerField()), 0)
+
+
+def get_loans_dues(queryset, as_of=None):
+    """Dues of every loan in the queryset keyed by loan id, in a single query."""
+    loans = queryset.select_related("iteration").annotate(
+        principal_paid=_principal_paid_expression(LoanDeposit, "loan", as_of)
+    )
+    terms = {}
+    loan_dues = {}
+    for loan in loans:
+        iteration = loan.iteration
+        if iteration.pk not in terms:
+            total_months = _get_total_months(iteration.start_date, as_of) - 1
+            terms[iteration.pk] = (get_iteration_terms(iteration), total_months)
+        iteration_terms, total_months = terms[iteration.pk]
+        loan_dues[loan.pk] = loan_dues_breakdown(
+            iteration_terms, LoanState(loan.amount, loan.principal_paid), total_months
+        )._asdict()
+    return loan_dues
+
+
+def get_accounts_dues(queryset, as_of=None):
+    """Dues of every account in the queryset keyed by account id, in a single query."""
+    accounts = queryset.select_related("iteration").annotate(
+        principal_paid=_principal_paid_expression(AccountDeposit, "account", as_of)
+    )
+    terms = {}
+    account_dues = {}
+    for account in accounts:
+        iteration = account.iteration
+        if iteration.pk not in terms:
+            total_months = _get_total_months(iteration.start_date, as_of)
+            terms[iteration.pk] = (get_iteration_terms(iteration), total_months)
+        iteration_terms, total_months = terms[iteration.pk]
+        account_dues[account.pk] = account_dues_breakdown(
+            iteration_terms, AccountState(account.principal_paid), total_months
+        )._asdict()
+    return account_dues
+
+
+class _Truncate(Func):
+    function = "TRUNC"
+    output_field = FloatField()
+
+
+def _to_int(expression):
+    return Cast(_Truncate(expression), IntegerField())
+
+
+def _to_float(expression):
+    return Cast(expression, FloatField())
+
+
+def _total_months_expression(start_date_field, as_of=None):
+    # Same month count as `get_total_months`, but computed by the database.
+    current_date = as_of or datetime.today().date()
+    total_months = (Value(current_date.year) - ExtractYear(start_date_field)) * 12 + (
+        Value(current_date.month) - ExtractMonth(start_date_field)
+    )
+    started_earlier_in_month = Case(
+        When(**{f"{start_date_field}__day__lt": current_date.day}, then=Value(1)),
+        default=Value(0),
+        output_field=IntegerField(),
+    )
+    return ExpressionWrapper(total_months + started_earlier_in_month, output_field=IntegerField())
+
+
+def annotate_loan_dues(queryset, as_of=None):
+    """Annotate `dues_principal`, `dues_interest`, `dues_penalty` and `dues_total` on loans."""
+    # Floats are computed as double precision so the results truncate exactly like
+    # `loan_dues_breakdown`.
+    installment_amount = _to_float(F("amount")) * Value(0.1, output_field=FloatField())
+    queryset = queryset.annotate(
+        dues_months=_total_months_expression("iteration__start_date", as_of) - 1,
+        dues_principal_paid=_principal_paid_expression(LoanDeposit, "loan", as_of),
+    )
+    queryset = queryset.annotate(
+        dues_principal_raw=Greatest(
+            installment_amount * _to_float(F("dues_months")) - _to_float(F("dues_principal_paid")),
+            Value(0.0, output_field=FloatField()),
+        )
+    )
+    queryset = queryset.annotate(
+        dues_installments=Greatest(_to_int(F("dues_principal_raw") / installment_amount), Value(1)),
+        dues_balance=F("amount") - F("dues_principal_paid"),
+    )
+    queryset = queryset.annotate(
+        dues_interest_raw=_to_float(
+            F("dues_installments") * F("dues_balance") * F("iteration__interest_rate")
+        )
+        / Value(100.0, output_field=FloatField()),
+        dues_penalty_raw=_to_float(
+            Greatest(F("dues_installments") - 1, Value(0))
+            * F("dues_balance")
+            * F("iteration__late_deposit_fine")
+        )
+        / Value(100.0, output_field=FloatField()),
+    )
+    return queryset.annotate(
+        dues_principal=_to_int(F("dues_principal_raw")),
+        dues_interest=_to_int(F("dues_interest_raw")),
+        dues_penalty=_to_int(F("dues_penalty_raw")),
+        dues_total=_to_int(
+            F("dues_principal_raw") + F("dues_interest_raw") + F("dues_penalty_raw")
+        ),
+    )
+
+
+def annotate_account_dues(queryset, as_of=None):
+    """Annotate `dues_principal`, `dues_penalty` and `dues_total` on accounts."""
+    queryset = queryset.annotate(
+        dues_months=_total_months_expression("iteration__start_date", as_of),
+        dues_principal_paid=_principal_paid_expression(AccountDeposit, "account", as_of),
+    )
+    queryset = queryset.annotate(
+        dues_installments=Greatest(
+            F("dues_months") - F("dues_principal_paid") / F("iteration__deposit_amount"),
+            Value(0),
+        )
+    )
+    queryset = queryset.annotate(
+        dues_principal=ExpressionWrapper(
+            F("dues_installments") * F("iteration__deposit_amount"), output_field=IntegerField()
+        ),
+        dues_penalty=ExpressionWrapper(
+            Greatest(F("dues_installments") - 1, Value(0))
+            * (F("iteration__late_deposit_fine") + F("iteration__interest_rate")),
+            output_field=IntegerField(),
+        ),
+    )
+    return queryset.annotate(
+        dues_total=ExpressionWrapper(
+            F("dues_principal") + F("dues_penalty"), output_field=IntegerField()
+        )
+    )
+
+
+def _customer_subquery(queryset, value):
+    rows = (
+        queryset.filter(customer=OuterRef("pk"))
+        .order_by()
+        .values("customer")
+        .annotate(total=value)
+        .values("total")
+    )
+    return Coalesce(Subquery(rows, output_field=IntegerField()), 0)
+
+
+def annotate_customer_counts(queryset):
+    """Annotate `account_count` and `loan_count` on customers, without grouping them."""
+    return queryset.annotate(
+        account_count=_customer_subquery(Account.objects.all(), Count("id")),
+        loan_count=_customer_subquery(Loan.objects.all(), Count("id")),
+    )
+
+
+def annotate_customer_dues(queryset, as_of=None):
+    """Annotate `account_dues_total`, `loan_dues_total` and `dues_total` on customers."""
+    queryset = queryset.annotate(
+        account_dues_total=_customer_subquery(
+            annotate_account_dues(Account.objects.all(), as_of), Sum("dues_total")
+        ),
+        loan_dues_total=_customer_subquery(
+            annotate_loan_dues(Loan.objects.all(), as_of), Sum("dues_total")
+        ),
+    )
+    return queryset.annotate(
+        dues_total=ExpressionWrapper(
+            F("account_dues_total") + F("loan_dues_total"), output_field=IntegerField()
+        )
+    )
+
+
+def _address_subquery(queryset, value, address_field="customer__address"):
+    rows = (
+        queryset.filter(**{address_field: OuterRef("pk")})
+        .order_by()
+        .values(address_field)
+        .annotate(total=value)
+        .values("total")
+    )
+    return Coalesce(Subquery(rows, output_field=IntegerField()), 0)
+
+
+def get_address_report(iteration, month):
+    """Accounts, loans, collections and dues of the iteration's customers, per address.
+
+    Customers without an address are reported together, in a last "(no address)" row.
+
+    `month` is an installment date. Expected collection is that month's installments,
+    actual collection everything deposited on it, and dues are as of that date.
+    """
+    accounts = Account.objects.filter(iteration=iteration)
+    loans = Loan.objects.filter(iteration=iteration)
+    collections = MonthlyCollection.objects.filter(iteration=iteration, date=month)
+    collected = (
+        F("account_principal")
+        + F("account_penalty")
+        + F("loan_principal")
+        + F("loan_interest")
+        + F("loan_penalty")
+    )
+    totals = dict(
+        account_count=_address_subquery(accounts, Count("id")),
+        loan_count=_address_subquery(loans, Count("id")),
+        loan_amount=_address_subquery(loans, Sum("amount")),
+        collected=_address_subquery(collections, Sum(collected), address_field="address"),
+        account_dues=_address_subquery(annotate_account_dues(accounts, month), Sum("dues_total")),
+        loan_dues=_address_subquery(annotate_loan_dues(loans, month), Sum("dues_total")),
+    )
+    addresses = list(
+        Address.objects.annotate(**totals)
+        .filter(Q(account_count__gt=0) | Q(loan_count__gt=0))
+        .order_by("name")
+        .values("name", *totals)
+    )
+    # Customers whose address was deleted have none, they are reported together last.
+    unaddressed = {
+        "name": "(no address)",
+        **annotate_account_dues(accounts.filter(customer__address=None), month).aggregate(
+            account_count=Count("id"), account_dues=Coalesce(Sum("dues_total"), 0)
+        ),
+        **annotate_loan_dues(loans.filter(customer__address=None), month).aggregate(
+            loan_count=Count("id"),
+            loan_amount=Coalesce(Sum("amount"), 0),
+            loan_dues=Coalesce(Sum("dues_total"), 0),
+        ),
+        **collections.filter(address=None).aggregate(collected=Coalesce(Sum(collected), 0)),
+    }
+    if unaddressed["account_count"] or unaddressed["loan_count"]:
+        addresses.append(unaddressed)
+    # Loan installments start a month after the iteration does.
+    loan_installment_rate = 0.1 if month > iteration.start_date else 0
+    rows = []
+    for address in addresses:
+        rows.append(
+            {
+                "address": address["name"],
+                "accounts": address["account_count"],
+                "loans": address["loan_count"],
+                "expected": address["account_count"] * iteration.deposit_amount
+                + int(address["loan_amount"] * loan_installment_rate),
+                "collected": address["collected"],
+                "dues": address["account_dues"] + address["loan_dues"],
+            }
+        )
+    return rows
+
+
+def get_account_installments(obj, as_of=None):
+    start_date = obj.iteration.start_date
+    months = get_months(start_date, get_elapsed_months(start_date, as_of) + 1)
     _html = ""
-    for i in range(0, total_months + 1):
-        installment_date = start_date + relativedelta.relativedelta(months=i)
-        principal = 0
-        penalty = 0
-        for deposit in deposits:
-            if deposit.date == installment_date:
-                principal = deposit.principal
-                penalty = deposit.penalty
+    for installment_date, deposit in match_deposits(months, obj.deposits.all()):
+        principal = deposit.principal if deposit else 0
+        penalty = deposit.penalty if deposit else 0
         _installment = f"<td>{installment_date.strftime('%d-%m-%Y')}</td><td>{principal}<td>{penalty}</td></td>"
         _html += f"<tr>{_installment}</tr>"
     return _html
 
 
-def get_loan_installments(obj):
-    deposits = obj.deposits.all()
-    iteration = obj.iteration
-    current_date = datetime.today().date()
-    start_date = iteration.start_date
-    diff = relativedelta.relativedelta(current_date, start_date)
-    total_months = (diff.years * 12) + (diff.months)
+def get_loan_installments(obj, as_of=None):
+    start_date = obj.iteration.start_date
+    months = get_months(start_date, get_elapsed_months(start_date, as_of) + 1)[1:]
     _html = ""
-    for i in range(1, total_months + 1):
-        installment_date = start_date + relativedelta.relativedelta(months=i)
-        principal = 0
-        interest = 0
-        penalty = 0
-        for deposit in deposits:
-            if deposit.date == installment_date:
-                principal = deposit.principal
-                interest = deposit.interest
-                penalty = deposit.penalty
+    for installment_date, deposit in match_deposits(months, obj.deposits.all()):
+        principal = deposit.principal if deposit else 0
+        interest = deposit.interest if deposit else 0
+        penalty = deposit.penalty if deposit else 0
         _installment = f"<td>{installment_date.strftime('%d-%m-%Y')}</td><td>{principal}</td><td>{interest}</td><td>{penalty}</td>"
         _html += f"<tr>{_installment}</tr>"
     return _html
 
 
-def generate_dues_pdf_response(response, data, header_text):
-    elements = []
-    doc = SimpleDocTemplate(response, pagesize=A4)
-    styles = getSampleStyleSheet()
-    style = ParagraphStyle(name="Header", parent=styles["Heading1"], alignment=TA_CENTER)
-    header = Paragraph(header_text, style)
-    elements.append(header)
-    table_style = TableStyle(
+def _dues_table_style():
+    return TableStyle(
         [
             ["GRID", (0, 0), (-1, -1), 1, colors.black],
             ["ALIGN", (0, 0), (-1, -1), "CENTER"],
             ["FONTNAME", (0, 0), (-1, 0), "Courier-Bold"],
         ]
     )
-    _table = Table(data, style=table_style, repeatRows=1,)
-    elements.append(_table)
-    doc.build(elements)
+
+
+class _Echo:
+    def write(self, value):
+        return value
+
+
+def generate_csv_response(filename, rows):
+    """Stream `rows` as a CSV download, writing each row only when it is sent."""
+    writer = csv.writer(_Echo())
+    response = StreamingHttpResponse(
+        (writer.writerow(row) for row in rows), content_type="text/csv"
+    )
+    response["Content-Disposition"] = f'attachment; filename="{filename}"'
+    return response
+
+
+def generate_dues_pdf_response(response, data, header_text):
+    """Render the dues table one page at a time.
+
+    `data` can be any iterable (a generator works best) whose first row is the
+    table header. Only one page worth of rows is held and laid out at a time,
+    and the header row is repeated at the top of every page.
+    """
+    rows = iter(data)
+    header_row = next(rows)
+    page_width, page_height = A4
+    pdf = canvas.Canvas(response, pagesize=A4)
+    styles = getSampleStyleSheet()
+    style = ParagraphStyle(name="Header", parent=styles["Heading1"], alignment=TA_CENTER)
+    header = Paragraph(header_text, style)
+    table_style = _dues_table_style()
+
+    frame_width = page_width - 2 * inch
+    frame_height = page_height - 2 * inch
+    # Frame keeps 6 points of padding on every side.
+    available_width = frame_width - 12
+    available_height = frame_height - 12
+    # Cells are plain strings, so every row of the table has the same height.
+    row_height = Table([header_row], style=table_style).wrap(available_width, available_height)[1]
+    header_height = header.wrap(available_width, available_height)[1] + header.getSpaceAfter()
+    first_page_rows = int((available_height - header_height) // row_height) - 1
+    page_rows = int(available_height // row_height) - 1
+
+    flowables = [header]
+    page_data = list(islice(rows, first_page_rows))
+    while True:
+        flowables.append(Table([header_row] + page_data, style=table_style, repeatRows=1))
+        frame = Frame(inch, inch, frame_width, frame_height)
+        frame.addFromList(flowables, pdf)
+        page_data = list(islice(rows, page_rows))
+        if not page_data:
+            break
+        pdf.showPage()
+    pdf.save()
+
+
+def get_snapshot_month(iteration, current_date=None):
+    total_months = _get_total_months(iteration.start_date, current_date)
+    return iteration.start_date + relativedelta.relativedelta(months=total_months)
+
+
+def get_current_snapshots(owner_field):
+    """Snapshot rows holding today's dues of every account or loan."""
+    current_date = datetime.today().date()
+    months = Q()
+    for iteration in Iteration.objects.all():
+        months |= Q(
+            **{f"{owner_field}__iteration": iteration},
+            month=get_snapshot_month(iteration, current_date),
+        )
+    if not months:
+        return DuesSnapshot.objects.none()
+    return DuesSnapshot.objects.filter(months, **{f"{owner_field}__isnull": False})
+
+
+def _filter_customers(queryset, customer_field, customer_range):
+    if customer_range is None:
+        return queryset
+    return queryset.filter(**{f"{customer_field}__id__range": customer_range})
+
+
+def _get_dues_rows(owners, owner_field, columns):
+    for row in owners.iterator(chunk_size=2000):
+        owner = getattr(row, owner_field) if owner_field else row
+        customer = owner.customer
+        yield [customer.id, customer.name, customer.address.name, owner.id] + [
+            getattr(row, column) for column in columns
+        ]
+
+
+def _get_owner_dues_rows(owner_model, owner_field, columns, as_of, customer_range):
+    annotate_dues = annotate_loan_dues if owner_model is Loan else annotate_account_dues
+    owners = _filter_customers(owner_model.objects.all(), "customer", customer_range)
+    dues_columns = [f"dues_{column}" for column in columns]
+    if as_of is not None:
+        owners = annotate_dues(owners, as_of)
+        return _get_dues_rows(
+            owners.filter(dues_total__gt=0)
+            .select_related("customer__address")
+            .order_by("customer", "id"),
+            None,
+            dues_columns,
+        )
+
+    snapshots = get_current_snapshots(owner_field)
+    listed = _filter_customers(snapshots, f"{owner_field}__customer", customer_range)
+    listed = (
+        listed.filter(total_dues__gt=0)
+        .select_related(f"{owner_field}__customer__address")
+        .order_by(f"{owner_field}__customer", owner_field)
+    )
+    # Snapshots stop at the month of their last refresh once an iteration has ended,
+    # and are missing altogether until the first one. Such owners are computed instead.
+    unsnapshotted = annotate_dues(
+        owners.annotate(
+            has_snapshot=Exists(snapshots.filter(**{owner_field: OuterRef("pk")}))
+        ).filter(has_snapshot=False)
+    )
+    unsnapshotted = (
+        unsnapshotted.filter(dues_total__gt=0)
+        .select_related("customer__address")
+        .order_by("customer", "id")
+    )
+    return heapq.merge(
+        _get_dues_rows(listed, owner_field, [f"{column}_dues" for column in columns]),
+        _get_dues_rows(unsnapshotted, None, dues_columns),
+        key=lambda row: (row[0], row[3]),
+    )
+
+
+def get_loan_dues_rows(as_of=None, customer_range=None):
+    """Yield the loan dues list, header first.
+
+    Today's list streams the dues snapshots. Snapshots hold the dues of installment
+    dates only, so the list as of an earlier date is computed by the database.
+    `customer_range` limits the list to customers with ids in the inclusive range.
+    """
+    yield [
+        "Serial",
+        "Customer Id",
+        "Name",
+        "Address",
+        "Loan Id",
+        "Principal",
+        "Interest",
+        "Penalty",
+    ]
+    rows = _get_owner_dues_rows(
+        Loan, "loan", ["principal", "interest", "penalty"], as_of, customer_range
+    )
+    for serial, row in enumerate(rows, 1):
+        yield [serial] + row
+
+
+def get_account_dues_rows(as_of=None, customer_range=None):
+    """Yield the account dues list, header first, like `get_loan_dues_rows`."""
+    yield ["Serial", "Customer Id", "Name", "Address", "Account Id", "Principal", "Penalty"]
+    rows = _get_owner_dues_rows(Account, "account", ["principal", "penalty"], as_of, customer_range)
+    for serial, row in enumerate(rows, 1):
+        yield [serial] + row
 
 
 def _get_customer_active_accounts(customer):
@@ -167,6 +589,75 @@ def _get_customer_active_accounts(customer):
     return account_string[:-2]
 
 
+def get_receipt_details(customer_ids):
+    """This month's receipt items for every customer, keyed by customer id, in two queries."""
+    this_month = datetime.today().replace(day=15).date()
+    account_totals = (
+        AccountDeposit.objects.filter(date=this_month, account__customer__in=customer_ids)
+        .values("account__customer")
+        .annotate(
+            count=Count("id"),
+            penalty_count=Count("id", filter=Q(penalty__gt=0)),
+            total_principal=Sum("principal"),
+            total_penalty=Sum("penalty"),
+        )
+    )
+    loan_totals = (
+        LoanDeposit.objects.filter(date=this_month, loan__customer__in=customer_ids)
+        .values("loan__customer")
+        .annotate(
+            count=Count("id"),
+            penalty_count=Count("id", filter=Q(penalty__gt=0)),
+            total_principal=Sum("principal"),
+            total_interest=Sum("interest"),
+            total_penalty=Sum("penalty"),
+        )
+    )
+    details = {
+        customer_id: {
+            "Account Credit": [0, 0],
+            "Account Penalty": [0, 0],
+            "Loan Principal": [0, 0],
+            "Loan Interest": [0, 0],
+            "Loan Penalty": [0, 0],
+        }
+        for customer_id in customer_ids
+    }
+    for total in account_totals:
+        detail = details[total["account__customer"]]
+        detail["Account Credit"] = [total["count"], total["total_principal"]]
+        detail["Account Penalty"] = [total["penalty_count"], total["total_penalty"]]
+    for total in loan_totals:
+        detail = details[total["loan__customer"]]
+        detail["Loan Principal"] = [total["count"], total["total_principal"]]
+        detail["Loan Interest"] = [total["count"], total["total_interest"]]
+        detail["Loan Penalty"] = [total["penalty_count"], total["total_penalty"]]
+    return details
+
+
+@transaction.atomic
+def create_receipts(customers, user):
+    """Create this month's receipt, with all their accounts, for every customer."""
+    customers = list(customers)
+    details = get_receipt_details([customer.id for customer in customers])
+    receipts = Receipt.objects.bulk_create(
+        [
+            Receipt(customer=customer, detail=details[customer.id], created_by=user)
+            for customer in customers
+        ]
+    )
+    receipt_ids = {receipt.customer_id: receipt.id for receipt in receipts}
+    Receipt.accounts.through.objects.bulk_create(
+        [
+            Receipt.accounts.through(receipt_id=receipt_ids[customer_id], account_id=account_id)
+            for account_id, customer_id in Account.objects.filter(
+                customer__in=customers
+            ).values_list("id", "customer")
+        ]
+    )
+    return receipts
+
+
 def generate_invoice(response, invoice_obj):
     customer = invoice_obj.customer
     doc = SimpleInvoice(
@@ -190,44 +681,14 @@ def generate_invoice(response, invoice_obj):
         city=_get_customer_active_accounts(customer),
     )
 
-    # Add Item
-    this_month = datetime.today().replace(day=15).date()
-    accounts = invoice_obj.accounts.all()
-    monthly_credit_count = 0
-    monthly_penalty_count = 0
-    total_credit = 0
-    total_penalty = 0
-    for account in accounts:
-        for deposit in account.deposits.all():
-            if deposit.date == this_month:
-                monthly_credit_count += 1
-                total_credit += deposit.principal
-                total_penalty += deposit.penalty
-                if deposit.penalty > 0:
-                    monthly_penalty_count += 1
-
-    total_loan_count = 0
-    total_loan_principal = 0
-    total_loan_interest = 0
-    total_loan_penalty = 0
-    total_penalty_count = 0
-    for loan in customer.loans.all():
-        for deposit in loan.deposits.all():
-            if deposit.date == this_month:
-                total_loan_count += 1
-                total_loan_principal += deposit.principal
-                total_loan_penalty += deposit.penalty
-                total_loan_interest += deposit.interest
-                if deposit.penalty > 0:
-                    total_penalty_count += 1
+    # Receipts created in bulk already carry their details
+    details = invoice_obj.detail
+    if not details:
+        details = get_receipt_details([customer.id])[customer.id]
+        invoice_obj.detail = details
+        invoice_obj.save()
 
-    details = {
-        "Account Credit": [monthly_credit_count, total_credit],
-        "Account Penalty": [monthly_penalty_count, total_penalty],
-        "Loan Principal": [total_loan_count, total_loan_principal],
-        "Loan Interest": [total_loan_count, total_loan_interest],
-        "Loan Penalty": [total_penalty_count, total_loan_penalty],
-    }
+    # Add Item
     for key, value in details.items():
         doc.add_item(Item(key, value[0], value[1]))
 
@@ -235,56 +696,54 @@ def generate_invoice(response, invoice_obj):
 
     doc.finish()
 
-    invoice_obj.detail = details
-    invoice_obj.save()
-
 
 def get_all_installment_dates(iteration):
-    start_date = iteration.start_date
-    total_months = iteration.no_of_months
-    day = iteration.day_of_payment
-
-    months = []
-    for i in range(0, total_months):
-        months.append((start_date + relativedelta.relativedelta(months=i)).replace(day=day))
-    return months
+    return get_installment_dates(
+        iteration.start_date, iteration.no_of_months, iteration.day_of_payment
+    )
 
 
-def get_all_loan_deposit_monthwise(months):
-    all_loan_deposits = (
-        LoanDeposit.objects.filter(date__in=months)
-        .values("date")
-        .order_by("date")
-        .annotate(total_principal=Sum("principal"))
-        .annotate(total_interest=Sum("interest"))
-        .annotate(total_penalty=Sum("penalty"))
-        .annotate(total_amount=F("total_principal") + F("total_interest") + F("total_penalty"))
+def _get_version(values):
+    return "-".join(
+        str(value.timestamp()) if isinstance(value, datetime) else str(value) for value in values
     )
-    all_loan_deposits = list(all_loan_deposits)
-    return all_loan_deposits
 
 
-def get_all_account_deposit_monthwise(months):
-    all_account_deposit = (
-        AccountDeposit.objects.filter(date__in=months)
-        .values("date")
-        .order_by("date")
-        .annotate(total_principal=Sum("principal"))
-        .annotate(total_penalty=Sum("penalty"))
-        .annotate(total_amount=F("total_principal") + F("total_penalty"))
+def get_analysis_version(iteration):
+    """Changes whenever the iteration, its accounts, loans or deposits, or the month change."""
+    account_deposits = AccountDeposit.objects.filter(account__iteration=iteration).aggregate(
+        count=Count("id"), modified_at=Max("modified_at")
+    )
+    loan_deposits = LoanDeposit.objects.filter(loan__iteration=iteration).aggregate(
+        count=Count("id"), modified_at=Max("modified_at")
+    )
+    loans = iteration.loans.aggregate(count=Count("id"), modified_at=Max("modified_at"))
+    return _get_version(
+        [
+            iteration.modified_at,
+            get_snapshot_month(iteration),
+            iteration.accounts.count(),
+            loans["count"],
+            loans["modified_at"],
+            account_deposits["count"],
+            account_deposits["modified_at"],
+            loan_deposits["count"],
+            loan_deposits["modified_at"],
+        ]
     )
-    all_account_deposit = list(all_account_deposit)
-    return all_account_deposit
 
 
-def get_total_threshold_amount(iteration):
+def get_total_threshold_amount(iteration, account_count=None):
+    if account_count is None:
+        account_count = iteration.accounts.count()
     deposit_amount = iteration.deposit_amount * iteration.no_of_months
-    return (iteration.return_amount - deposit_amount) * iteration.accounts.count()
+    return (iteration.return_amount - deposit_amount) * account_count
 
 
-def get_optimum_amount(iteration):
-    _sum = 0
-    for i in range(iteration.no_of_months, 0, -1):
-        __sum = int(pow((1 + (iteration.interest_rate / 100)), i) * iteration.deposit_amount)
-        _sum += __sum
-    return (_sum - (iteration.deposit_amount * iteration.no_of_months)) * iteration.accounts.count()
+def get_optimum_amount(iteration, account_count=None):
+    if account_count is None:
+        account_count = iteration.accounts.count()
+    interest = get_optimum_interest(
+        iteration.deposit_amount, iteration.interest_rate, iteration.no_of_months
+    )
+    return interest * account_count
@@ -1,66 +1,184 @@
+from datetime import date
+
+from django.contrib import admin
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.contrib.auth.mixins import UserPassesTestMixin
+from django.core.cache import cache
+from django.http import Http404
+from django.http import JsonResponse
 from django.shortcuts import get_object_or_404
 from django.shortcuts import render
-from src.models import Iteration
+from django.utils.dateparse import parse_date
+from django.utils.decorators import method_decorator
 from django.views import View
+from django.views.decorators.cache import cache_control
+from django.views.decorators.gzip import gzip_page
+from django.views.decorators.http import etag
 
+from src.dues import get_total_months
+from src.middleware import get_slow_requests
 from src.models import Iteration
-from src.utils import get_all_account_deposit_monthwise
+from src.projection import load_iteration_state
+from src.projection import project_collections
+from src.rollups import get_monthly_collections
+from src.utils import get_address_report
 from src.utils import get_all_installment_dates
-from src.utils import get_all_loan_deposit_monthwise
+from src.utils import get_analysis_version
+from src.utils import get_iteration_terms
 from src.utils import get_optimum_amount
+from src.utils import get_snapshot_month
 from src.utils import get_total_threshold_amount
 
+# Cache keys change with every deposit, so entries only expire to free up memory.
+ANALYSIS_CACHE_TIMEOUT = 60 * 60 * 24
+# Customers moving address do not change the key, so these entries expire sooner.
+ADDRESS_REPORT_CACHE_TIMEOUT = 60 * 15
+
+
+def _add_collections(datum, pay):
+    penalty = pay["account_penalty"] + pay["loan_penalty"]
+    datum["penalty"] += penalty
+    datum["interest"] += pay["loan_interest"]
+    datum["interest_penalty"] += penalty + pay["loan_interest"]
+
+
+def get_analysis_series(iteration):
+    months = get_all_installment_dates(iteration)
+
+    collections = get_monthly_collections(iteration, months)
+    state = load_iteration_state(iteration)
+    # Iterations starting in the future, like a rollover's, have nothing due yet.
+    total_months = max(0, get_total_months(iteration.start_date, date.today()))
+    projected = project_collections(get_iteration_terms(iteration), months, total_months, state)
+    account_count = len(state.account_principal_paid)
+    threshold_paid = get_total_threshold_amount(iteration, account_count)
+    optimum_paid = get_optimum_amount(iteration, account_count)
+
+    series = {
+        "dates": [],
+        "interest": [],
+        "penalty": [],
+        "interestPlusPenalty": [],
+        "threshold": [],
+        "optimum": [],
+        "projectedInterest": [],
+        "projectedPenalty": [],
+        "projectedInterestPlusPenalty": [],
+    }
+
+    datum = {"interest": 0, "penalty": 0, "interest_penalty": 0}
+    projected_datum = dict(datum) if total_months == 0 else None
+    for index, _date in enumerate(months):
+        pay = collections.get(_date)
+        if pay is not None:
+            _add_collections(datum, pay)
+        if index == total_months - 1:
+            # The projection carries on from the last month already due.
+            projected_datum = dict(datum)
+        if _date in projected:
+            _add_collections(projected_datum, projected[_date])
+        projected_values = projected_datum or dict.fromkeys(datum)
+        series["dates"].append(_date.isoformat())
+        series["interest"].append(datum["interest"])
+        series["penalty"].append(datum["penalty"])
+        series["interestPlusPenalty"].append(datum["interest_penalty"])
+        series["projectedInterest"].append(projected_values["interest"])
+        series["projectedPenalty"].append(projected_values["penalty"])
+        series["projectedInterestPlusPenalty"].append(projected_values["interest_penalty"])
+        series["threshold"].append(threshold_paid)
+        series["optimum"].append(optimum_paid)
+    return series
+
+
+def _analysis_etag(request, iteration_id):
+    iteration = Iteration.objects.filter(pk=iteration_id).first()
+    if iteration is None:
+        return None
+    # Kept for the view, so the version's queries run once per request.
+    request.analysis_version = get_analysis_version(iteration)
+    return request.analysis_version
+
 
 class Analysis(LoginRequiredMixin, UserPassesTestMixin, View):
     login_url = "/login/"
 
+    def test_func(self):
+        return self.request.user.is_superuser
+
+    def get(self, request, iteration_id):
+        iteration = get_object_or_404(Iteration, pk=iteration_id)
+        return render(request, "src/profits.html", {"iteration": iteration})
+
+
+class AnalysisData(LoginRequiredMixin, UserPassesTestMixin, View):
+    login_url = "/login/"
+
+    def test_func(self):
+        return self.request.user.is_superuser
+
+    @method_decorator(gzip_page)
+    @method_decorator(cache_control(private=True, no_cache=True))
+    @method_decorator(etag(_analysis_etag))
+    def get(self, request, iteration_id):
+        iteration = get_object_or_404(Iteration, pk=iteration_id)
+        cache_key = f"analysis:{iteration.id}:{request.analysis_version}"
+        series = cache.get(cache_key)
+        if series is None:
+            series = get_analysis_series(iteration)
+            cache.set(cache_key, series, ANALYSIS_CACHE_TIMEOUT)
+        return JsonResponse(series)
+
+
+class AddressReport(LoginRequiredMixin, UserPassesTestMixin, View):
+    login_url = "/login/"
+
     def test_func(self):
         return self.request.user.is_superuser
 
     def get(self, request, iteration_id):
         iteration = get_object_or_404(Iteration, pk=iteration_id)
         months = get_all_installment_dates(iteration)
+        current_month = get_snapshot_month(iteration)
+        month = max([date for date in months if date <= current_month], default=months[0])
+        if request.GET.get("month"):
+            try:
+                month = parse_date(request.GET["month"])
+            except ValueError:
+                month = None
+            if month not in months:
+                raise Http404("Not an installment date of the iteration")
 
-        account_paid = get_all_account_deposit_monthwise(months)
-        loan_paid = get_all_loan_deposit_monthwise(months)
-        threshold_paid = get_total_threshold_amount(iteration)
-        optimum_paid = get_optimum_amount(iteration)
-
-        interest_data = []
-        penalty_data = []
-        interest_plus_penalty_data = []
-        threshold_data = []
-        optimum_data = []
-
-        datum = {"interest": 0, "penalty": 0, "interest_penalty": 0, "threshold": 0, "optimum": 0}
-        for _date in months:
-            for pay in account_paid:
-                if pay.get("date") == _date:
-                    datum["penalty"] += pay["total_penalty"]
-                    datum["interest_penalty"] += pay["total_penalty"]
-            datum["threshold"] = threshold_paid
-            datum["optimum"] = optimum_paid
-
-            for pay in loan_paid:
-                if pay.get("date") == _date:
-                    datum["penalty"] += pay["total_penalty"]
-                    datum["interest"] += pay["total_interest"]
-                    datum["interest_penalty"] += pay["total_penalty"] + pay["total_interest"]
-            interest_data.append({"date": _date.strftime("%m/%d/%Y"), "y": datum["interest"]})
-            penalty_data.append({"date": _date.strftime("%m/%d/%Y"), "y": datum["penalty"]})
-            interest_plus_penalty_data.append(
-                {"date": _date.strftime("%m/%d/%Y"), "y": datum["interest_penalty"]}
-            )
-            threshold_data.append({"date": _date.strftime("%m/%d/%Y"), "y": datum["threshold"]})
-            optimum_data.append({"date": _date.strftime("%m/%d/%Y"), "y": datum["optimum"]})
+        cache_key = f"address_report:{iteration.id}:{month}:{get_analysis_version(iteration)}"
+        rows = cache.get(cache_key)
+        if rows is None:
+            rows = get_address_report(iteration, month)
+            cache.set(cache_key, rows, ADDRESS_REPORT_CACHE_TIMEOUT)
+        totals = {
+            field: sum(row[field] for row in rows)
+            for field in ("accounts", "loans", "expected", "collected", "dues")
+        }
+        context = {
+            **admin.site.each_context(request),
+            "title": f"Collections by address, {iteration}",
+            "iteration": iteration,
+            "months": months,
+            "month": month,
+            "rows": rows,
+            "totals": totals,
+        }
+        return render(request, "src/address_report.html", context)
+
+
+class SlowRequests(LoginRequiredMixin, UserPassesTestMixin, View):
+    login_url = "/login/"
+
+    def test_func(self):
+        return self.request.user.is_superuser
 
+    def get(self, request):
         context = {
-            "interestData": interest_data,
-            "penaltyData": penalty_data,
-            "interestPlusPenaltyData": interest_plus_penalty_data,
-            "thresholdData": threshold_data,
-            "optimumData": optimum_data,
+            **admin.site.each_context(request),
+            "title": "Slowest requests",
+            "slow_requests": get_slow_requests(),
         }
-        return render(request, "src/profits.html", context)
+        return render(request, "src/slow_requests.html", context)